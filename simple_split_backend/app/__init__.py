@@ -1,12 +1,18 @@
 from flask import Flask, jsonify, request, send_from_directory, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
+from sqlalchemy.exc import SQLAlchemyError
 import os
+import time
 from datetime import timedelta
 
 db = SQLAlchemy()
 jwt = JWTManager()
 
+# Tentativas de criar/atualizar o esquema na inicialização (workers iniciando juntos disputam o banco)
+SCHEMA_UPGRADE_ATTEMPTS = 3
+SCHEMA_UPGRADE_RETRY_SECONDS = 1.0
+
 def create_app():
     app = Flask(__name__)
     
@@ -17,9 +23,37 @@ def create_app():
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-simple-split-secret-2025')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
     
+    # Otimização de dívidas: 'background' (fila + worker) ou 'sync' (no próprio request)
+    app.config['OPTIMIZATION_MODE'] = os.environ.get('OPTIMIZATION_MODE', 'background')
+    app.config['OPTIMIZATION_COALESCE_SECONDS'] = float(os.environ.get('OPTIMIZATION_COALESCE_SECONDS', 2.0))
+    app.config['OPTIMIZATION_POLL_SECONDS'] = float(os.environ.get('OPTIMIZATION_POLL_SECONDS', 1.0))
+    app.config['OPTIMIZATION_LEASE_SECONDS'] = float(os.environ.get('OPTIMIZATION_LEASE_SECONDS', 300.0))
+    
+    # Cache de dados derivados entre requisições: 'tiered' (LRU por processo + arquivo SQLite
+    # compartilhado pelos workers), 'memory', 'shared' ou 'none'
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'tiered')
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+    app.config['CACHE_SHARED_PATH'] = os.environ.get('CACHE_SHARED_PATH')  # padrão: instance/cache.db
+    app.config['CACHE_SHARED_MAX_ENTRIES'] = int(os.environ.get('CACHE_SHARED_MAX_ENTRIES', 20000))
+    
+    # Logging: nível global, amostragem por módulo ('app.routes.user=0.1,...') e token do
+    # cabeçalho X-Debug-Trace que liga DEBUG só para a requisição que o enviar
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+    app.config['LOG_SAMPLING'] = os.environ.get('LOG_SAMPLING', '')
+    app.config['LOG_TRACE_TOKEN'] = os.environ.get('LOG_TRACE_TOKEN')
+
+    # Divisões com pelo menos este número de devedores são gravadas como vetor de cotas
+    # (uma linha por despesa) em vez de uma dívida por membro; 0 desativa
+    app.config['SHARE_VECTOR_MIN_MEMBERS'] = int(os.environ.get('SHARE_VECTOR_MIN_MEMBERS', 200))
+    
     # Evitar redirecionamentos automáticos que quebram CORS
     app.url_map.strict_slashes = False
     
+    # Logging não bloqueante (fila + thread de escrita)
+    from app.services.logging_service import LoggingService
+    LoggingService.init_app(app)
+    logger = LoggingService.get_logger(__name__)
+    
     # Inicializar extensões
     db.init_app(app)
     jwt.init_app(app)
@@ -44,6 +78,45 @@ def create_app():
     app.register_blueprint(marketplace_bp, url_prefix='/api/marketplace')
     app.register_blueprint(user_bp, url_prefix='/api/user')
     
+    # Memoização por requisição (flask.g), descartada no teardown
+    from app.services.request_memo import RequestMemo
+    RequestMemo.init_app(app)
+    
+    # Cache entre requisições com invalidação por contadores de versão
+    from app.services.cache_service import CacheService
+    CacheService.init_app(app)
+    
+    # Comandos de linha de comando (ex.: flask optimize-all)
+    from app.commands import register_commands
+    register_commands(app)
+    
+    # Criar tabelas novas (ex.: fila de otimização, ledger de saldos) também quando servido via gunicorn
+    with app.app_context():
+        from app.models.optimization_job import OptimizationJob
+        from app.models.group_balance import GroupBalance
+        from app.models.change_counter import ChangeCounter
+        from app.models.expense_share import ExpenseShare
+        from app.models.expense_rollup import ExpenseRollup
+        from app.services.schema_service import SchemaService
+        for attempt in range(SCHEMA_UPGRADE_ATTEMPTS):
+            try:
+                SchemaService.upgrade()
+                break
+            except SQLAlchemyError as e:
+                # Outro worker pode estar criando as mesmas tabelas: as etapas são idempotentes
+                db.session.rollback()
+                if attempt == SCHEMA_UPGRADE_ATTEMPTS - 1:
+                    raise
+                logger.warning("Erro ao atualizar o esquema, tentando de novo: %s", e)
+                time.sleep(SCHEMA_UPGRADE_RETRY_SECONDS)
+    
+    # Jobs de otimização deixados por um processo anterior (os presos em execução voltam à fila pelo lease)
+    from app.services.optimization_queue import OptimizationQueue
+    try:
+        OptimizationQueue.resume(app)
+    except Exception as e:
+        logger.error("Erro ao retomar a fila de otimização: %s", e)
+    
     # Rota de compatibilidade para /api/users/profile
     from app.routes.user import get_user_profile
     app.add_url_rule('/api/users/profile', 'users_profile', get_user_profile, methods=['GET'])
@@ -98,6 +171,11 @@ def create_app():
     
     @app.route('/api/health')
     def health():
-        return jsonify({'status': 'OK', 'message': 'API funcionando!', 'timestamp': 'now'})
+        return jsonify({
+            'status': 'OK',
+            'message': 'API funcionando!',
+            'timestamp': 'now',
+            'cache': CacheService.stats()
+        })
     
     return app
\ No newline at end of file
@@ -0,0 +1,43 @@
+import click
+from app.services.log_service import LogService
+from app.services.balance_service import BalanceService
+from app.services.expense_rollup_service import ExpenseRollupService
+from app import db
+from app.models.group import Group
+
+
+def register_commands(app):
+    """Registra os comandos de linha de comando (flask <comando>)"""
+
+    @app.cli.command('optimize-all')
+    @click.option('--workers', type=int, default=None, help='Processos do pool (padrão: número de CPUs)')
+    def optimize_all(workers):
+        """Reotimiza as dívidas de todos os grupos em paralelo"""
+        result = LogService.optimize_debts_parallel(workers)
+
+        click.echo(
+            f"Otimização concluída: {result['groups']} grupos, {result['debts']} dívidas pendentes, "
+            f"{result['optimized_count']} dívidas otimizadas com {result['workers']} processos"
+        )
+        for phase, ms in result['timings_ms'].items():
+            click.echo(f"  {phase}: {ms:.1f} ms")
+
+    @app.cli.command('rebuild-balances')
+    def rebuild_balances():
+        """Reconstrói o ledger de saldos (group_balances) de todos os grupos"""
+        rebuilt = BalanceService.rebuild_all()
+        click.echo(f"Ledger de saldos reconstruído para {rebuilt} grupos")
+
+    @app.cli.command('repair-group-counters')
+    def repair_group_counters():
+        """Recalcula members_count, expenses_count e total_expenses de todos os grupos"""
+        repaired = Group.repair_counters()
+        db.session.commit()
+        click.echo(f"Contadores recalculados para {repaired} grupos")
+
+    @app.cli.command('rebuild-expense-rollups')
+    def rebuild_expense_rollups():
+        """Reconstrói os totais mensais de despesas (expense_rollups) a partir do histórico"""
+        expenses = ExpenseRollupService.rebuild()
+        db.session.commit()
+        click.echo(f"Totais mensais reconstruídos a partir de {expenses} despesas")
@@ -5,5 +5,10 @@ from .debt import Debt
 from .receivable import Receivable
 from .wallet import Wallet
 from .log import Log
+from .optimization_job import OptimizationJob
+from .group_balance import GroupBalance
+from .change_counter import ChangeCounter
+from .expense_share import ExpenseShare
+from .expense_rollup import ExpenseRollup
 
-__all__ = ['User', 'Group', 'Expense', 'Debt', 'Receivable', 'Wallet', 'Log']
\ No newline at end of file
+__all__ = ['User', 'Group', 'Expense', 'Debt', 'Receivable', 'Wallet', 'Log', 'OptimizationJob', 'GroupBalance', 'ChangeCounter', 'ExpenseShare', 'ExpenseRollup']
\ No newline at end of file
@@ -0,0 +1,23 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class ChangeCounter(db.Model):
+    __tablename__ = 'change_counters'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'object_id', name='uq_change_counters_scope_object'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    scope = db.Column(db.String(10), nullable=False)  # user, group
+    object_id = db.Column(db.String(36), nullable=False)  # ID do usuário ou do grupo
+    version = db.Column(db.Integer, default=1)  # Incrementado a cada escrita que afeta o escopo
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'scope': self.scope,
+            'object_id': self.object_id,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -2,16 +2,21 @@ from app import db
 from datetime import datetime
 import uuid
 
+# Descrição das dívidas criadas pela otimização, que pertencem ao grupo e não a uma despesa
+SETTLEMENT_DESCRIPTION = 'Acerto do grupo'
+
 class Debt(db.Model):
     __tablename__ = 'debts'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    expense_id = db.Column(db.String(36), db.ForeignKey('expenses.id'), nullable=False)
+    expense_id = db.Column(db.String(36), db.ForeignKey('expenses.id'), nullable=True, index=True)  # NULL nos acertos da otimização
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=True, index=True)  # Grupo da dívida (os acertos não têm despesa)
     debtor_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     creditor_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
+    split_amount = db.Column(db.Float, nullable=True)  # Valor original na divisão da despesa (a otimização pode reduzir amount)
     status = db.Column(db.String(20), default='pending')  # pending, paid, cancelled, sold_as_title
-    source = db.Column(db.String(20), default='group_debt')  # group_debt, purchased_title, virtual_payment
+    source = db.Column(db.String(20), default='group_debt')  # group_debt, purchased_title, virtual_payment, settlement
     due_date = db.Column(db.Date, nullable=True)
     paid_at = db.Column(db.DateTime, nullable=True)
     sold_at = db.Column(db.DateTime, nullable=True)
@@ -21,6 +26,7 @@ class Debt(db.Model):
         return {
             'id': self.id,
             'expense_id': self.expense_id,
+            'group_id': self.group_id,
             'debtor_id': self.debtor_id,
             'debtor_name': self.debtor.name if self.debtor else None,
             'creditor_id': self.creditor_id,
@@ -32,13 +38,24 @@ class Debt(db.Model):
             'paid_at': self.paid_at.isoformat() if self.paid_at else None,
             'sold_at': self.sold_at.isoformat() if self.sold_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'expense_description': self.expense.description if self.expense else None
+            'expense_description': self.description
         }
     
+    @property
+    def description(self):
+        """Descrição da despesa de origem (os acertos da otimização não têm despesa)"""
+        if self.expense:
+            return self.expense.description
+        return SETTLEMENT_DESCRIPTION if self.source == 'settlement' else None
+    
     def mark_as_paid(self):
         """Marca a dívida como paga e atualiza scores"""
+        from app.services.balance_service import BalanceService
+        
+        previous_status = self.status
         self.status = 'paid'
         self.paid_at = datetime.utcnow()
+        BalanceService.record_debt_status(self, previous_status, self.status)
         
         # Atualizar scores
         self.debtor.update_score(payment_on_time=True)
@@ -48,15 +65,76 @@ class Debt(db.Model):
     
     def cancel(self):
         """Cancela a dívida"""
+        from app.services.balance_service import BalanceService
+        
+        previous_status = self.status
         self.status = 'cancelled'
+        BalanceService.record_debt_status(self, previous_status, self.status)
         db.session.commit()
     
+    @classmethod
+    def bulk_cancel(cls, debt_ids, chunk_size=500):
+        """
+        Cancela várias dívidas com UPDATE em massa (sem commit; o chamador controla a transação).
+        Os objetos já carregados na sessão não são sincronizados: o commit os expira.
+        """
+        debt_ids = list(debt_ids)
+        for start in range(0, len(debt_ids), chunk_size):
+            chunk = debt_ids[start:start + chunk_size]
+            cls.query.filter(cls.id.in_(chunk)).update(
+                {'status': 'cancelled'},
+                synchronize_session=False
+            )
+        return len(debt_ids)
+    
+    @classmethod
+    def bulk_update_amounts(cls, amounts_by_id):
+        """Atualiza o valor de várias dívidas em um único executemany (sem commit)"""
+        if not amounts_by_id:
+            return 0
+        db.session.execute(
+            db.update(cls),
+            [{'id': debt_id, 'amount': amount} for debt_id, amount in amounts_by_id.items()]
+        )
+        return len(amounts_by_id)
+    
+    @classmethod
+    def repair_groups(cls):
+        """
+        Preenche group_id das dívidas antigas a partir da despesa e solta os acertos da
+        otimização da despesa que usavam como referência (sem commit). Retorna quantas foram corrigidas.
+        """
+        from app.models.expense import Expense
+
+        expense_group = db.select(Expense.group_id).where(Expense.id == cls.expense_id).scalar_subquery()
+        repaired = db.session.execute(
+            db.update(cls).where(cls.group_id.is_(None)).values(group_id=expense_group),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        db.session.execute(
+            db.update(cls).where(cls.source == 'settlement', cls.expense_id.isnot(None)).values(expense_id=None),
+            execution_options={'synchronize_session': False}
+        )
+        return repaired
+
     @classmethod
     def get_pending_debts(cls, **kwargs):
         """Buscar apenas dívidas verdadeiramente pendentes (excluindo vendidas como títulos)"""
         return cls.query.filter_by(status='pending', **kwargs)
     
+    @classmethod
+    def get_user_pending_debts(cls, debtor_id=None, creditor_id=None):
+        """
+        Dívidas pendentes do usuário como devedor e/ou credor, incluindo as cotas de grupos
+        grandes ainda em vetor (PendingShare, somente leitura)
+        """
+        from app.services.share_vector_service import ShareVectorService
+        
+        filters = {key: value for key, value in (('debtor_id', debtor_id), ('creditor_id', creditor_id)) if value}
+        debts = cls.get_pending_debts(**filters).all()
+        return debts + ShareVectorService.user_pending_debts(debtor_id, creditor_id)
+    
     @classmethod 
     def get_available_for_sale_debts(cls, creditor_id):
         """Buscar dívidas que podem ser vendidas no marketplace (apenas pending)"""
-        return cls.query.filter_by(creditor_id=creditor_id, status='pending')
\ No newline at end of file
+        return cls.query.filter_by(creditor_id=creditor_id, status='pending')
@@ -4,6 +4,10 @@ import uuid
 
 class Expense(db.Model):
     __tablename__ = 'expenses'
+    __table_args__ = (
+        # Histórico do grupo paginado por (created_at, id)
+        db.Index('ix_expenses_group_created', 'group_id', 'created_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False)
@@ -15,6 +19,7 @@ class Expense(db.Model):
     
     # Relacionamentos
     debts = db.relationship('Debt', backref='expense', cascade='all, delete-orphan')
+    share = db.relationship('ExpenseShare', backref='expense', uselist=False, cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -29,34 +34,42 @@ class Expense(db.Model):
             'debts': [debt.to_dict() for debt in self.debts]
         }
     
-    def split_expense(self, member_ids=None):
-        """Divide a despesa entre os membros do grupo"""
+    def split_expense(self, member_ids=None, split_type='equal', shares=None):
+        """
+        Divide a despesa e registra o valor pago no ledger de saldos. Divisão igual entre member_ids
+        (padrão: todos do grupo) ou, com split_type weighted, exact ou percentage, pelas partes de
+        shares ({user_id: valor}). Levanta SplitError antes de gravar qualquer coisa.
+        """
+        from app.models.group import Group
+        from app.services.balance_service import BalanceService
+        from app.services.cache_service import CacheService
+        from app.services.expense_rollup_service import ExpenseRollupService
+        from app.services.split_service import SplitService
+        
         # Se não especificou membros, divide entre todos do grupo
-        if not member_ids:
+        if not member_ids and split_type == 'equal':
             from app.models.user import GroupMember
             group_members = GroupMember.query.filter_by(group_id=self.group_id).all()
             member_ids = [member.user_id for member in group_members]
         
-        # Remove o pagador da lista se ele estiver incluído
-        if self.payer_id in member_ids:
-            member_ids.remove(self.payer_id)
-        
-        if not member_ids:
-            return  # Ninguém deve nada
-        
-        # Calcula o valor que cada um deve
-        amount_per_person = self.amount / (len(member_ids) + 1)  # +1 para incluir o pagador
+        expense = {
+            'id': self.id,
+            'group_id': self.group_id,
+            'payer_id': self.payer_id,
+            'amount': self.amount,
+            'date': self.date,
+            'created_at': self.created_at,
+            'member_ids': member_ids or [],
+            'split_type': split_type,
+            'shares': shares
+        }
+        debt_rows, share_rows, participants, parts = SplitService.split_rows([expense], self.group_id)
         
-        # Criar dívidas
-        from app.models.debt import Debt
-        for debtor_id in member_ids:
-            debt = Debt(
-                expense_id=self.id,
-                debtor_id=debtor_id,
-                creditor_id=self.payer_id,
-                amount=amount_per_person,
-                status='pending'
-            )
-            db.session.add(debt)
+        BalanceService.record_expense(self, parts[self.id])
+        Group.adjust_counters(self.group_id, expenses=1, amount=self.amount)
+        ExpenseRollupService.record([expense], parts)
+        SplitService.insert(debt_rows, share_rows)
+        # INSERTs em massa não passam pelo flush: versionar explicitamente os afetados
+        CacheService.touch(participants, [self.group_id])
         
         db.session.commit()
\ No newline at end of file
@@ -0,0 +1,35 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class ExpenseRollup(db.Model):
+    """
+    Totais mensais de despesas por usuário e grupo, mantidos nas escritas de despesas.
+    Os cartões de resumo somam poucas linhas desta tabela em vez de percorrer o histórico.
+    """
+    __tablename__ = 'expense_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'group_id', 'month', name='uq_expense_rollups_user_group_month'),
+        # Total do mês dos grupos do usuário
+        db.Index('ix_expense_rollups_group_month', 'group_id', 'month'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False)
+    month = db.Column(db.Date, nullable=False)  # Primeiro dia do mês da despesa
+    paid_cents = db.Column(db.Integer, default=0)  # Soma em centavos das despesas pagas pelo usuário no grupo e mês
+    paid_count = db.Column(db.Integer, default=0)  # Número de despesas pagas pelo usuário no grupo e mês
+    spent_cents = db.Column(db.Integer, default=0)  # Parte do usuário nas despesas em centavos (como pagador ou devedor)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'group_id': self.group_id,
+            'month': self.month.isoformat() if self.month else None,
+            'paid_total': (self.paid_cents or 0) / 100,
+            'paid_count': self.paid_count,
+            'spent_total': (self.spent_cents or 0) / 100,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,38 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class ExpenseShare(db.Model):
+    """
+    Divisão compacta de uma despesa de grupo grande: uma linha por despesa no lugar de
+    uma dívida por membro. Os participantes são um bitmap indexado por GroupMember.position;
+    a parte de cada um é unit_amount * peso (centavos exatos quando há pesos). Posições em
+    closed já saíram do vetor (viraram dívidas ou foram absorvidas pela otimização).
+    """
+    __tablename__ = 'expense_shares'
+    __table_args__ = (
+        # Vetores com cotas pendentes de um grupo
+        db.Index('ix_expense_shares_group_open', 'group_id', 'open_count'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    expense_id = db.Column(db.String(36), db.ForeignKey('expenses.id'), nullable=False, unique=True)
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False)
+    creditor_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
+    unit_amount = db.Column(db.Float, nullable=False)  # Valor de uma cota de peso 1
+    participants = db.Column(db.LargeBinary, nullable=False)  # Bitmap (little-endian) das posições dos devedores
+    weights = db.Column(db.LargeBinary, nullable=True)  # Pesos uint32 na ordem das posições (centavos nas divisões não iguais); NULL = todos 1
+    closed = db.Column(db.LargeBinary, nullable=False, default=b'')  # Bitmap das posições que saíram do vetor
+    open_count = db.Column(db.Integer, nullable=False, default=0)  # Cotas ainda pendentes no vetor
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'expense_id': self.expense_id,
+            'group_id': self.group_id,
+            'creditor_id': self.creditor_id,
+            'unit_amount': self.unit_amount,
+            'open_count': self.open_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
@@ -1,7 +1,11 @@
 from app import db
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 import uuid
 
+# Tentativas de adicionar um membro quando uma entrada simultânea ocupa a mesma posição no grupo
+ADD_MEMBER_RETRIES = 5
+
 class Group(db.Model):
     __tablename__ = 'groups'
     
@@ -12,6 +16,12 @@ class Group(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Contadores desnormalizados para o card do grupo (atualizados na mesma transação
+    # de add_member, split_expense e delete_expense; corrigíveis com flask repair-group-counters)
+    members_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    expenses_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_expenses = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    
     # Relacionamentos
     creator = db.relationship('User', backref='created_groups')
     members = db.relationship('GroupMember', backref='group', cascade='all, delete-orphan')
@@ -25,29 +35,103 @@ class Group(db.Model):
             'created_by': self.created_by,
             'creator_name': self.creator.name if self.creator else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'members_count': len(self.members),
-            'expenses_count': len(self.expenses),
-            'total_expenses': sum([expense.amount for expense in self.expenses])
+            'members_count': self.members_count,
+            'expenses_count': self.expenses_count,
+            'total_expenses': self.total_expenses
         }
     
+    @classmethod
+    def adjust_counters(cls, group_id, members=0, expenses=0, amount=0.0):
+        """Soma aos contadores do grupo com um UPDATE atômico (sem commit)"""
+        db.session.execute(
+            db.update(cls).where(cls.id == group_id).values(
+                members_count=cls.members_count + members,
+                expenses_count=cls.expenses_count + expenses,
+                total_expenses=cls.total_expenses + amount
+            )
+        )
+    
+    @classmethod
+    def repair_counters(cls, group_ids=None):
+        """
+        Recalcula os contadores a partir de group_members e expenses (sem commit).
+        Sem group_ids, corrige todos os grupos. Retorna quantos grupos foram atualizados.
+        """
+        from app.models.user import GroupMember
+        from app.models.expense import Expense
+        
+        members = db.select(db.func.count(GroupMember.id))\
+            .where(GroupMember.group_id == cls.id).scalar_subquery()
+        expenses = db.select(db.func.count(Expense.id))\
+            .where(Expense.group_id == cls.id).scalar_subquery()
+        total = db.select(db.func.coalesce(db.func.sum(Expense.amount), 0.0))\
+            .where(Expense.group_id == cls.id).scalar_subquery()
+        
+        stmt = db.update(cls).values(members_count=members, expenses_count=expenses, total_expenses=total)
+        if group_ids is not None:
+            stmt = stmt.where(cls.id.in_(list(group_ids)))
+        return db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+    
+    @classmethod
+    def load_with_details(cls, group_id):
+        """
+        Carrega o grupo com criador, membros, despesas e dívidas das despesas em um número
+        fixo de consultas, independente do tamanho do grupo.
+        """
+        from app.models.expense import Expense
+        
+        return cls.query.options(
+            db.joinedload(cls.creator),
+            db.selectinload(cls.members),
+            db.selectinload(cls.expenses).selectinload(Expense.debts)
+        ).filter_by(id=group_id).first()
+    
     def get_members(self):
         """Retorna lista de membros do grupo"""
-        from app.models.user import User
-        return [User.query.get(member.user_id) for member in self.members]
+        from app.services.request_memo import RequestMemo
+        # Uma única consulta para todos os membros ainda não carregados
+        users = RequestMemo.get_users([member.user_id for member in self.members])
+        return [users[member.user_id] for member in self.members]
     
     def add_member(self, user_id):
-        """Adiciona um membro ao grupo"""
+        """
+        Adiciona um membro ao grupo na próxima posição livre. Se outra entrada simultânea
+        ocupar a mesma posição (índice único), desfaz e tenta de novo com a posição relida.
+        Espera que o chamador já tenha feito commit do que estava pendente na sessão.
+        """
         from app.models.user import GroupMember
+        from app.services.balance_service import BalanceService
+        from app.services.request_memo import RequestMemo
         
-        # Verificar se já é membro
-        existing_member = GroupMember.query.filter_by(
-            user_id=user_id, 
-            group_id=self.id
-        ).first()
-        
-        if not existing_member:
-            new_member = GroupMember(user_id=user_id, group_id=self.id)
+        for attempt in range(ADD_MEMBER_RETRIES):
+            # Verificar se já é membro
+            existing_member = GroupMember.query.filter_by(
+                user_id=user_id, 
+                group_id=self.id
+            ).first()
+            if existing_member:
+                return False
+            
+            last_position = db.session.query(db.func.max(GroupMember.position))\
+                .filter(GroupMember.group_id == self.id).scalar()
+            new_member = GroupMember(
+                user_id=user_id,
+                group_id=self.id,
+                position=0 if last_position is None else last_position + 1
+            )
             db.session.add(new_member)
+            try:
+                db.session.flush()
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == ADD_MEMBER_RETRIES - 1:
+                    raise
+                continue
+            
+            Group.adjust_counters(self.id, members=1)
+            
+            # A cota de cada membro muda e pagamentos virtuais com o novo membro passam a contar
+            BalanceService.rebuild_group(self.id)
             db.session.commit()
+            RequestMemo.invalidate('user_group_ids')
             return True
-        return False
\ No newline at end of file
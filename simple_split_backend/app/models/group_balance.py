@@ -0,0 +1,31 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class GroupBalance(db.Model):
+    __tablename__ = 'group_balances'
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'user_id', name='uq_group_balances_group_user'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False, index=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
+    paid_total = db.Column(db.Float, default=0.0)  # Soma das despesas pagas pelo membro no grupo
+    share_total = db.Column(db.Float, default=0.0)  # Soma das partes do membro nas despesas do grupo (pela divisão de cada uma)
+    adjustment = db.Column(db.Float, default=0.0)  # Correções de pagamentos via wallet, virtuais e títulos vendidos
+    balance = db.Column(db.Float, default=0.0)  # Saldo líquido (positivo = recebe, negativo = paga)
+    version = db.Column(db.Integer, default=1)  # Incrementado a cada alteração no grupo
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'group_id': self.group_id,
+            'user_id': self.user_id,
+            'paid_total': self.paid_total,
+            'share_total': self.share_total,
+            'adjustment': self.adjustment,
+            'balance': self.balance,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,44 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class OptimizationJob(db.Model):
+    __tablename__ = 'optimization_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, done, failed
+    user_ids = db.Column(db.Text, nullable=True)  # Usuários afetados separados por vírgula (vazio = grupo inteiro)
+    trigger_count = db.Column(db.Integer, default=1)  # Quantos disparos foram agrupados neste job
+    optimized_count = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'status': self.status,
+            'trigger_count': self.trigger_count,
+            'optimized_count': self.optimized_count,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def get_user_ids(self):
+        """Retorna a lista de usuários afetados, ou None para o grupo inteiro"""
+        return self.user_ids.split(',') if self.user_ids else None
+    
+    def merge_user_ids(self, user_ids):
+        """Agrupa os usuários de um novo disparo neste job"""
+        if not self.user_ids or not user_ids:
+            # Algum disparo pediu o grupo inteiro
+            self.user_ids = None
+            return
+        merged = set(self.user_ids.split(',')) | set(user_ids)
+        self.user_ids = ','.join(sorted(merged))
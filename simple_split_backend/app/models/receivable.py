@@ -1,7 +1,10 @@
 from app import db
+from app.services.logging_service import LoggingService
 from datetime import datetime
 import uuid
 
+logger = LoggingService.get_logger(__name__)
+
 class Receivable(db.Model):
     __tablename__ = 'receivables'
     
@@ -68,6 +71,7 @@ class Receivable(db.Model):
     def sell_to_buyer(self, buyer_id):
         """Vende o título para um comprador"""
         from app.models.debt import Debt
+        from app.services.balance_service import BalanceService
         
         try:
             # Atualizar status
@@ -77,7 +81,7 @@ class Receivable(db.Model):
             
             if self.consolidated_group_id:
                 # Título consolidado: transferir todas as dívidas deste devedor
-                print(f"[DEBUG] Looking for debts to transfer: creditor={self.owner_id}, debtor={self.consolidated_group_id}")
+                logger.debug("Looking for debts to transfer: creditor=%s, debtor=%s", self.owner_id, self.consolidated_group_id)
                 
                 debts_to_transfer = Debt.query.filter_by(
                     creditor_id=self.owner_id,
@@ -85,12 +89,13 @@ class Receivable(db.Model):
                     status='pending'
                 ).all()
                 
-                print(f"[DEBUG] Found {len(debts_to_transfer)} debts to transfer")
+                logger.debug("Found %s debts to transfer", len(debts_to_transfer))
                 for i, debt in enumerate(debts_to_transfer):
-                    print(f"[DEBUG] Transferring debt {i+1}: {debt.id} (R$ {debt.amount})")
+                    logger.debug("Transferring debt %s: %s (R$ %s)", i + 1, debt.id, debt.amount)
                     # Criar uma nova dívida para o comprador
                     new_debt = Debt(
                         expense_id=debt.expense_id,
+                        group_id=debt.group_id,
                         debtor_id=debt.debtor_id,
                         creditor_id=buyer_id,
                         amount=debt.amount,
@@ -103,15 +108,17 @@ class Receivable(db.Model):
                     # Marcar a dívida original como vendida
                     debt.status = 'sold_as_title'
                     debt.sold_at = datetime.utcnow()
+                    BalanceService.record_debt_status(debt, 'pending', debt.status)
                     
-                print(f"[DEBUG] Transferred {len(debts_to_transfer)} debts from {self.consolidated_group_id} to {buyer_id}")
+                logger.debug("Transferred %s debts from %s to %s", len(debts_to_transfer), self.consolidated_group_id, buyer_id)
             elif self.debt:
                 # Título individual: criar nova dívida para o comprador
-                print(f"[DEBUG] Transferring individual debt {self.debt.id} to buyer {buyer_id}")
+                logger.debug("Transferring individual debt %s to buyer %s", self.debt.id, buyer_id)
                 
                 # Criar nova dívida para o comprador
                 new_debt = Debt(
                     expense_id=self.debt.expense_id,
+                    group_id=self.debt.group_id,
                     debtor_id=self.debt.debtor_id,
                     creditor_id=buyer_id,
                     amount=self.debt.amount,
@@ -122,13 +129,15 @@ class Receivable(db.Model):
                 db.session.add(new_debt)
                 
                 # Marcar a dívida original como vendida
+                previous_status = self.debt.status
                 self.debt.status = 'sold_as_title'
                 self.debt.sold_at = datetime.utcnow()
+                BalanceService.record_debt_status(self.debt, previous_status, self.debt.status)
             else:
-                print(f"[DEBUG] No consolidated_group_id or individual debt found, nothing to transfer")
+                logger.debug("No consolidated_group_id or individual debt found, nothing to transfer")
             
             # Não commitamos aqui, deixamos o marketplace.py gerenciar a transação
             return True
         except Exception as e:
-            print(f"[ERROR] Error in sell_to_buyer: {str(e)}")
+            logger.error("Error in sell_to_buyer: %s", e)
             return False
\ No newline at end of file
@@ -57,5 +57,10 @@ class GroupMember(db.Model):
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     group_id = db.Column(db.String(36), db.ForeignKey('groups.id'), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Posição estável do membro no grupo (bit do membro nos vetores de cotas de expense_shares)
+    position = db.Column(db.Integer, nullable=True)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'group_id', name='unique_user_group'),)
\ No newline at end of file
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'group_id', name='unique_user_group'),
+        db.Index('ux_group_members_position', 'group_id', 'position', unique=True),
+    )
\ No newline at end of file
@@ -3,8 +3,10 @@ from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identi
 from app import db
 from app.models.user import User
 from app.models.wallet import Wallet
+from app.services.logging_service import LoggingService
 
 auth_bp = Blueprint('auth', __name__)
+logger = LoggingService.get_logger(__name__)
 
 @auth_bp.route('/health', methods=['GET'])
 def health():
@@ -89,11 +91,11 @@ def verify_2fa():
 @jwt_required()
 def get_profile():
     """Obter perfil do usuário logado"""
-    print(f"[DEBUG] Acessando /api/auth/profile")
+    logger.debug("Acessando /api/auth/profile")
     user_id = get_jwt_identity()
-    print(f"[DEBUG] User ID do token: {user_id}")
+    logger.debug("User ID do token: %s", user_id)
     user = User.query.get(user_id)
-    print(f"[DEBUG] Usuário encontrado: {user.name if user else 'Não encontrado'}")
+    logger.debug("Usuário encontrado: %s", user.name if user else 'Não encontrado')
     
     if not user:
         return jsonify({'error': 'Usuário não encontrado'}), 404
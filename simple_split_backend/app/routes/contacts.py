@@ -17,8 +17,8 @@ def get_contacts():
     # ou estão no mesmo grupo
     
     # Buscar usuários que têm dívidas com o usuário atual (excluindo vendidas)
-    debts_as_creditor = Debt.get_pending_debts(creditor_id=user_id).all()
-    debts_as_debtor = Debt.get_pending_debts(debtor_id=user_id).all()
+    debts_as_creditor = Debt.get_user_pending_debts(creditor_id=user_id)
+    debts_as_debtor = Debt.get_user_pending_debts(debtor_id=user_id)
     
     contact_ids = set()
     for debt in debts_as_creditor:
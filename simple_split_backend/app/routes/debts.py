@@ -4,18 +4,26 @@ from app import db
 from app.models.debt import Debt
 from app.models.user import User
 from app.models.receivable import Receivable
+from app.services.balance_service import BalanceService
+from app.services.request_memo import RequestMemo
+from app.services.cache_service import CacheService
+from app.services.etag_service import EtagService
+from app.services.share_vector_service import ShareVectorService
+from app.services.logging_service import LoggingService
 
 debts_bp = Blueprint('debts', __name__)
+logger = LoggingService.get_logger(__name__)
 
 @debts_bp.route('/', methods=['GET'])
 @jwt_required()
+@EtagService.conditional(EtagService.user_scoped('debts'))
 def get_user_debts():
     """Obter todas as dívidas do usuário (consolidadas por devedor/credor)"""
     user_id = get_jwt_identity()
     
     # Buscar dívidas onde o usuário é devedor ou credor (apenas pendentes)
-    debts_as_debtor = Debt.get_pending_debts(debtor_id=user_id).all()
-    debts_as_creditor = Debt.get_pending_debts(creditor_id=user_id).all()
+    debts_as_debtor = Debt.get_user_pending_debts(debtor_id=user_id)
+    debts_as_creditor = Debt.get_user_pending_debts(creditor_id=user_id)
     
     # Converter para dicionário com informações extras
     debts_data = []
@@ -27,7 +35,7 @@ def get_user_debts():
         debt_dict['amount'] = -abs(debt_dict['amount'])  # valor negativo
         debt_dict['other_user'] = debt.creditor.name
         debt_dict['other_user_id'] = debt.creditor_id
-        debt_dict['expense_description'] = debt.expense.description if debt.expense else 'Despesa removida'
+        debt_dict['expense_description'] = debt.description or 'Despesa removida'
         debts_data.append(debt_dict)
     
     # Dívidas onde devem ao usuário - CONSOLIDAR POR DEVEDOR
@@ -58,7 +66,7 @@ def get_user_debts():
         consolidated_debts[debtor_id]['total_amount'] += amount
         consolidated_debts[debtor_id]['debtor_name'] = debt.debtor.name
         consolidated_debts[debtor_id]['debtor_id'] = debtor_id
-        consolidated_debts[debtor_id]['descriptions'].append(debt.expense.description if debt.expense else 'Despesa removida')
+        consolidated_debts[debtor_id]['descriptions'].append(debt.description or 'Despesa removida')
         consolidated_debts[debtor_id]['debt_ids'].append(str(debt.id))
         
         if is_purchased:
@@ -114,23 +122,18 @@ def get_user_debts():
 @jwt_required()
 def get_consolidated_debts():
     """Obter dívidas consolidadas por usuário em todos os grupos (para marketplace)"""
-    from app.models.user import GroupMember
     from app.models.expense import Expense
     from collections import defaultdict
     
     user_id = get_jwt_identity()
     
-    # Buscar todos os grupos do usuário
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
     # Consolidar saldos por usuário em todos os grupos
     global_balances = defaultdict(float)
     
-    for group_member in user_groups:
-        group_id = group_member.group_id
-        
-        # Calcular saldos do grupo usando a mesma lógica da otimização
-        group_balances = _calculate_group_balances(group_id)
+    # Saldos de todos os grupos do usuário em uma única consulta (mesma lógica da otimização)
+    balances_by_group = BalanceService.pending_user_group_balances(user_id)
+    
+    for group_balances in balances_by_group.values():
         
         # Somar os saldos de cada usuário globalmente
         for other_user_id, balance in group_balances.items():
@@ -160,11 +163,11 @@ def get_consolidated_debts():
             
             # Se já existe recebível ativo (à venda ou vendido), pular esta dívida
             if existing_receivable or sold_receivable:
-                print(f"[DEBUG] Skipping debt for {debtor_id} - already has receivable")
+                logger.debug("Skipping debt for %s - already has receivable", debtor_id)
                 continue
                 
             # Buscar informações do devedor
-            debtor = User.query.get(debtor_id)
+            debtor = RequestMemo.get_user(debtor_id)
             if not debtor:
                 continue
                 
@@ -191,62 +194,38 @@ def get_consolidated_debts():
 
 def _calculate_group_balances(group_id):
     """Calcula o saldo líquido de cada membro do grupo baseado apenas em dívidas PENDENTES"""
-    from app.models.user import GroupMember
-    from collections import defaultdict
-    
-    # Buscar membros do grupo
-    members = GroupMember.query.filter_by(group_id=group_id).all()
-    if len(members) == 0:
-        return {}
-    
-    # NOVA LÓGICA: Calcular com base apenas em dívidas PENDENTES
-    balances = defaultdict(float)
-    
-    # Buscar todas as dívidas pendentes relacionadas a este grupo
-    # (dívidas entre membros deste grupo)
-    member_ids = [member.user_id for member in members]
-    
-    pending_debts = Debt.get_pending_debts().filter(
-        Debt.creditor_id.in_(member_ids),
-        Debt.debtor_id.in_(member_ids)
-    ).all()
-    
-    # Calcular saldos baseado nas dívidas pendentes
-    for debt in pending_debts:
-        # Creditor tem saldo positivo (deve receber)
-        balances[debt.creditor_id] += debt.amount
-        # Debtor tem saldo negativo (deve pagar)  
-        balances[debt.debtor_id] -= debt.amount
-    
-    # Converter para dict normal e garantir que todos os membros estejam presentes
-    final_balances = {}
-    for member in members:
-        final_balances[member.user_id] = balances.get(member.user_id, 0.0)
-    
-    return final_balances
+    return BalanceService.pending_group_balances(group_id)
 
 @debts_bp.route('/summary', methods=['GET'])
 @jwt_required()
+@EtagService.conditional(EtagService.user_scoped('debts_summary'))
 def get_debts_summary():
     """Obter resumo das dívidas do usuário"""
     user_id = get_jwt_identity()
     
+    # Resultado em cache até a próxima escrita que afete o usuário
+    summary = CacheService.for_user('debts_summary', user_id, lambda: _build_debts_summary(user_id))
+    return jsonify(summary)
+
+
+def _build_debts_summary(user_id):
+    """Calcula o resumo das dívidas do usuário"""
     # Calcular totais (apenas dívidas pendentes)
-    debts_as_debtor = Debt.get_pending_debts(debtor_id=user_id).all()
-    debts_as_creditor = Debt.get_pending_debts(creditor_id=user_id).all()
+    debts_as_debtor = Debt.get_user_pending_debts(debtor_id=user_id)
+    debts_as_creditor = Debt.get_user_pending_debts(creditor_id=user_id)
     
     total_owe = sum(debt.amount for debt in debts_as_debtor)  # o que devo
     total_owed = sum(debt.amount for debt in debts_as_creditor)  # o que me devem
     
     net_balance = total_owed - total_owe  # saldo líquido
     
-    return jsonify({
+    return {
         'total_owe': float(total_owe),
         'total_owed': float(total_owed),
         'net_balance': float(net_balance),
         'debts_count': len(debts_as_debtor),
         'credits_count': len(debts_as_creditor)
-    })
+    }
 
 @debts_bp.route('/<debt_id>/pay', methods=['POST'])
 @jwt_required()
@@ -254,7 +233,7 @@ def pay_debt(debt_id):
     """Marcar dívida como paga"""
     user_id = get_jwt_identity()
     
-    debt = Debt.query.get(debt_id)
+    debt = ShareVectorService.find_debt(debt_id)
     if not debt:
         return jsonify({'error': 'Dívida não encontrada'}), 404
     
@@ -262,6 +241,11 @@ def pay_debt(debt_id):
     if debt.debtor_id != user_id:
         return jsonify({'error': 'Você não pode pagar esta dívida'}), 403
     
+    # Cota ainda em vetor vira dívida só agora, para ser paga
+    debt = ShareVectorService.materialize_debt(debt)
+    if not debt:
+        return jsonify({'error': 'Dívida não encontrada'}), 404
+    
     # Marcar como paga
     debt.mark_as_paid()
     
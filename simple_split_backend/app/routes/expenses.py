@@ -4,6 +4,8 @@ from app import db
 from app.models.expense import Expense
 from app.models.group import Group
 from app.models.user import GroupMember
+from app.models.expense_rollup import ExpenseRollup
+from app.services.expense_rollup_service import ExpenseRollupService
 from datetime import datetime, timedelta
 
 expenses_bp = Blueprint('expenses', __name__)
@@ -73,29 +75,26 @@ def get_expenses_summary():
     user_id = get_jwt_identity()
     
     # Buscar grupos do usuário
-    user_groups = db.session.query(GroupMember.group_id).filter_by(user_id=user_id).subquery()
+    user_groups = db.select(GroupMember.group_id).where(GroupMember.user_id == user_id)
     
-    # Calcular totais
+    # Totais a partir do mês atual, somados na tabela de totais mensais
     current_month = datetime.now().replace(day=1).date()
     
-    # Total gasto no mês atual
-    monthly_expenses = Expense.query.join(Group, Expense.group_id == Group.id)\
-                                   .filter(Group.id.in_(user_groups))\
-                                   .filter(Expense.date >= current_month)\
-                                   .all()
-    
-    total_monthly = sum(expense.amount for expense in monthly_expenses)
+    # Total gasto nos grupos do usuário (todos os pagadores)
+    total_monthly, monthly_count, _ = ExpenseRollupService.totals(
+        ExpenseRollup.group_id.in_(user_groups),
+        ExpenseRollup.month >= current_month
+    )
     
     # Total de despesas pagas pelo usuário
-    user_paid_expenses = Expense.query.filter_by(payer_id=user_id)\
-                                     .filter(Expense.date >= current_month)\
-                                     .all()
-    
-    total_paid = sum(expense.amount for expense in user_paid_expenses)
+    total_paid, user_paid_count, _ = ExpenseRollupService.totals(
+        ExpenseRollup.user_id == user_id,
+        ExpenseRollup.month >= current_month
+    )
     
     return jsonify({
         'monthly_total': float(total_monthly),
         'user_paid_total': float(total_paid),
-        'monthly_count': len(monthly_expenses),
-        'user_paid_count': len(user_paid_expenses)
+        'monthly_count': monthly_count,
+        'user_paid_count': user_paid_count
     })
\ No newline at end of file
@@ -1,12 +1,22 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from collections import defaultdict
 from app import db
 from app.models.user import User, GroupMember
 from app.models.group import Group
 from app.models.expense import Expense
 from app.models.debt import Debt
+from app.models.expense_share import ExpenseShare
 from app.services.log_service import LogService
+from app.services.optimization_queue import OptimizationQueue
+from app.services.balance_service import BalanceService
+from app.services.request_memo import RequestMemo
+from app.services.pagination_service import PaginationService, InvalidCursor
+from app.services.cache_service import CacheService
+from app.services.etag_service import EtagService
+from app.services.expense_import_service import ExpenseImportService, ExpenseImportError
+from app.services.expense_rollup_service import ExpenseRollupService
+from app.services.share_vector_service import ShareVectorService
+from app.services.split_service import SplitService, SplitError
 from datetime import datetime
 
 groups_bp = Blueprint('groups', __name__)
@@ -14,16 +24,58 @@ groups_bp = Blueprint('groups', __name__)
 @groups_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_user_groups():
-    """Obter grupos do usuário"""
+    """
+    Obter grupos do usuário em uma única consulta (colunas do card, sem carregar membros
+    ou despesas). Parâmetros opcionais: sort=recent (atividade mais recente primeiro),
+    limit e cursor (paginação por keyset; a resposta traz next_cursor e has_more).
+    """
     user_id = get_jwt_identity()
     
-    # Buscar grupos onde o usuário é membro
-    memberships = GroupMember.query.filter_by(user_id=user_id).all()
-    groups = [Group.query.get(membership.group_id) for membership in memberships]
-    
-    return jsonify({
-        "groups": [group.to_dict() for group in groups if group]
-    })
+    creator = db.aliased(User)
+    query = db.session.query(
+        Group.id, Group.name, Group.description, Group.created_by, Group.created_at,
+        Group.updated_at, Group.members_count, Group.expenses_count, Group.total_expenses,
+        creator.name.label('creator_name')
+    ).join(GroupMember, GroupMember.group_id == Group.id)\
+        .outerjoin(creator, creator.id == Group.created_by)\
+        .filter(GroupMember.user_id == user_id)
+    
+    # Atividade: updated_at muda a cada despesa ou membro (contadores do grupo)
+    if request.args.get('sort') == 'recent':
+        columns, descending = [Group.updated_at, Group.id], True
+    else:
+        columns, descending = [Group.id], False
+    
+    paginate = 'limit' in request.args or 'cursor' in request.args
+    if paginate:
+        try:
+            rows, next_cursor = PaginationService.keyset_page(
+                query, columns, PaginationService.page_size(request.args.get('limit')),
+                request.args.get('cursor'), descending=descending
+            )
+        except InvalidCursor:
+            return jsonify({'error': 'Cursor inválido'}), 400
+    else:
+        order = [column.desc() if descending else column.asc() for column in columns]
+        rows = query.order_by(*order).all()
+    
+    response = {
+        "groups": [{
+            'id': row.id,
+            'name': row.name,
+            'description': row.description,
+            'created_by': row.created_by,
+            'creator_name': row.creator_name,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'members_count': row.members_count,
+            'expenses_count': row.expenses_count,
+            'total_expenses': row.total_expenses
+        } for row in rows]
+    }
+    if paginate:
+        response['next_cursor'] = next_cursor
+        response['has_more'] = next_cursor is not None
+    return jsonify(response)
 
 @groups_bp.route('/', methods=['POST'])
 @jwt_required()
@@ -52,66 +104,43 @@ def create_group():
         'group': group.to_dict()
     }), 201
 
+def _group_detail_etag(group_id):
+    """ETag do detalhe do grupo (só para membros; os demais seguem para o 403)"""
+    if not RequestMemo.is_member(get_jwt_identity(), group_id):
+        return None
+    return EtagService.make_etag('group_detail', group_id, CacheService.group_scope_version(group_id))
+
 @groups_bp.route('/<string:group_id>', methods=['GET'])
 @jwt_required()
+@EtagService.conditional(_group_detail_etag)
 def get_group_detail(group_id):
     """Obter detalhes de um grupo"""
     user_id = get_jwt_identity()
     
     # Verificar se usuário é membro do grupo
-    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
-    if not membership:
+    if not RequestMemo.is_member(user_id, group_id):
         return jsonify({'error': 'Acesso negado'}), 403
     
-    group = Group.query.get(group_id)
+    # Grupo, membros, despesas e dívidas em consultas fixas (sem carregamento por item)
+    group = Group.load_with_details(group_id)
     if not group:
         return jsonify({'error': 'Grupo não encontrado'}), 404
     
-    # Buscar membros, despesas e dívidas
-    members = group.get_members()
-    
-    # Buscar todas as despesas do grupo
-    all_expenses = Expense.query.filter_by(group_id=group_id).all()
+    expenses = group.expenses
+    member_ids = [m.user_id for m in group.members]
     
-    # Buscar todas as despesas do grupo (agora que a despesa incorreta foi removida)
-    expenses = all_expenses
+    # Dívidas pendentes do grupo: das despesas e acertos da otimização (não vendidas como títulos)
+    debts = Debt.query.filter(Debt.group_id == group_id, Debt.status == 'pending').all()
+    # Cotas ainda em vetores (grupos grandes) também são dívidas pendentes do grupo
+    share_debts = [debt for debt, _ in ShareVectorService.pending_debts(ExpenseShare.group_id == group_id)]
     
-    # Buscar dívidas das despesas filtradas (não vendidas como títulos)
-    debts = []
-    for expense in expenses:
-        for debt in expense.debts:
-            if debt.status == 'pending':
-                debts.append(debt)
-    
-    # Buscar pagamentos via wallet relacionados ao grupo
-    wallet_payments = []
-    
-    # 1. Pagamentos de despesas do grupo
-    paid_debts = Debt.query.join(Expense).filter(
-        Expense.group_id == group_id,
+    # 1. Pagamentos de dívidas do grupo
+    paid_debts = Debt.query.filter(
+        Debt.group_id == group_id,
         Debt.status == 'paid'
     ).all()
     
-    for debt in paid_debts:
-        wallet_payments.append({
-            'id': f'payment_{debt.id}',
-            'type': 'wallet_payment',
-            'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira',
-            'amount': debt.amount,
-            'payer_id': debt.debtor_id,
-            'payer_name': debt.debtor.name,
-            'creditor_id': debt.creditor_id,
-            'creditor_name': debt.creditor.name,
-            'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
-            'original_expense_description': debt.expense.description if debt.expense else None,
-            'debt_id': debt.id
-        })
-    
     # 2. Pagamentos virtuais entre membros do grupo
-    # Buscar membros do grupo para filtrar pagamentos virtuais
-    group_members = GroupMember.query.filter_by(group_id=group_id).all()
-    member_ids = [m.user_id for m in group_members]
-    
     virtual_payments = Debt.query.filter(
         Debt.source == 'virtual_payment',
         Debt.status == 'paid',
@@ -119,23 +148,28 @@ def get_group_detail(group_id):
         Debt.creditor_id.in_(member_ids)
     ).all()
     
+    # Mapa de usuários carregado de uma vez: os nomes de membros, pagadores, devedores e
+    # credores passam a ser resolvidos na identity map da sessão, sem consultas por item
+    referenced_user_ids = set(member_ids)
+    referenced_user_ids.update(expense.payer_id for expense in expenses)
+    for debt in [d for expense in expenses for d in expense.debts] + debts + share_debts + paid_debts + virtual_payments:
+        referenced_user_ids.update((debt.debtor_id, debt.creditor_id))
+    RequestMemo.get_users(referenced_user_ids, db.selectinload(User.wallet))
+    
+    members = group.get_members()
+    
+    # Buscar pagamentos via wallet relacionados ao grupo
+    wallet_payments = []
+    
+    for debt in paid_debts:
+        wallet_payments.append(_wallet_payment_dict(debt))
+    
     for debt in virtual_payments:
-        wallet_payments.append({
-            'id': f'virtual_payment_{debt.id}',
-            'type': 'virtual_wallet_payment',
-            'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira (pagamento virtual)',
-            'amount': debt.amount,
-            'payer_id': debt.debtor_id,
-            'payer_name': debt.debtor.name,
-            'creditor_id': debt.creditor_id,
-            'creditor_name': debt.creditor.name,
-            'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
-            'original_expense_description': 'Pagamento direto entre membros',
-            'debt_id': debt.id
-        })
+        wallet_payments.append(_virtual_payment_dict(debt))
     
     # Incluir dados do grupo no root para compatibilidade com Flutter
     group_dict = group.to_dict()
+    expense_descriptions = {expense.id: expense.description for expense in expenses}
     
     return jsonify({
         # Dados do grupo no root
@@ -153,10 +187,173 @@ def get_group_detail(group_id):
         'group': group_dict,  # Manter para compatibilidade
         'members': [member.to_dict() for member in members],
         'expenses': [expense.to_dict() for expense in expenses],
-        'debts': [debt.to_dict() for debt in debts],
+        'debts': [debt.to_dict() for debt in debts] + [
+            ShareVectorService.snapshot_dict(debt, expense_descriptions.get(debt.expense_id)) for debt in share_debts
+        ],
         'wallet_payments': wallet_payments  # Pagamentos via carteira
     })
 
+def _wallet_payment_dict(debt):
+    """Pagamento via carteira de uma dívida de despesa do grupo"""
+    return {
+        'id': f'payment_{debt.id}',
+        'type': 'wallet_payment',
+        'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira',
+        'amount': debt.amount,
+        'payer_id': debt.debtor_id,
+        'payer_name': debt.debtor.name,
+        'creditor_id': debt.creditor_id,
+        'creditor_name': debt.creditor.name,
+        'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
+        'original_expense_description': debt.description,
+        'debt_id': debt.id
+    }
+
+def _virtual_payment_dict(debt):
+    """Pagamento virtual (dívida otimizada paga via carteira) entre membros do grupo"""
+    return {
+        'id': f'virtual_payment_{debt.id}',
+        'type': 'virtual_wallet_payment',
+        'description': f'{debt.debtor.name} pagou R$ {debt.amount:.2f} para {debt.creditor.name} via carteira (pagamento virtual)',
+        'amount': debt.amount,
+        'payer_id': debt.debtor_id,
+        'payer_name': debt.debtor.name,
+        'creditor_id': debt.creditor_id,
+        'creditor_name': debt.creditor.name,
+        'paid_at': debt.paid_at.isoformat() if debt.paid_at else None,
+        'original_expense_description': 'Pagamento direto entre membros',
+        'debt_id': debt.id
+    }
+
+# Detalhe do grupo em seções paginadas por cursor (para clientes que não precisam do grupo inteiro).
+# Parâmetros: limit (padrão 20, máximo 100) e cursor (next_cursor da página anterior).
+
+@groups_bp.route('/<string:group_id>/overview', methods=['GET'])
+@jwt_required()
+def get_group_overview(group_id):
+    """Dados do grupo e membros, sem despesas, dívidas ou pagamentos"""
+    user_id = get_jwt_identity()
+    
+    if not RequestMemo.is_member(user_id, group_id):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    group = Group.query.options(db.joinedload(Group.creator)).filter_by(id=group_id).first()
+    if not group:
+        return jsonify({'error': 'Grupo não encontrado'}), 404
+    
+    RequestMemo.get_users([m.user_id for m in group.members], db.selectinload(User.wallet))
+    
+    return jsonify({
+        'group': group.to_dict(),
+        'members': [member.to_dict() for member in group.get_members()]
+    })
+
+@groups_bp.route('/<string:group_id>/expenses', methods=['GET'])
+@jwt_required()
+def get_group_expenses_page(group_id):
+    """Despesas do grupo, das mais recentes para as mais antigas"""
+    user_id = get_jwt_identity()
+    
+    if not RequestMemo.is_member(user_id, group_id):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    query = Expense.query.options(db.selectinload(Expense.debts)).filter(Expense.group_id == group_id)
+    try:
+        expenses, next_cursor = PaginationService.keyset_page(
+            query, [Expense.created_at, Expense.id],
+            PaginationService.page_size(request.args.get('limit')), request.args.get('cursor')
+        )
+    except InvalidCursor:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    
+    # Nomes de pagadores, devedores e credores em uma única consulta
+    user_ids = {expense.payer_id for expense in expenses}
+    for expense in expenses:
+        for debt in expense.debts:
+            user_ids.update((debt.debtor_id, debt.creditor_id))
+    RequestMemo.get_users(user_ids)
+    
+    return jsonify({
+        'expenses': [expense.to_dict() for expense in expenses],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+@groups_bp.route('/<string:group_id>/debts', methods=['GET'])
+@jwt_required()
+def get_group_debts_page(group_id):
+    """Dívidas pendentes do grupo, das mais recentes para as mais antigas"""
+    user_id = get_jwt_identity()
+    
+    if not RequestMemo.is_member(user_id, group_id):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    query = Debt.query.options(db.joinedload(Debt.expense)).filter(
+        Debt.group_id == group_id,
+        Debt.status == 'pending'
+    )
+    try:
+        debts, next_cursor = PaginationService.keyset_page(
+            query, [Debt.created_at, Debt.id],
+            PaginationService.page_size(request.args.get('limit')), request.args.get('cursor')
+        )
+    except InvalidCursor:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    
+    RequestMemo.get_users({user for debt in debts for user in (debt.debtor_id, debt.creditor_id)})
+    
+    return jsonify({
+        'debts': [debt.to_dict() for debt in debts],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+@groups_bp.route('/<string:group_id>/payments', methods=['GET'])
+@jwt_required()
+def get_group_payments_page(group_id):
+    """
+    Pagamentos via carteira do grupo (dívidas pagas das despesas do grupo e pagamentos
+    virtuais entre membros), dos mais recentes para os mais antigos. Cada dívida aparece uma vez.
+    """
+    user_id = get_jwt_identity()
+    
+    if not RequestMemo.is_member(user_id, group_id):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    member_ids = db.select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+    paid_on = db.func.coalesce(Debt.paid_at, Debt.created_at)
+    
+    query = Debt.query.options(db.joinedload(Debt.expense)).filter(
+        Debt.status == 'paid',
+        db.or_(
+            db.and_(Debt.source != 'virtual_payment', Debt.group_id == group_id),
+            db.and_(
+                Debt.source == 'virtual_payment',
+                Debt.debtor_id.in_(member_ids),
+                Debt.creditor_id.in_(member_ids)
+            )
+        )
+    )
+    try:
+        debts, next_cursor = PaginationService.keyset_page(
+            query, [paid_on, Debt.id],
+            PaginationService.page_size(request.args.get('limit')), request.args.get('cursor'),
+            key=lambda debt: [debt.paid_at or debt.created_at, debt.id]
+        )
+    except InvalidCursor:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    
+    RequestMemo.get_users({user for debt in debts for user in (debt.debtor_id, debt.creditor_id)})
+    
+    return jsonify({
+        'payments': [
+            _virtual_payment_dict(debt) if debt.source == 'virtual_payment' else _wallet_payment_dict(debt)
+            for debt in debts
+        ],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
 @groups_bp.route('/<string:group_id>/members', methods=['POST'])
 @jwt_required()
 def add_member_to_group(group_id):
@@ -208,6 +405,21 @@ def add_expense(group_id):
         if field not in data:
             return jsonify({'error': f'{field} é obrigatório'}), 400
     
+    # Divisão por peso, valor exato ou percentual (shares: {user_id: valor}); padrão: igual
+    split_type = data.get('split_type') or 'equal'
+    shares = data.get('shares')
+    if split_type != 'equal':
+        try:
+            SplitService.participant_cents(float(data['amount']), split_type, shares)
+        except SplitError as e:
+            return jsonify({'error': str(e)}), 400
+        members_in_shares = GroupMember.query.filter(
+            GroupMember.group_id == group_id,
+            GroupMember.user_id.in_(list(shares))
+        ).count()
+        if members_in_shares != len(shares):
+            return jsonify({'error': 'shares deve conter apenas membros do grupo'}), 400
+    
     # Criar despesa
     expense = Expense(
         group_id=group_id,
@@ -218,17 +430,60 @@ def add_expense(group_id):
     )
     
     db.session.add(expense)
-    db.session.commit()
+    db.session.flush()
     
-    # Dividir despesa automaticamente
-    expense.split_expense(data.get('member_ids'))
+    # Dividir despesa automaticamente (a divisão confirma a despesa junto com o ledger de saldos)
+    expense.split_expense(data.get('member_ids'), split_type, shares)
     
-    # Executar otimização automática
-    LogService.optimize_debts()
+    # Agendar otimização do grupo e dos pares afetados (disparos em sequência são agrupados)
+    participant_ids = [user_id] + [debt.debtor_id for debt in expense.debts]
+    if expense.share:
+        participant_ids += ShareVectorService.debtor_ids(expense.share)
+    job = OptimizationQueue.enqueue(group_id, participant_ids)
     
     return jsonify({
         'message': 'Despesa adicionada com sucesso',
-        'expense': expense.to_dict()
+        'expense': expense.to_dict(),
+        'optimization_job_id': job.id
+    }), 201
+
+@groups_bp.route('/<string:group_id>/expenses/bulk', methods=['POST'])
+@jwt_required()
+def bulk_add_expenses(group_id):
+    """
+    Importar várias despesas de uma vez: JSON (lista ou {"expenses": [...]}) ou CSV
+    (upload no campo 'file' ou corpo text/csv). Tudo em uma transação; otimiza uma vez no final.
+    """
+    user_id = get_jwt_identity()
+    
+    if not RequestMemo.is_member(user_id, group_id):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    if 'file' in request.files:
+        rows = ExpenseImportService.parse_csv(request.files['file'].read().decode('utf-8-sig', errors='replace'))
+    elif request.mimetype == 'text/csv':
+        rows = ExpenseImportService.parse_csv(request.get_data(as_text=True))
+    else:
+        data = request.get_json(silent=True)
+        rows = data.get('expenses') if isinstance(data, dict) else data
+    
+    try:
+        expense_ids, total, participant_ids = ExpenseImportService.import_expenses(group_id, user_id, rows)
+    except ExpenseImportError as e:
+        db.session.rollback()
+        return jsonify({'error': 'Importação rejeitada', 'details': e.errors}), 400
+    
+    db.session.commit()
+    
+    # Uma única otimização para todo o lote
+    job = OptimizationQueue.enqueue(group_id, participant_ids)
+    
+    return jsonify({
+        'message': f'{len(expense_ids)} despesas importadas com sucesso',
+        'created': len(expense_ids),
+        'total_amount': total,
+        'expense_ids': expense_ids,
+        'optimization_job_id': job.id
     }), 201
 
 @groups_bp.route('/<string:group_id>/expenses/<string:expense_id>', methods=['DELETE'])
@@ -245,11 +500,21 @@ def delete_expense(group_id, expense_id):
     if expense.payer_id != user_id:
         return jsonify({'error': 'Apenas quem pagou pode deletar a despesa'}), 403
     
-    # Cancelar todas as dívidas relacionadas
-    for debt in expense.debts:
-        debt.cancel()
+    # Saldos pendentes que o grupo deve ter sem a despesa (lidos antes da remoção)
+    targets = LogService.removal_targets(expense)
+    
+    # Desfazer a despesa no ledger de saldos e cancelar as dívidas relacionadas
+    # (em massa, na mesma transação da remoção)
+    BalanceService.remove_expense(expense)
+    ExpenseRollupService.remove_expense(expense)
+    Debt.bulk_cancel([debt.id for debt in expense.debts])
+    Group.adjust_counters(group_id, expenses=-1, amount=-expense.amount)
     
     db.session.delete(expense)
+    db.session.flush()
+    
+    # Se as dívidas da despesa já tinham virado acertos, refazer os acertos com as obrigações restantes
+    LogService.resettle_group(group_id, targets)
     db.session.commit()
     
     return jsonify({'message': 'Despesa removida com sucesso'})
@@ -270,11 +535,9 @@ def optimize_group_debts(group_id):
     if not membership:
         return jsonify({'error': 'Usuário não é membro do grupo'}), 403
     
-    # Calcular saldos antes da otimização
-    balances_before = _calculate_group_balances(group_id)
-    
-    # Executar otimização
-    optimized_count = LogService.optimize_debts()
+    # Executar otimização do grupo agora, absorvendo disparos que estavam na fila
+    job = OptimizationQueue.run_now(group_id)
+    optimized_count = job.optimized_count or 0
     
     # Calcular saldos após otimização
     balances_after = _calculate_group_balances(group_id)
@@ -304,136 +567,75 @@ def optimize_group_debts(group_id):
     return jsonify({
         'message': message,
         'optimized_count': optimized_count,
-        'balance_summary': balance_summary
+        'balance_summary': balance_summary,
+        'optimization_job': job.to_dict()
     })
 
 
-def calculate_user_net_balance(user_id):
-    """Calcula o saldo líquido real do usuário em todos os grupos"""
-    from app.models.expense import Expense
-    from app.models.user import GroupMember
-    
-    # Buscar todos os grupos do usuário
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
+@groups_bp.route('/<group_id>/optimize/simulate', methods=['POST'])
+@jwt_required()
+def simulate_group_optimization(group_id):
+    """Simula a otimização do grupo sem gravar nada (plano, transferências e tempos por fase)"""
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
     
-    total_net_balance = 0.0
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return jsonify({'error': 'Usuário não é membro do grupo'}), 403
     
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Calcular saldo neste grupo específico
-        group_balances = _calculate_group_balances(group_id)
-        user_balance = group_balances.get(user_id, 0.0)
-        total_net_balance += user_balance
+    report = LogService.simulate_group(group_id, data.get('user_ids'))
     
-    return total_net_balance
+    return jsonify(report)
 
 
-def _calculate_group_balances(group_id):
-    """Calcula o saldo líquido de cada membro do grupo baseado no que pagaram vs o que deveriam pagar"""
-    from app.models.expense import Expense
-    from app.models.user import GroupMember
-    
-    # Buscar todas as despesas do grupo
-    expenses = Expense.query.filter_by(group_id=group_id).all()
-    
-    # Calcular quanto cada pessoa pagou
-    paid_by_user = defaultdict(float)
-    for expense in expenses:
-        paid_by_user[expense.payer_id] += expense.amount
-    
-    # Calcular total de despesas
-    total_expenses = sum(expense.amount for expense in expenses)
-    
-    # Buscar membros do grupo
-    members = GroupMember.query.filter_by(group_id=group_id).all()
-    member_count = len(members)
-    
-    if member_count == 0:
-        return {}
-    
-    # Calcular quanto cada pessoa deveria pagar (divisão igual)
-    should_pay_per_person = total_expenses / member_count
-    
-    # Calcular saldo líquido: quanto pagou - quanto deveria pagar
-    balances = {}
-    for member in members:
-        paid = paid_by_user.get(member.user_id, 0.0)
-        should_pay = should_pay_per_person
-        balance = paid - should_pay  # Positivo = recebe, Negativo = paga
-        balances[member.user_id] = balance
-    
-    # CORREÇÃO: Ajustar saldos considerando pagamentos via wallet
-    # 1. Buscar pagamentos via wallet dentro deste grupo (dívidas de despesas do grupo)
-    paid_debts = Debt.query.join(Expense).filter(
-        Expense.group_id == group_id,
-        Debt.status == 'paid'
-    ).all()
+@groups_bp.route('/<group_id>/optimize/status', methods=['GET'])
+@jwt_required()
+def get_optimization_status(group_id):
+    """Status do último job de otimização do grupo"""
+    user_id = get_jwt_identity()
     
-    print(f"[DEBUG] Grupo {group_id}: Encontrados {len(paid_debts)} pagamentos de despesas via wallet")
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return jsonify({'error': 'Usuário não é membro do grupo'}), 403
     
-    for debt in paid_debts:
-        debtor_id = debt.debtor_id
-        creditor_id = debt.creditor_id
-        amount = debt.amount
-        
-        print(f"[DEBUG] Pagamento de despesa: {debtor_id} pagou {amount} para {creditor_id}")
-        
-        if debtor_id in balances:
-            balances[debtor_id] += amount
-        if creditor_id in balances:
-            balances[creditor_id] -= amount
+    job = OptimizationQueue.get_latest_job(group_id)
     
-    # 2. Buscar pagamentos virtuais (source='virtual_payment')
-    # Estes são pagamentos diretos entre membros do grupo
-    virtual_payments = Debt.query.filter(
-        Debt.source == 'virtual_payment',
-        Debt.status == 'paid',
-        # Verificar se ambos os usuários são membros do grupo
-        Debt.debtor_id.in_([m.user_id for m in members]),
-        Debt.creditor_id.in_([m.user_id for m in members])
-    ).all()
+    return jsonify({
+        'group_id': group_id,
+        'job': job.to_dict() if job else None
+    })
+
+
+@groups_bp.route('/<group_id>/optimize/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_optimization_job(group_id, job_id):
+    """Status de um job de otimização específico"""
+    from app.models.optimization_job import OptimizationJob
+    user_id = get_jwt_identity()
     
-    print(f"[DEBUG] Grupo {group_id}: Encontrados {len(virtual_payments)} pagamentos virtuais")
+    membership = GroupMember.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if not membership:
+        return jsonify({'error': 'Usuário não é membro do grupo'}), 403
     
-    for payment in virtual_payments:
-        debtor_id = payment.debtor_id
-        creditor_id = payment.creditor_id
-        amount = payment.amount
-        
-        print(f"[DEBUG] Pagamento virtual: {debtor_id} pagou {amount} para {creditor_id}")
-        
-        if debtor_id in balances:
-            balances[debtor_id] += amount  # Quem pagou melhora
-            print(f"[DEBUG] Novo saldo de {debtor_id}: {balances[debtor_id]}")
-        if creditor_id in balances:
-            balances[creditor_id] -= amount  # Quem recebeu piora
-            print(f"[DEBUG] Novo saldo de {creditor_id}: {balances[creditor_id]}")
-    
-    # 3. CORREÇÃO: Descontar dívidas que foram vendidas como títulos
-    # Quando alguém vende uma dívida, ela não tem mais direito a receber do devedor
-    sold_debts = Debt.query.join(Expense).filter(
-        Expense.group_id == group_id,
-        Debt.status == 'sold_as_title'
-    ).all()
+    job = OptimizationJob.query.get(job_id)
+    if not job or job.group_id != group_id:
+        return jsonify({'error': 'Job não encontrado'}), 404
     
-    print(f"[DEBUG] Grupo {group_id}: Encontradas {len(sold_debts)} dívidas vendidas como títulos")
+    return jsonify({'job': job.to_dict()})
+
+
+def calculate_user_net_balance(user_id):
+    """Calcula o saldo líquido real do usuário em todos os grupos"""
+    # Saldos de todos os grupos do usuário em lote (número constante de consultas)
+    balances_by_group = BalanceService.get_user_group_balances(user_id)
     
-    for debt in sold_debts:
-        debtor_id = debt.debtor_id
-        creditor_id = debt.creditor_id  # Quem VENDEU a dívida
-        amount = debt.amount
-        
-        print(f"[DEBUG] Dívida vendida: {creditor_id} vendeu dívida de {amount} do {debtor_id}")
-        
-        # Quem vendeu a dívida não tem mais direito a receber
-        if creditor_id in balances:
-            balances[creditor_id] -= amount  # Reduz o que tem a receber
-            print(f"[DEBUG] Saldo ajustado de {creditor_id}: {balances[creditor_id]} (descontou R$ {amount} vendido)")
-        
-        # Quem devia não deve mais para o vendedor original
-        if debtor_id in balances:
-            balances[debtor_id] += amount  # Reduz o que deve pagar
-            print(f"[DEBUG] Saldo ajustado de {debtor_id}: {balances[debtor_id]} (não deve mais R$ {amount} para vendedor)")
+    total_net_balance = 0.0
+    for group_balances in balances_by_group.values():
+        total_net_balance += group_balances.get(user_id, 0.0)
     
-    return balances
\ No newline at end of file
+    return total_net_balance
+
+
+def _calculate_group_balances(group_id):
+    """Saldo líquido de cada membro do grupo (quanto pagou vs quanto deveria pagar, com correções de pagamentos)"""
+    return BalanceService.get_group_balances(group_id)
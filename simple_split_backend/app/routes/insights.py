@@ -6,19 +6,38 @@ from app.models.debt import Debt
 from app.models.log import Log
 from app.models.expense import Expense
 from app.models.group import Group
+from app.models.expense_rollup import ExpenseRollup
+from app.services.balance_service import BalanceService
+from app.services.allocation_service import AllocationService
+from app.services.request_memo import RequestMemo
+from app.services.cache_service import CacheService
+from app.services.expense_rollup_service import ExpenseRollupService
 from datetime import datetime, timedelta
+from app.services.logging_service import LoggingService
 
 insights_bp = Blueprint('insights', __name__)
+logger = LoggingService.get_logger(__name__)
+
+# Segundos que os insights automáticos ficam em cache
+INSIGHTS_CACHE_TTL = 60
 
 @insights_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_insights():
     """Obter insights automáticos para o usuário"""
     user_id = get_jwt_identity()
+    
+    # Depende também da data atual e da última otimização global, por isso expira sozinho
+    insights = CacheService.for_user('insights', user_id, lambda: _build_insights(user_id), ttl=INSIGHTS_CACHE_TTL)
+    return jsonify(insights)
+
+
+def _build_insights(user_id):
+    """Gera a lista de insights do usuário, ordenada por prioridade"""
     insights = []
     
     # Insight 1: Próximos pagamentos (dívidas que o usuário deve, excluindo vendidas)
-    debts_to_pay = Debt.get_pending_debts(debtor_id=user_id).join(Expense).all()
+    debts_to_pay = Debt.get_user_pending_debts(debtor_id=user_id)
     
     for debt in debts_to_pay[:3]:  # Mostrar apenas as 3 primeiras
         due_date = debt.due_date or (datetime.now().date() + timedelta(days=7))
@@ -30,14 +49,14 @@ def get_insights():
                 'amount': debt.amount,
                 'creditor': debt.creditor.name,
                 'due_date': due_date.isoformat(),
-                'expense_description': debt.expense.description if debt.expense else None,
+                'expense_description': debt.description,
                 'debt_id': debt.id
             },
             'priority': 'high' if due_date <= datetime.now().date() else 'medium'
         })
     
     # Insight 2: Dívidas a receber (consolidadas por devedor)
-    debts_to_receive = Debt.get_pending_debts(creditor_id=user_id).join(Expense).all()
+    debts_to_receive = Debt.get_user_pending_debts(creditor_id=user_id)
     
     # Consolidar dívidas por devedor
     from collections import defaultdict
@@ -178,7 +197,7 @@ def get_insights():
     priority_order = {'high': 0, 'medium': 1, 'low': 2, 'info': 3}
     insights.sort(key=lambda x: priority_order.get(x['priority'], 3))
     
-    return jsonify(insights)
+    return insights
 
 @insights_bp.route('/summary', methods=['GET'])
 @jwt_required()
@@ -186,23 +205,21 @@ def get_summary():
     """Obter resumo financeiro do usuário"""
     user_id = get_jwt_identity()
     
+    # Resultado em cache até a próxima escrita que afete o usuário ou os seus grupos
+    summary = CacheService.for_user('insights_summary', user_id, lambda: _build_summary(user_id))
+    return jsonify(summary)
+
+
+def _build_summary(user_id):
+    """Calcula o resumo financeiro do usuário"""
     # Usar lógica otimizada (mesma do /user/profile e grupos)
-    from app.routes.groups import calculate_user_net_balance
-    from app.models.user import GroupMember
-    
-    # Calcular valores otimizados baseados nos saldos dos grupos
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
+    # Calcular valores otimizados baseados nos saldos dos grupos (todos os grupos em lote)
+    balances_by_group = BalanceService.get_user_group_balances(user_id)
     
     optimized_total_to_pay = 0.0
     optimized_total_to_receive = 0.0
     
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Usar a função _calculate_group_balances
-        from app.routes.groups import _calculate_group_balances
-        group_balances = _calculate_group_balances(group_id)
-        
+    for group_balances in balances_by_group.values():
         user_balance = group_balances.get(user_id, 0.0)
         
         if user_balance < 0:  # Usuário deve (saldo negativo)
@@ -224,33 +241,21 @@ def get_summary():
     you_owe_total = 0.0
     others_owe_total = 0.0
     
-    for membership in user_groups:
-        group_id = membership.group_id
-        group_balances = _calculate_group_balances(group_id)
+    allocations = AllocationService.for_groups(balances_by_group)
+    
+    for group_id, group_balances in balances_by_group.items():
         user_balance = group_balances.get(user_id, 0.0)
         
         if abs(user_balance) > 0.01:
             if user_balance < 0:  # Usuário deve (saldo negativo)
-                for other_user_id, other_balance in group_balances.items():
-                    if other_user_id != user_id and other_balance > 0.01:
-                        total_positive = sum(balance for balance in group_balances.values() if balance > 0)
-                        if total_positive > 0:
-                            proportion = other_balance / total_positive
-                            amount_owed = abs(user_balance) * proportion
-                            
-                            if amount_owed > 0.01:
-                                # Verificar se há dívidas pagas individualmente que devem reduzir o saldo
-                                paid_debts = Debt.query.filter_by(
-                                    debtor_id=user_id,
-                                    creditor_id=other_user_id,
-                                    status='paid'
-                                ).all()
-                                
-                                paid_amount = sum(d.amount for d in paid_debts)
-                                amount_owed = max(0, amount_owed - paid_amount)
-                                
-                                you_owe_total += amount_owed
-                                
+                for other_user_id, amount_owed in allocations[group_id].owed_by(user_id, min_balance=0.01):
+                    if amount_owed > 0.01:
+                        # Verificar se há dívidas pagas individualmente que devem reduzir o saldo
+                        paid_amount = _paid_between(user_id, other_user_id)
+                        amount_owed = max(0, amount_owed - paid_amount)
+                        
+                        you_owe_total += amount_owed
+                        
             elif user_balance > 0:  # Usuário deve receber (saldo positivo)
                 others_owe_total += user_balance
     
@@ -261,35 +266,20 @@ def get_summary():
     total_to_pay = you_owe_total
     total_to_receive = others_owe_total
     
-    print(f"[DEBUG] Summary totais corrigidos - A pagar: R$ {total_to_pay}, A receber: R$ {total_to_receive}")
-    
-    # Total gasto: soma da parte do usuário nas despesas (tanto como pagador quanto devedor)
-    from app.models.expense import Expense
-    # Total gasto (parte real do usuário nas despesas)
-    # 1. Parte das despesas que ele pagou (valor dividido pelo número de pessoas)
-    expenses_paid = Expense.query.filter_by(payer_id=user_id).all()
-    spent_as_payer = 0
-    for expense in expenses_paid:
-        # Conta quantas pessoas participaram (pagador + devedores)
-        debt_count = len(expense.debts)
-        total_people = debt_count + 1  # +1 para o pagador
-        spent_as_payer += expense.amount / total_people
+    logger.debug("Summary totais corrigidos - A pagar: R$ %s, A receber: R$ %s", total_to_pay, total_to_receive)
     
-    # 2. Parte das despesas que ele deve (já paga ou pendente)
-    spent_as_debtor = db.session.query(db.func.sum(Debt.amount))\
-        .filter_by(debtor_id=user_id).scalar() or 0
-    
-    total_spent = spent_as_payer + spent_as_debtor
+    # Total gasto: soma da parte do usuário nas despesas (tanto como pagador quanto devedor),
+    # registrada na divisão de cada despesa na tabela de totais mensais
+    _, _, total_spent = ExpenseRollupService.totals(ExpenseRollup.user_id == user_id)
     
     # Saldo da carteira
     user = User.query.get(user_id)
     wallet_balance = user.wallet.balance if user.wallet else 0
     
     # Número de grupos ativos
-    from app.models.user import GroupMember
-    active_groups = GroupMember.query.filter_by(user_id=user_id).count()
+    active_groups = len(balances_by_group)
     
-    return jsonify({
+    return {
         'wallet_balance': wallet_balance,
         'total_to_pay': total_to_pay,
         'total_to_receive': total_to_receive,
@@ -297,7 +287,7 @@ def get_summary():
         'net_balance': total_to_receive - total_to_pay,
         'active_groups': active_groups,
         'score': user.score
-    })
+    }
 
 @insights_bp.route('/debts-categorized', methods=['GET'])
 @jwt_required()
@@ -305,13 +295,14 @@ def get_debts_categorized():
     """Obter dívidas categorizadas usando saldos otimizados dos grupos (mesma lógica do OTIMIZAR)"""
     user_id = get_jwt_identity()
     
-    # Importar função de cálculo de saldos dos grupos
-    from app.routes.groups import calculate_user_net_balance
-    from app.models.user import GroupMember, User
+    from app.models.user import User
     from collections import defaultdict
     
+    # Saldos de todos os grupos do usuário em lote (número constante de consultas)
+    balances_by_group = BalanceService.get_user_group_balances(user_id)
+    
     # Calcular saldo líquido total do usuário usando a mesma lógica dos grupos
-    total_net_balance = calculate_user_net_balance(user_id)
+    total_net_balance = sum(balances.get(user_id, 0.0) for balances in balances_by_group.values())
     
     # Ajustar o saldo considerando pagamentos individuais feitos
     individual_payments = Debt.query.filter_by(
@@ -320,115 +311,95 @@ def get_debts_categorized():
     ).all()
     
     total_paid_individually = sum(debt.amount for debt in individual_payments)
-    print(f"[DEBUG] Usuário {user_id} pagou individualmente: R$ {total_paid_individually}")
+    paid_by_creditor = defaultdict(float)
+    for debt in individual_payments:
+        paid_by_creditor[debt.creditor_id] += debt.amount
+    
+    # Dívidas pendentes do usuário carregadas uma vez, por credor (id de exemplo de cada credor abaixo)
+    pending_by_creditor = defaultdict(list)
+    for debt in Debt.get_user_pending_debts(debtor_id=user_id):
+        pending_by_creditor[debt.creditor_id].append(debt)
+    logger.debug("Usuário %s pagou individualmente: R$ %s", user_id, total_paid_individually)
     
     # Ajustar o saldo líquido
     total_net_balance += total_paid_individually  # Se pagou individualmente, melhora o saldo
     
-    # Buscar todos os grupos do usuário para calcular saldos individuais
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
-    
     you_owe_list = []
     others_owe_list = []
+    allocations = AllocationService.for_groups(balances_by_group)
     
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Usar a função _calculate_group_balances importada
-        from app.routes.groups import _calculate_group_balances
-        group_balances = _calculate_group_balances(group_id)
-        
+    # Carregar de uma vez os membros de todos os grupos (nomes usados nas listas abaixo)
+    RequestMemo.get_users({member_id for balances in balances_by_group.values() for member_id in balances})
+    
+    for group_id, group_balances in balances_by_group.items():
         user_balance = group_balances.get(user_id, 0.0)
-        print(f"[DEBUG] Insights - Grupo {group_id}: saldo do usuário = {user_balance}")
+        allocation = allocations[group_id]
+        logger.debug("Insights - Grupo %s: saldo do usuário = %s", group_id, user_balance)
         
         if abs(user_balance) > 0.01:  # Apenas se tiver saldo significativo
             if user_balance < 0:  # Usuário deve (saldo negativo)
-                # Encontrar quem deve receber no grupo
-                for other_user_id, other_balance in group_balances.items():
-                    if other_user_id != user_id and other_balance > 0.01:
-                        # Calcular quanto este usuário deve para este outro usuário
-                        # Proporcionalmente ao quanto cada um deve receber
+                # Quanto este usuário deve a cada membro que deve receber no grupo,
+                # proporcionalmente ao quanto cada um deve receber
+                for other_user_id, amount_owed in allocation.owed_by(user_id, min_balance=0.01):
+                    logger.debug("Usuário deve para %s: total_positive=%s, amount_owed=%s", other_user_id, allocation.total_positive, amount_owed)
+                    
+                    if amount_owed > 0.01:  # Apenas valores significativos
+                        other_user = RequestMemo.get_user(other_user_id)
                         
-                        total_positive = sum(balance for balance in group_balances.values() if balance > 0)
-                        if total_positive > 0:
-                            proportion = other_balance / total_positive
-                            amount_owed = abs(user_balance) * proportion
+                        # Verificar se já existe entrada para este credor
+                        existing = None
+                        for item in you_owe_list:
+                            if item['creditor_id'] == other_user_id:
+                                existing = item
+                                break
+                        
+                        if existing:
+                            existing['amount'] += amount_owed
+                            existing['amount'] = round(existing['amount'], 2)
+                        else:
+                            # Buscar uma dívida individual real para este credor para ter um debt_id (excluindo vendidas)
+                            pair_debts = pending_by_creditor.get(other_user_id)
+                            sample_debt = pair_debts[0] if pair_debts else None
+                            
+                            # Verificar se há dívidas pagas individualmente que devem reduzir o saldo
+                            paid_amount = paid_by_creditor.get(other_user_id, 0.0)
+                            amount_owed = max(0, amount_owed - paid_amount)
                             
-                            print(f"[DEBUG] Usuário deve para {other_user_id}: total_positive={total_positive}, proportion={proportion}, amount_owed={amount_owed}")
+                            logger.debug("Após descontar pagamentos: paid_amount=%s, amount_owed_final=%s", paid_amount, amount_owed)
                             
-                            if amount_owed > 0.01:  # Apenas valores significativos
-                                other_user = User.query.get(other_user_id)
-                                
-                                # Verificar se já existe entrada para este credor
-                                existing = None
-                                for item in you_owe_list:
-                                    if item['creditor_id'] == other_user_id:
-                                        existing = item
-                                        break
-                                
-                                if existing:
-                                    existing['amount'] += amount_owed
-                                    existing['amount'] = round(existing['amount'], 2)
-                                else:
-                                    # Buscar uma dívida individual real para este credor para ter um debt_id (excluindo vendidas)
-                                    sample_debt = Debt.get_pending_debts(
-                                        debtor_id=user_id,
-                                        creditor_id=other_user_id
-                                    ).first()
-                                    
-                                    # Verificar se há dívidas pagas individualmente que devem reduzir o saldo
-                                    paid_debts = Debt.query.filter_by(
-                                        debtor_id=user_id,
-                                        creditor_id=other_user_id,
-                                        status='paid'
-                                    ).all()
-                                    
-                                    paid_amount = sum(d.amount for d in paid_debts)
-                                    amount_owed = max(0, amount_owed - paid_amount)
-                                    
-                                    print(f"[DEBUG] Após descontar pagamentos: paid_amount={paid_amount}, amount_owed_final={amount_owed}")
-                                    
-                                    # Só incluir se ainda deve alguma coisa
-                                    if amount_owed > 0.01:
-                                        you_owe_list.append({
-                                            'id': sample_debt.id if sample_debt else f'virtual_{user_id}_{other_user_id}',
-                                            'creditor_id': other_user_id,
-                                            'creditor_name': other_user.name,
-                                            'amount': round(amount_owed, 2),
-                                            'source': 'group_debt'
-                                        })
+                            # Só incluir se ainda deve alguma coisa
+                            if amount_owed > 0.01:
+                                you_owe_list.append({
+                                    'id': sample_debt.id if sample_debt else f'virtual_{user_id}_{other_user_id}',
+                                    'creditor_id': other_user_id,
+                                    'creditor_name': other_user.name,
+                                    'amount': round(amount_owed, 2),
+                                    'source': 'group_debt'
+                                })
                             
             elif user_balance > 0:  # Usuário deve receber (saldo positivo)
-                # Encontrar quem deve no grupo
-                for other_user_id, other_balance in group_balances.items():
-                    if other_user_id != user_id and other_balance < -0.01:
-                        # Calcular quanto este outro usuário deve para o usuário atual
+                # Quanto cada membro devedor do grupo deve para o usuário atual
+                for other_user_id, amount_to_receive in allocation.owed_to(user_id, min_balance=0.01):
+                    if amount_to_receive > 0.01:  # Apenas valores significativos
+                        other_user = RequestMemo.get_user(other_user_id)
                         
-                        total_negative = sum(abs(balance) for balance in group_balances.values() if balance < 0)
-                        if total_negative > 0:
-                            proportion = abs(other_balance) / total_negative
-                            amount_to_receive = user_balance * proportion
-                            
-                            if amount_to_receive > 0.01:  # Apenas valores significativos
-                                other_user = User.query.get(other_user_id)
-                                
-                                # Verificar se já existe entrada para este devedor
-                                existing = None
-                                for item in others_owe_list:
-                                    if item['debtor_id'] == other_user_id:
-                                        existing = item
-                                        break
-                                
-                                if existing:
-                                    existing['amount'] += amount_to_receive
-                                    existing['amount'] = round(existing['amount'], 2)
-                                else:
-                                    others_owe_list.append({
-                                        'debtor_id': other_user_id,
-                                        'debtor_name': other_user.name,
-                                        'amount': round(amount_to_receive, 2),
-                                        'source': 'group_debt'
-                                    })
+                        # Verificar se já existe entrada para este devedor
+                        existing = None
+                        for item in others_owe_list:
+                            if item['debtor_id'] == other_user_id:
+                                existing = item
+                                break
+                        
+                        if existing:
+                            existing['amount'] += amount_to_receive
+                            existing['amount'] = round(existing['amount'], 2)
+                        else:
+                            others_owe_list.append({
+                                'debtor_id': other_user_id,
+                                'debtor_name': other_user.name,
+                                'amount': round(amount_to_receive, 2),
+                                'source': 'group_debt'
+                            })
     
     # Adicionar dívidas de títulos comprados (purchased_title)
     purchased_debts = Debt.query.filter_by(
@@ -462,7 +433,7 @@ def get_debts_categorized():
     total_others_owe = sum(item['amount'] for item in others_owe_list)
     adjusted_net_balance = total_others_owe - total_you_owe
     
-    print(f"[DEBUG] Totais ajustados - Você deve: R$ {total_you_owe}, Outros devem: R$ {total_others_owe}")
+    logger.debug("Totais ajustados - Você deve: R$ %s, Outros devem: R$ %s", total_you_owe, total_others_owe)
     
     return jsonify({
         'you_owe': you_owe_list,
@@ -470,4 +441,15 @@ def get_debts_categorized():
         'net_balance': round(adjusted_net_balance, 2),
         'total_you_owe': round(total_you_owe, 2),
         'total_others_owe': round(total_others_owe, 2)
-    })
\ No newline at end of file
+    })
+
+
+def _paid_between(debtor_id, creditor_id):
+    """Total já pago individualmente pelo devedor ao credor (memoizado na requisição)"""
+    return RequestMemo.get('paid_between', (debtor_id, creditor_id), lambda: sum(
+        debt.amount for debt in Debt.query.filter_by(
+            debtor_id=debtor_id,
+            creditor_id=creditor_id,
+            status='paid'
+        ).all()
+    ))
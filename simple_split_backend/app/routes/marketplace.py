@@ -5,8 +5,12 @@ from app.models.user import User
 from app.models.receivable import Receivable
 from app.models.debt import Debt
 from app.models.wallet import Wallet, Transaction
+from app.services.balance_service import BalanceService
+from app.services.share_vector_service import ShareVectorService
+from app.services.logging_service import LoggingService
 
 marketplace_bp = Blueprint('marketplace', __name__)
+logger = LoggingService.get_logger(__name__)
 
 @marketplace_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -14,7 +18,7 @@ def get_marketplace_items():
     """Obter todos os títulos à venda no marketplace"""
     try:
         user_id = get_jwt_identity()
-        print(f"[DEBUG] Getting marketplace items for user: {user_id}")
+        logger.debug("Getting marketplace items for user: %s", user_id)
         
         # Buscar todos os recebíveis à venda, exceto os do usuário atual
         receivables = Receivable.query.filter(
@@ -24,11 +28,11 @@ def get_marketplace_items():
         
         # Debug: mostrar todos os recebíveis à venda
         all_for_sale = Receivable.query.filter(Receivable.status == 'for_sale').all()
-        print(f"[DEBUG] Total receivables for sale: {len(all_for_sale)}")
+        logger.debug("Total receivables for sale: %s", len(all_for_sale))
         for r in all_for_sale:
-            print(f"[DEBUG] Receivable {r.id[:8]}... owner: {r.owner_id}, current user: {user_id}, match: {r.owner_id == user_id}")
+            logger.debug("Receivable %s... owner: %s, current user: %s, match: %s", r.id[:8], r.owner_id, user_id, r.owner_id == user_id)
         
-        print(f"[DEBUG] Found {len(receivables)} receivables after filtering")
+        logger.debug("Found %s receivables after filtering", len(receivables))
     
         # Retornar dados anonimizados
         marketplace_items = []
@@ -40,11 +44,11 @@ def get_marketplace_items():
         # Ordenar por lucro estimado (descendente)
         marketplace_items.sort(key=lambda x: x['profit_estimated'], reverse=True)
         
-        print(f"[DEBUG] Returning {len(marketplace_items)} marketplace items")
+        logger.debug("Returning %s marketplace items", len(marketplace_items))
         return jsonify(marketplace_items)
         
     except Exception as e:
-        print(f"[ERROR] Error in get_marketplace_items: {str(e)}")
+        logger.error("Error in get_marketplace_items: %s", e)
         return jsonify({'error': f'Erro ao carregar marketplace: {str(e)}'}), 500
 
 @marketplace_bp.route('/sell', methods=['POST'])
@@ -54,9 +58,9 @@ def create_receivable():
     user_id = get_jwt_identity()
     data = request.get_json()
     
-    print(f"\n🔥 [MARKETPLACE] NOVA CHAMADA CREATE_RECEIVABLE")
-    print(f"[MARKETPLACE] User: {user_id[:8]}...")
-    print(f"[MARKETPLACE] Data recebida: {data}")
+    logger.debug("NOVA CHAMADA CREATE_RECEIVABLE")
+    logger.debug("User: %s...", user_id[:8])
+    logger.debug("Data recebida: %s", data)
     
     # Validar dados
     selling_price = float(data.get('selling_price', 0))
@@ -69,7 +73,7 @@ def create_receivable():
         # Extrair debtor_id do ID consolidado
         debtor_id = debt_id.split('consolidated_')[1]
         debt_id = None  # ⭐ CORREÇÃO: Limpar debt_id para que seja tratado como consolidado
-        print(f"[MARKETPLACE] ID consolidado detectado - debtor_id: {debtor_id[:8]}...")
+        logger.debug("ID consolidado detectado - debtor_id: %s...", debtor_id[:8])
         
     if debtor_id:
         # Validar se o devedor existe e calcular saldo consolidado real
@@ -119,7 +123,7 @@ def create_receivable():
             
     elif debt_id:
         # Dívida individual
-        debt = Debt.query.get(debt_id)
+        debt = ShareVectorService.find_debt(debt_id)
         if not debt:
             return jsonify({'error': 'Dívida não encontrada'}), 404
             
@@ -146,6 +150,13 @@ def create_receivable():
     if selling_price >= total_amount:
         return jsonify({'error': 'Preço de venda deve ser menor que o valor total das dívidas'}), 400
     
+    # Cota ainda em vetor (grupos grandes) vira dívida só agora, já validada a venda
+    if debt_id:
+        debt = ShareVectorService.materialize_debt(debts[0])
+        if not debt:
+            return jsonify({'error': 'Dívida não encontrada'}), 404
+        debt_id = debt.id
+    
     # Criar um único recebível consolidado
     if debtor_id and not debt_id:
         # Recebível consolidado (virtual)
@@ -173,6 +184,9 @@ def create_receivable():
         # Para recebível consolidado, marcar TODAS as dívidas pendentes deste devedor
         from datetime import datetime
         
+        # Cotas ainda em vetor deste devedor com o credor precisam existir como dívidas para serem vendidas
+        ShareVectorService.materialize_between(user_id, debtor_id)
+        
         # Buscar todas as dívidas pendentes deste devedor para este credor
         debts_to_mark = Debt.query.filter_by(
             creditor_id=user_id,
@@ -183,23 +197,26 @@ def create_receivable():
         for debt in debts_to_mark:
             debt.status = 'sold_as_title'
             debt.sold_at = datetime.utcnow()
+            BalanceService.record_debt_status(debt, 'pending', debt.status)
             
-        print(f"[MARKETPLACE] Marcadas {len(debts_to_mark)} dívidas como sold_as_title para debtor {debtor_id}")
+        logger.debug("Marcadas %s dívidas como sold_as_title para debtor %s", len(debts_to_mark), debtor_id)
         
     elif debt_id:
         # Para dívida individual, marcar apenas ela
         from datetime import datetime
         debt = Debt.query.get(debt_id)
         if debt:
+            previous_status = debt.status
             debt.status = 'sold_as_title'
             debt.sold_at = datetime.utcnow()
-            print(f"[MARKETPLACE] Dívida {debt_id[:8]}... marcada como sold_as_title")
+            BalanceService.record_debt_status(debt, previous_status, debt.status)
+            logger.debug("Dívida %s... marcada como sold_as_title", debt_id[:8])
     
     try:
         db.session.commit()
         
-        print(f"🎯 [MARKETPLACE] SUCESSO! Receivable {receivable.id[:8]}... criado")
-        print(f"[MARKETPLACE] ===== FIM DA CHAMADA =====\n")
+        logger.debug("SUCESSO! Receivable %s... criado", receivable.id[:8])
+        logger.debug("===== FIM DA CHAMADA =====")
         
         return jsonify({
             'message': 'Título colocado à venda com sucesso',
@@ -210,7 +227,7 @@ def create_receivable():
             
     except Exception as e:
         db.session.rollback()
-        print(f'[ERROR] Erro ao criar recebível: {e}')
+        logger.error("Erro ao criar recebível: %s", e)
         return jsonify({'error': 'Erro interno do servidor'}), 500
 
 @marketplace_bp.route('/buy/<receivable_id>', methods=['POST'])
@@ -329,8 +346,9 @@ def cancel_receivable(receivable_id):
             for debt in debts_to_revert:
                 debt.status = 'pending'
                 debt.sold_at = None
+                BalanceService.record_debt_status(debt, 'sold_as_title', debt.status)
                 
-            print(f"[MARKETPLACE] Revertidas {len(debts_to_revert)} dívidas para pending")
+            logger.debug("Revertidas %s dívidas para pending", len(debts_to_revert))
             
         elif receivable.debt_id:
             # Recebível individual
@@ -338,7 +356,8 @@ def cancel_receivable(receivable_id):
             if debt and debt.status == 'sold_as_title':
                 debt.status = 'pending'
                 debt.sold_at = None
-                print(f"[MARKETPLACE] Dívida {debt.id[:8]}... revertida para pending")
+                BalanceService.record_debt_status(debt, 'sold_as_title', debt.status)
+                logger.debug("Dívida %s... revertida para pending", debt.id[:8])
         
         receivable.status = 'cancelled'
         db.session.commit()
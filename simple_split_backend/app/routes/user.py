@@ -1,24 +1,34 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
-from app.models.user import User
+from app.models.user import User, GroupMember
 from app.models.wallet import Wallet, Transaction
 from app.models.debt import Debt
 from app.models.receivable import Receivable
 from app.models.expense import Expense
+from app.models.expense_share import ExpenseShare
+from app.models.expense_rollup import ExpenseRollup
+from app.services.balance_service import BalanceService
+from app.services.cache_service import CacheService
+from app.services.etag_service import EtagService
+from app.services.expense_rollup_service import ExpenseRollupService
+from app.services.share_vector_service import ShareVectorService
 from datetime import datetime
+from app.services.logging_service import LoggingService
 
 user_bp = Blueprint('user', __name__)
+logger = LoggingService.get_logger(__name__)
 
 @user_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@EtagService.conditional(EtagService.user_scoped('profile'))
 def get_user_profile():
     """Obter perfil completo do usuário"""
-    print(f"[DEBUG] Acessando /api/user/profile")
+    logger.debug("Acessando /api/user/profile")
     user_id = get_jwt_identity()
-    print(f"[DEBUG] User ID do token: {user_id}")
+    logger.debug("User ID do token: %s", user_id)
     user = User.query.get(user_id)
-    print(f"[DEBUG] Usuário encontrado: {user.name if user else 'Não encontrado'}")
+    logger.debug("Usuário encontrado: %s", user.name if user else 'Não encontrado')
     
     if not user:
         return jsonify({'error': 'Usuário não encontrado'}), 404
@@ -27,31 +37,46 @@ def get_user_profile():
     wallet = Wallet.query.filter_by(user_id=user_id).first()
     
     # Buscar dívidas a pagar (apenas pendentes, excluindo vendidas como títulos)
-    debts_to_pay = Debt.get_pending_debts(debtor_id=user_id).all()
+    debts_to_pay = Debt.get_user_pending_debts(debtor_id=user_id)
     
     # Buscar dívidas a receber (incluindo títulos comprados, mas excluindo vendidas)
-    debts_to_receive = Debt.get_pending_debts(creditor_id=user_id).all()
+    debts_to_receive = Debt.get_user_pending_debts(creditor_id=user_id)
     
     # Buscar títulos de recebíveis comprados
     bought_receivables = Receivable.query.filter_by(buyer_id=user_id, status='sold').all()
     
-    # Calcular totais otimizados para os cards do dashboard (mesma lógica do OTIMIZAR)
-    from app.routes.groups import calculate_user_net_balance
-    from app.models.user import GroupMember
+    # Totais otimizados para os cards do dashboard, em cache até a próxima escrita que afete o usuário
+    totals = CacheService.for_user('profile_totals', user_id, lambda: _calculate_profile_totals(user_id))
+    total_to_pay = totals['total_to_pay']
+    total_to_receive = totals['total_to_receive']
     
-    # Usar lógica otimizada baseada nos saldos dos grupos
-    user_groups = GroupMember.query.filter_by(user_id=user_id).all()
+    return jsonify({
+        'user': user.to_dict(),
+        'wallet': wallet.to_dict() if wallet else {'balance': 0},
+        'debts_to_pay': [debt.to_dict() for debt in debts_to_pay],
+        'debts_to_receive': [debt.to_dict() for debt in debts_to_receive],
+        'bought_receivables': [r.to_dict() for r in bought_receivables],
+        # Campos para os cards do dashboard
+        'total_to_pay': total_to_pay,
+        'total_to_receive': total_to_receive,
+        'net_balance': total_to_receive - total_to_pay,
+        'score_info': {
+            'current_score': user.score,
+            'max_score': 10.0,
+            'description': get_score_description(user.score)
+        }
+    })
+
+
+def _calculate_profile_totals(user_id):
+    """Calcula os totais a pagar e a receber do usuário (mesma lógica do OTIMIZAR)"""
+    # Usar lógica otimizada baseada nos saldos dos grupos (todos os grupos em lote)
+    balances_by_group = BalanceService.get_user_group_balances(user_id)
     
     optimized_total_to_pay = 0.0
     optimized_total_to_receive = 0.0
     
-    for membership in user_groups:
-        group_id = membership.group_id
-        
-        # Usar a função _calculate_group_balances
-        from app.routes.groups import _calculate_group_balances
-        group_balances = _calculate_group_balances(group_id)
-        
+    for group_balances in balances_by_group.values():
         user_balance = group_balances.get(user_id, 0.0)
         
         if user_balance < 0:  # Usuário deve (saldo negativo)
@@ -74,42 +99,26 @@ def get_user_profile():
     for debt in purchased_debts:
         optimized_total_to_receive += debt.amount
     
-    # Usar valores otimizados
-    total_to_pay = optimized_total_to_pay
-    total_to_receive = optimized_total_to_receive
-    
-    return jsonify({
-        'user': user.to_dict(),
-        'wallet': wallet.to_dict() if wallet else {'balance': 0},
-        'debts_to_pay': [debt.to_dict() for debt in debts_to_pay],
-        'debts_to_receive': [debt.to_dict() for debt in debts_to_receive],
-        'bought_receivables': [r.to_dict() for r in bought_receivables],
-        # Campos para os cards do dashboard
-        'total_to_pay': total_to_pay,
-        'total_to_receive': total_to_receive,
-        'net_balance': total_to_receive - total_to_pay,
-        'score_info': {
-            'current_score': user.score,
-            'max_score': 10.0,
-            'description': get_score_description(user.score)
-        }
-    })
+    return {
+        'total_to_pay': optimized_total_to_pay,
+        'total_to_receive': optimized_total_to_receive
+    }
 
 @user_bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_user_profile():
     """Atualizar perfil do usuário"""
-    print(f"[DEBUG] Atualizando perfil do usuário")
+    logger.debug("Atualizando perfil do usuário")
     user_id = get_jwt_identity()
-    print(f"[DEBUG] User ID: {user_id}")
+    logger.debug("User ID: %s", user_id)
     user = User.query.get(user_id)
     
     if not user:
-        print(f"[DEBUG] Usuário não encontrado: {user_id}")
+        logger.debug("Usuário não encontrado: %s", user_id)
         return jsonify({'error': 'Usuário não encontrado'}), 404
     
     data = request.get_json()
-    print(f"[DEBUG] Dados recebidos: {data}")
+    logger.debug("Dados recebidos: %s", data)
     
     # Atualizar campos permitidos
     if 'name' in data:
@@ -125,7 +134,7 @@ def update_user_profile():
     
     try:
         db.session.commit()
-        print(f"[DEBUG] Perfil atualizado com sucesso para usuário {user_id}")
+        logger.debug("Perfil atualizado com sucesso para usuário %s", user_id)
         
         return jsonify({
             'success': True,
@@ -134,7 +143,7 @@ def update_user_profile():
         })
     except Exception as e:
         db.session.rollback()
-        print(f"[DEBUG] Erro ao salvar no banco: {e}")
+        logger.debug("Erro ao salvar no banco: %s", e)
         return jsonify({'error': f'Erro interno: {str(e)}'}), 500
 
 @user_bp.route('/wallet/add-funds', methods=['POST'])
@@ -193,19 +202,19 @@ def get_transactions():
 
 def _handle_virtual_debt_payment(debt_id, user_id):
     """Lidar com pagamento de dívidas virtuais otimizadas"""
-    print(f"[DEBUG] Processando pagamento de dívida virtual: {debt_id}")
+    logger.debug("Processando pagamento de dívida virtual: %s", debt_id)
     
     # Extrair informações do ID virtual: virtual_debtor-id_creditor-id
     # Remover prefixo "virtual_"
     ids_part = debt_id.replace('virtual_', '')
-    print(f"[DEBUG] IDs part após remover virtual_: {ids_part}")
+    logger.debug("IDs part após remover virtual_: %s", ids_part)
     
     # O formato é: debtor_uuid_creditor_uuid
     # Procurar pela posição onde termina o primeiro UUID e começa o segundo
     # UUID tem formato: xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx (36 caracteres)
     
     if len(ids_part) < 73:  # 36 + 1 + 36 = 73 caracteres mínimo
-        print(f"[DEBUG] Erro: ID muito curto para conter 2 UUIDs")
+        logger.debug("Erro: ID muito curto para conter 2 UUIDs")
         return jsonify({'error': 'ID de dívida virtual inválido - muito curto'}), 400
     
     # Procurar o underscore que separa os dois UUIDs
@@ -213,80 +222,60 @@ def _handle_virtual_debt_payment(debt_id, user_id):
     debtor_id = ids_part[:36]
     creditor_id = ids_part[37:]  # Pula o underscore
     
-    print(f"[DEBUG] Debtor ID extraído (36 chars): {debtor_id}")
-    print(f"[DEBUG] Creditor ID extraído (resto): {creditor_id}")
+    logger.debug("Debtor ID extraído (36 chars): %s", debtor_id)
+    logger.debug("Creditor ID extraído (resto): %s", creditor_id)
     
     # Validar formato UUID
     import re
     uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
     
     if not re.match(uuid_pattern, debtor_id) or not re.match(uuid_pattern, creditor_id):
-        print(f"[DEBUG] Erro: UUIDs inválidos")
+        logger.debug("Erro: UUIDs inválidos")
         return jsonify({'error': 'Formato de UUID inválido'}), 400
     
-    print(f"[DEBUG] Debtor ID extraído: {debtor_id}")
-    print(f"[DEBUG] Creditor ID extraído: {creditor_id}")
-    print(f"[DEBUG] User ID atual: {user_id}")
+    logger.debug("Debtor ID extraído: %s", debtor_id)
+    logger.debug("Creditor ID extraído: %s", creditor_id)
+    logger.debug("User ID atual: %s", user_id)
     
     if debtor_id != user_id:
-        print(f"[DEBUG] Erro: debtor_id ({debtor_id}) != user_id ({user_id})")
+        logger.debug("Erro: debtor_id (%s) != user_id (%s)", debtor_id, user_id)
         return jsonify({'error': 'Esta não é sua dívida'}), 403
     
     # Calcular o valor da dívida virtual usando a lógica dos grupos
-    from app.models.user import GroupMember
-    from app.routes.groups import _calculate_group_balances
-    
-    # Encontrar grupos em comum entre devedor e credor
-    debtor_groups = GroupMember.query.filter_by(user_id=debtor_id).all()
-    creditor_groups = GroupMember.query.filter_by(user_id=creditor_id).all()
+    from app.services.allocation_service import AllocationService
     
-    print(f"[DEBUG] Grupos do devedor: {[g.group_id for g in debtor_groups]}")
-    print(f"[DEBUG] Grupos do credor: {[g.group_id for g in creditor_groups]}")
+    # Saldos de todos os grupos do devedor; os grupos em comum são aqueles em que o credor também é membro
+    debtor_balances_by_group = BalanceService.get_user_group_balances(debtor_id)
+    common_groups = [
+        group_id for group_id, group_balances in debtor_balances_by_group.items()
+        if creditor_id in group_balances
+    ]
     
-    common_groups = []
-    for dg in debtor_groups:
-        for cg in creditor_groups:
-            if dg.group_id == cg.group_id:
-                common_groups.append(dg.group_id)
-    
-    print(f"[DEBUG] Grupos em comum: {common_groups}")
+    logger.debug("Grupos em comum: %s", common_groups)
     
     if not common_groups:
-        print(f"[DEBUG] Erro: usuários não compartilham grupos")
+        logger.debug("Erro: usuários não compartilham grupos")
         return jsonify({'error': 'Usuários não compartilham grupos'}), 400
     
     # Calcular o valor total devido entre os usuários
     total_amount_owed = 0.0
     
     for group_id in common_groups:
-        print(f"[DEBUG] Calculando balances para grupo: {group_id}")
-        group_balances = _calculate_group_balances(group_id)
-        debtor_balance = group_balances.get(debtor_id, 0.0)
-        creditor_balance = group_balances.get(creditor_id, 0.0)
-        
-        print(f"[DEBUG] Saldo do devedor no grupo {group_id}: {debtor_balance}")
-        print(f"[DEBUG] Saldo do credor no grupo {group_id}: {creditor_balance}")
+        allocation = AllocationService.for_group(debtor_balances_by_group[group_id])
         
-        # Se o devedor tem saldo negativo e o credor positivo
-        if debtor_balance < 0 and creditor_balance > 0:
-            # Calcular proporção que o devedor deve ao credor
-            total_negative = sum(abs(balance) for balance in group_balances.values() if balance < 0)
-            print(f"[DEBUG] Total negativo no grupo: {total_negative}")
-            
-            if total_negative > 0:
-                proportion = abs(debtor_balance) / total_negative
-                amount_owed = creditor_balance * proportion
-                print(f"[DEBUG] Proporção: {proportion}, Valor devido: {amount_owed}")
-                total_amount_owed += amount_owed
+        # Parcela do crédito do credor que cabe ao devedor (0 se o devedor não deve ou o credor não recebe)
+        amount_owed = allocation.amount_owed(debtor_id, creditor_id)
+        logger.debug("Grupo %s: total negativo = %s, valor devido = %s", group_id, allocation.total_negative, amount_owed)
+        total_amount_owed += amount_owed
     
-    print(f"[DEBUG] Total amount owed calculado: {total_amount_owed}")
+    logger.debug("Total amount owed calculado: %s", total_amount_owed)
     
     if total_amount_owed <= 0.01:
-        print(f"[DEBUG] Erro: não há dívida para pagar")
+        logger.debug("Erro: não há dívida para pagar")
         return jsonify({'error': 'Não há dívida para pagar'}), 400
     
     amount = round(total_amount_owed, 2)
-    print(f"[DEBUG] Valor calculado a pagar: {amount}")
+    logger.debug("Valor calculado a pagar: %s", amount)
     
     # Verificar saldo da carteira
     wallet = Wallet.query.filter_by(user_id=user_id).first()
@@ -316,16 +305,16 @@ def _handle_virtual_debt_payment(debt_id, user_id):
     from app.models.expense import Expense
     sample_expense = None
     
-    print(f"[DEBUG] Procurando despesa nos grupos: {common_groups}")
+    logger.debug("Procurando despesa nos grupos: %s", common_groups)
     
     for group_id in common_groups:
         sample_expense = Expense.query.filter_by(group_id=group_id).first()
-        print(f"[DEBUG] Grupo {group_id}: despesa encontrada = {sample_expense.id if sample_expense else 'None'}")
+        logger.debug("Grupo %s: despesa encontrada = %s", group_id, sample_expense.id if sample_expense else 'None')
         if sample_expense:
             break
     
     if sample_expense:
-        print(f"[DEBUG] Criando dívida virtual com expense_id: {sample_expense.id}")
+        logger.debug("Criando dívida virtual com expense_id: %s", sample_expense.id)
         paid_debt = Debt(
             debtor_id=user_id,
             creditor_id=creditor_id,
@@ -333,12 +322,14 @@ def _handle_virtual_debt_payment(debt_id, user_id):
             status='paid',
             source='virtual_payment',
             paid_at=datetime.utcnow(),
-            expense_id=sample_expense.id  # Usar uma despesa existente como referência
+            expense_id=sample_expense.id,  # Usar uma despesa existente como referência
+            group_id=sample_expense.group_id
         )
         db.session.add(paid_debt)
-        print(f"[DEBUG] Dívida virtual adicionada à sessão")
+        BalanceService.record_debt_status(paid_debt, None, paid_debt.status)
+        logger.debug("Dívida virtual adicionada à sessão")
     else:
-        print(f"[DEBUG] Nenhuma despesa encontrada nos grupos, não criando dívida física")
+        logger.debug("Nenhuma despesa encontrada nos grupos, não criando dívida física")
     
     # 4. Adicionar log
     from app.models.log import Log
@@ -354,7 +345,7 @@ def _handle_virtual_debt_payment(debt_id, user_id):
     
     try:
         db.session.commit()
-        print(f"[DEBUG] Commit realizado com sucesso!")
+        logger.debug("Commit realizado com sucesso!")
         
         # Verificar se a dívida foi salva
         if sample_expense:
@@ -364,14 +355,14 @@ def _handle_virtual_debt_payment(debt_id, user_id):
                 source='virtual_payment',
                 status='paid'
             ).order_by(Debt.created_at.desc()).first()
-            print(f"[DEBUG] Dívida virtual salva no banco: {saved_debt.id if saved_debt else 'NÃO ENCONTRADA'}")
+            logger.debug("Dívida virtual salva no banco: %s", saved_debt.id if saved_debt else 'NÃO ENCONTRADA')
         
     except Exception as commit_error:
-        print(f"[DEBUG] Erro no commit: {commit_error}")
+        logger.debug("Erro no commit: %s", commit_error)
         db.session.rollback()
         raise commit_error
     
-    print(f"[DEBUG] Pagamento virtual processado com sucesso!")
+    logger.debug("Pagamento virtual processado com sucesso!")
     
     return jsonify({
         'success': True,
@@ -388,30 +379,30 @@ def _handle_virtual_debt_payment(debt_id, user_id):
 @jwt_required()
 def pay_debt(debt_id):
     """Pagar uma dívida via wallet"""
-    print(f"[DEBUG] Tentando pagar dívida: {debt_id}")
+    logger.debug("Tentando pagar dívida: %s", debt_id)
     user_id = get_jwt_identity()
-    print(f"[DEBUG] User ID: {user_id}")
+    logger.debug("User ID: %s", user_id)
     
     try:
         # Verificar se é uma dívida virtual
         if debt_id.startswith('virtual_'):
-            print(f"[DEBUG] Detectada dívida virtual: {debt_id}")
+            logger.debug("Detectada dívida virtual: %s", debt_id)
             return _handle_virtual_debt_payment(debt_id, user_id)
         
         # Buscar dívida real no banco
-        debt = Debt.query.get(debt_id)
+        debt = ShareVectorService.find_debt(debt_id)
         if not debt:
-            print(f"[DEBUG] Dívida não encontrada: {debt_id}")
+            logger.debug("Dívida não encontrada: %s", debt_id)
             return jsonify({'error': 'Dívida não encontrada'}), 404
 
-        print(f"[DEBUG] Dívida encontrada - Devedor: {debt.debtor_id}, Credor: {debt.creditor_id}, Valor: {debt.amount}")
+        logger.debug("Dívida encontrada - Devedor: %s, Credor: %s, Valor: %s", debt.debtor_id, debt.creditor_id, debt.amount)
 
         if debt.debtor_id != user_id:
-            print(f"[DEBUG] Usuário não é o devedor")
+            logger.debug("Usuário não é o devedor")
             return jsonify({'error': 'Esta não é sua dívida'}), 403
 
         if debt.status != 'pending':
-            print(f"[DEBUG] Dívida não está pendente")
+            logger.debug("Dívida não está pendente")
             return jsonify({'error': 'Dívida já foi paga ou cancelada'}), 400
 
         # Verificar wallet
@@ -419,9 +410,15 @@ def pay_debt(debt_id):
         if not wallet or wallet.balance < debt.amount:
             return jsonify({'error': 'Saldo insuficiente na carteira'}), 400
 
+        # Cota ainda em vetor vira dívida só agora, para ser paga
+        debt = ShareVectorService.materialize_debt(debt)
+        if not debt:
+            return jsonify({'error': 'Dívida não encontrada'}), 404
+
         # Marcar como pago
         debt.status = 'paid'
         debt.paid_at = datetime.utcnow()
+        BalanceService.record_debt_status(debt, 'pending', debt.status)
         
         # Reduzir saldo da wallet
         wallet.balance -= debt.amount
@@ -438,9 +435,9 @@ def pay_debt(debt_id):
         
         # Notificar o grupo sobre o pagamento (para atualização em tempo real)
         group_id = None
-        if debt.expense and debt.expense.group_id:
-            group_id = debt.expense.group_id
-            print(f"[DEBUG] Pagamento afeta o grupo: {group_id}")
+        if debt.group_id:
+            group_id = debt.group_id
+            logger.debug("Pagamento afeta o grupo: %s", group_id)
             
             # Adicionar log/notificação para o grupo
             from app.models.log import Log
@@ -454,7 +451,7 @@ def pay_debt(debt_id):
             db.session.add(log_entry)
         
         db.session.commit()
-        print(f"[DEBUG] Pagamento processado com sucesso!")
+        logger.debug("Pagamento processado com sucesso!")
 
         return jsonify({
             'success': True,
@@ -470,7 +467,7 @@ def pay_debt(debt_id):
         })
 
     except Exception as e:
-        print(f"[ERROR] Erro: {str(e)}")
+        logger.error("Erro: %s", e)
         db.session.rollback()
         return jsonify({'error': f'Erro: {str(e)}'}), 500
 
@@ -510,30 +507,26 @@ def get_user_summary():
     total_to_receive = db.session.query(db.func.sum(Debt.amount))\
         .filter(Debt.creditor_id == user_id, Debt.status == 'pending').scalar() or 0
     
-    # Total gasto: soma da parte do usuário nas despesas (tanto como pagador quanto devedor)
-    # Total gasto (parte real do usuário nas despesas)
-    # 1. Parte das despesas que ele pagou (valor dividido pelo número de pessoas)
-    expenses_paid = Expense.query.filter_by(payer_id=user_id).all()
-    spent_as_payer = 0
-    for expense in expenses_paid:
-        # Conta quantas pessoas participaram (pagador + devedores)
-        debt_count = len(expense.debts)
-        total_people = debt_count + 1  # +1 para o pagador
-        spent_as_payer += expense.amount / total_people
+    # Cotas ainda em vetores (grupos grandes) também estão pendentes, sem precisar materializá-las
+    user_groups = db.select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+    for debt, _ in ShareVectorService.pending_debts(ExpenseShare.group_id.in_(user_groups)):
+        if debt.debtor_id == user_id:
+            total_to_pay += debt.amount
+        elif debt.creditor_id == user_id:
+            total_to_receive += debt.amount
     
-    # 2. Parte das despesas que ele deve (já paga ou pendente)
-    spent_as_debtor = db.session.query(db.func.sum(Debt.amount))\
-        .filter_by(debtor_id=user_id).scalar() or 0
-    
-    total_spent = spent_as_payer + spent_as_debtor
+    # Total gasto: soma da parte do usuário nas despesas (tanto como pagador quanto devedor),
+    # registrada na divisão de cada despesa na tabela de totais mensais
+    _, _, total_spent = ExpenseRollupService.totals(ExpenseRollup.user_id == user_id)
     
     # Saldo da carteira
     wallet = Wallet.query.filter_by(user_id=user_id).first()
     wallet_balance = wallet.balance if wallet else 0
     
     # Títulos de recebíveis comprados
-    bought_receivables = Receivable.query.filter_by(buyer_id=user_id, status='sold').all()
-    potential_profit = sum([r.nominal_amount - r.selling_price for r in bought_receivables])
+    potential_profit = db.session.query(
+        db.func.coalesce(db.func.sum(Receivable.nominal_amount - Receivable.selling_price), 0)
+    ).filter(Receivable.buyer_id == user_id, Receivable.status == 'sold').scalar()
     
     return jsonify({
         'wallet_balance': wallet_balance,
@@ -0,0 +1,77 @@
+class GroupAllocation:
+    """
+    Quem deve para quem em um grupo, dividindo proporcionalmente os saldos líquidos:
+    cada devedor paga a cada credor na proporção do saldo do credor (e vice-versa).
+    Os totais são calculados uma única vez; cada consulta é O(membros).
+    """
+
+    def __init__(self, balances):
+        self.balances = balances
+        # Listas na ordem dos membros, para manter a ordem das respostas
+        self.creditors = [(user_id, balance) for user_id, balance in balances.items() if balance > 0]
+        self.debtors = [(user_id, balance) for user_id, balance in balances.items() if balance < 0]
+        self.total_positive = sum(balance for _, balance in self.creditors)
+        self.total_negative = sum(abs(balance) for _, balance in self.debtors)
+
+    def owed_by(self, debtor_id, min_balance=0.0):
+        """
+        Quanto o devedor deve a cada credor, repartindo a sua dívida pelos saldos positivos.
+        Retorna [(credor, valor)] para credores com saldo acima de min_balance.
+        """
+        debtor_balance = self.balances.get(debtor_id, 0.0)
+        if debtor_balance >= 0 or self.total_positive <= 0:
+            return []
+
+        return [
+            (creditor_id, abs(debtor_balance) * (creditor_balance / self.total_positive))
+            for creditor_id, creditor_balance in self.creditors
+            if creditor_id != debtor_id and creditor_balance > min_balance
+        ]
+
+    def owed_to(self, creditor_id, min_balance=0.0):
+        """
+        Quanto cada devedor deve ao credor, repartindo o crédito pelos saldos negativos.
+        Retorna [(devedor, valor)] para devedores com saldo abaixo de -min_balance.
+        """
+        creditor_balance = self.balances.get(creditor_id, 0.0)
+        if creditor_balance <= 0 or self.total_negative <= 0:
+            return []
+
+        return [
+            (debtor_id, creditor_balance * (abs(debtor_balance) / self.total_negative))
+            for debtor_id, debtor_balance in self.debtors
+            if debtor_id != creditor_id and debtor_balance < -min_balance
+        ]
+
+    def amount_owed(self, debtor_id, creditor_id):
+        """Valor que o devedor deve ao credor (parcela do crédito do credor), ou 0.0"""
+        debtor_balance = self.balances.get(debtor_id, 0.0)
+        creditor_balance = self.balances.get(creditor_id, 0.0)
+        if debtor_balance >= 0 or creditor_balance <= 0 or self.total_negative <= 0:
+            return 0.0
+        return creditor_balance * (abs(debtor_balance) / self.total_negative)
+
+    def matrix(self):
+        """Matriz compacta {(devedor, credor): valor} de todas as obrigações do grupo"""
+        return {
+            (debtor_id, creditor_id): amount
+            for debtor_id, _ in self.debtors
+            for creditor_id, amount in self.owed_by(debtor_id)
+        }
+
+
+class AllocationService:
+    """Cálculo das obrigações par a par a partir dos saldos dos grupos"""
+
+    @staticmethod
+    def for_group(group_balances):
+        """Alocação de um grupo a partir dos seus saldos ({user_id: saldo})"""
+        return GroupAllocation(group_balances)
+
+    @staticmethod
+    def for_groups(balances_by_group):
+        """Alocações de vários grupos ({group_id: GroupAllocation}), calculadas uma vez cada"""
+        return {
+            group_id: GroupAllocation(group_balances)
+            for group_id, group_balances in balances_by_group.items()
+        }
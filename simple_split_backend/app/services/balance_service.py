@@ -0,0 +1,416 @@
+from app import db
+from app.models.group_balance import GroupBalance
+from app.services.request_memo import RequestMemo
+from app.services.cache_service import CacheService
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+# Status de dívida que entram como correção no saldo do grupo
+SETTLED_STATUSES = ('paid', 'sold_as_title')
+
+
+class BalanceService:
+    """
+    Saldos por grupo materializados na tabela group_balances: quanto cada membro pagou,
+    menos a sua parte nas despesas (como na divisão de cada uma), mais as correções.
+    As rotinas de escrita atualizam o ledger na mesma transação da alteração,
+    e a leitura de um saldo é uma única consulta indexada por group_id.
+    """
+
+    @staticmethod
+    def get_group_balances(group_id):
+        """Saldo líquido de cada membro do grupo (lido do ledger, memoizado na requisição)"""
+        return RequestMemo.get('group_balances', group_id, lambda: BalanceService._load_group_balances(group_id))
+
+    @staticmethod
+    def _load_group_balances(group_id):
+        rows = BalanceService._ledger_rows([group_id])
+
+        if not rows:
+            # Grupo ainda sem ledger (banco anterior à tabela): materializar agora
+            rows = BalanceService._rebuild_and_commit(group_id)
+
+        return {user_id: balance for _, user_id, balance in rows}
+
+    @staticmethod
+    def get_user_group_balances(user_id):
+        """
+        Saldos de todos os grupos do usuário ({group_id: {user_id: saldo}}) com um número
+        constante de consultas, independente de quantos grupos ele participa.
+        """
+        return RequestMemo.get('user_group_balances', user_id,
+                               lambda: BalanceService._load_user_group_balances(user_id))
+
+    @staticmethod
+    def _load_user_group_balances(user_id):
+        group_ids = RequestMemo.user_group_ids(user_id)
+        if not group_ids:
+            return {}
+
+        balances_by_group = {group_id: {} for group_id in group_ids}
+        for group_id, member_id, balance in BalanceService._ledger_rows(group_ids):
+            balances_by_group[group_id][member_id] = balance
+
+        for group_id, balances in balances_by_group.items():
+            if not balances:
+                # Grupo ainda sem ledger: materializar agora
+                for _, member_id, balance in BalanceService._rebuild_and_commit(group_id):
+                    balances[member_id] = balance
+
+        # Os saldos de cada grupo também ficam disponíveis para get_group_balances
+        for group_id, balances in balances_by_group.items():
+            RequestMemo.set('group_balances', group_id, balances)
+
+        return balances_by_group
+
+    @staticmethod
+    def pending_user_group_balances(user_id):
+        """
+        Versão em lote de pending_group_balances para todos os grupos do usuário
+        ({group_id: {user_id: saldo}}), em uma única consulta agregada mais a leitura dos vetores de cotas.
+        """
+        from app.models.debt import Debt
+        from app.models.expense_share import ExpenseShare
+        from app.models.user import GroupMember
+        from app.services.share_vector_service import ShareVectorService
+
+        zero = db.literal(0.0, db.Float)
+        user_groups = db.select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+        creditor_member = db.aliased(GroupMember)
+        debtor_member = db.aliased(GroupMember)
+
+        # Dívidas pendentes entre dois membros do mesmo grupo, uma linha por grupo em comum
+        pending_debts = db.select(creditor_member.group_id, Debt.creditor_id, Debt.debtor_id, Debt.amount)\
+            .join(creditor_member, creditor_member.user_id == Debt.creditor_id)\
+            .join(debtor_member, db.and_(
+                debtor_member.user_id == Debt.debtor_id,
+                debtor_member.group_id == creditor_member.group_id
+            ))\
+            .where(Debt.status == 'pending', creditor_member.group_id.in_(user_groups))\
+            .subquery()
+
+        entries = db.union_all(
+            db.select(GroupMember.group_id.label('group_id'), GroupMember.user_id.label('user_id'), zero.label('amount'))
+                .where(GroupMember.group_id.in_(user_groups)),
+            db.select(pending_debts.c.group_id, pending_debts.c.creditor_id, pending_debts.c.amount),
+            db.select(pending_debts.c.group_id, pending_debts.c.debtor_id, -pending_debts.c.amount)
+        ).subquery()
+
+        rows = db.session.execute(
+            db.select(entries.c.group_id, entries.c.user_id, db.func.sum(entries.c.amount))
+            .group_by(entries.c.group_id, entries.c.user_id)
+        ).all()
+
+        balances_by_group = defaultdict(dict)
+        groups_by_member = defaultdict(set)
+        for group_id, member_id, amount in rows:
+            balances_by_group[group_id][member_id] = amount or 0.0
+            groups_by_member[member_id].add(group_id)
+
+        # Cotas ainda em vetores (grupos grandes) contam em cada grupo em comum do par
+        members = db.select(GroupMember.user_id).where(GroupMember.group_id.in_(user_groups))
+        for debt, _ in ShareVectorService.pending_debts(ExpenseShare.creditor_id.in_(members)):
+            for group_id in groups_by_member[debt.creditor_id] & groups_by_member.get(debt.debtor_id, set()):
+                balances_by_group[group_id][debt.creditor_id] += debt.amount
+                balances_by_group[group_id][debt.debtor_id] -= debt.amount
+
+        return dict(balances_by_group)
+
+    @staticmethod
+    def compute_group_balances(group_id):
+        """Recalcula do zero o saldo de cada membro, sem usar o ledger"""
+        members, paid_by_user, share_by_user, adjustments = BalanceService._compute_components(group_id)
+        return {
+            user_id: paid_by_user[user_id] - share_by_user[user_id] + adjustments[user_id]
+            for user_id in members
+        }
+
+    @staticmethod
+    def pending_group_balances(group_id):
+        """
+        Saldo de cada membro considerando apenas as dívidas PENDENTES entre membros do grupo
+        (positivo = recebe), em uma única consulta agregada mais a leitura dos vetores de cotas.
+        """
+        from app.models.debt import Debt
+        from app.models.expense_share import ExpenseShare
+        from app.models.user import GroupMember
+        from app.services.share_vector_service import ShareVectorService
+
+        zero = db.literal(0.0, db.Float)
+        member_ids = db.select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+        pending_debts = db.select(Debt).where(
+            Debt.status == 'pending',
+            Debt.creditor_id.in_(member_ids),
+            Debt.debtor_id.in_(member_ids)
+        ).subquery()
+
+        entries = db.union_all(
+            db.select(GroupMember.user_id.label('user_id'), zero.label('amount'))
+                .where(GroupMember.group_id == group_id),
+            db.select(pending_debts.c.creditor_id, pending_debts.c.amount),
+            db.select(pending_debts.c.debtor_id, -pending_debts.c.amount)
+        ).subquery()
+
+        rows = db.session.execute(
+            db.select(entries.c.user_id, db.func.sum(entries.c.amount))
+            .group_by(entries.c.user_id)
+        ).all()
+
+        balances = {user_id: amount or 0.0 for user_id, amount in rows}
+
+        # Cotas ainda em vetores (grupos grandes) entram como dívidas pendentes entre membros
+        for debt, _ in ShareVectorService.pending_debts(ExpenseShare.creditor_id.in_(member_ids)):
+            if debt.debtor_id in balances:
+                balances[debt.creditor_id] += debt.amount
+                balances[debt.debtor_id] -= debt.amount
+
+        return balances
+
+    @staticmethod
+    def rebuild_group(group_id):
+        """Reconstrói as linhas do ledger de um grupo (sem commit)"""
+        RequestMemo.invalidate('group_balances', 'user_group_balances')
+        members, paid_by_user, share_by_user, adjustments = BalanceService._compute_components(group_id)
+
+        previous_version = db.session.query(db.func.max(GroupBalance.version))\
+            .filter(GroupBalance.group_id == group_id).scalar() or 0
+        GroupBalance.query.filter_by(group_id=group_id).delete(synchronize_session=False)
+
+        now = datetime.utcnow()
+        rows = []
+        for user_id in members:
+            paid = paid_by_user[user_id]
+            share = share_by_user[user_id]
+            adjustment = adjustments[user_id]
+            rows.append(GroupBalance(
+                group_id=group_id,
+                user_id=user_id,
+                paid_total=paid,
+                share_total=share,
+                adjustment=adjustment,
+                balance=paid - share + adjustment,
+                version=previous_version + 1,
+                updated_at=now
+            ))
+        db.session.add_all(rows)
+        return [(row.user_id, row.balance) for row in rows]
+
+    @staticmethod
+    def rebuild_all():
+        """Reconstrói o ledger de todos os grupos e confirma a transação"""
+        from app.models.group import Group
+
+        group_ids = [group_id for (group_id,) in db.session.query(Group.id).all()]
+        for group_id in group_ids:
+            BalanceService.rebuild_group(group_id)
+        db.session.commit()
+        return len(group_ids)
+
+    @staticmethod
+    def record_expense(expense, parts, sign=1):
+        """
+        Registra (sign=1) ou remove (sign=-1) uma despesa no ledger do grupo (sem commit).
+        parts ([(user_id, valor)]) é a parte de cada participante, como devolvida por SplitService.split_rows.
+        """
+        BalanceService.record_expenses(expense.group_id, {expense.payer_id: expense.amount}, parts, sign)
+
+    @staticmethod
+    def record_expenses(group_id, paid_by_user, parts, sign=1):
+        """
+        Registra várias despesas de uma vez ({pagador: total pago} e as partes de todas as despesas),
+        com um único UPDATE em massa e um único refresh (sem commit).
+        """
+        deltas = defaultdict(lambda: [0.0, 0.0])
+        for user_id, amount in paid_by_user.items():
+            deltas[user_id][0] += sign * amount
+        for user_id, amount in parts:
+            deltas[user_id][1] += sign * amount
+
+        table = GroupBalance.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.group_id == db.bindparam('b_group_id'), table.c.user_id == db.bindparam('b_user_id'))
+            .values(
+                paid_total=table.c.paid_total + db.bindparam('b_paid'),
+                share_total=table.c.share_total + db.bindparam('b_share')
+            ),
+            [
+                {'b_group_id': group_id, 'b_user_id': user_id, 'b_paid': paid, 'b_share': share}
+                for user_id, (paid, share) in deltas.items()
+            ]
+        )
+        BalanceService._refresh_group(group_id)
+
+    @staticmethod
+    def remove_expense(expense):
+        """Desfaz no ledger uma despesa e as correções das suas dívidas antes de removê-la (sem commit)"""
+        from app.models.expense import Expense
+        from app.services.split_service import SplitService
+
+        for debt in expense.debts:
+            BalanceService.record_debt_status(debt, debt.status, None)
+        parts = SplitService.stored_parts(Expense.id == expense.id).get(expense.id, [])
+        BalanceService.record_expense(expense, parts, sign=-1)
+
+    @staticmethod
+    def record_debt_status(debt, old_status, new_status=None):
+        """
+        Atualiza o ledger após a mudança de status de uma dívida (sem commit).
+        Dívidas pagas ou vendidas corrigem o saldo no grupo da dívida; pagamentos
+        virtuais corrigem também todos os grupos em comum entre devedor e credor.
+        new_status=None indica que a dívida está sendo removida.
+        """
+        group_delta = BalanceService._settled_weight(new_status) - BalanceService._settled_weight(old_status)
+        virtual_delta = 0
+        if debt.source == 'virtual_payment':
+            virtual_delta = (new_status == 'paid') - (old_status == 'paid')
+
+        if not group_delta and not virtual_delta:
+            return
+
+        amount = debt.amount
+        deltas = defaultdict(int)
+
+        if group_delta and debt.group_id:
+            deltas[debt.group_id] += group_delta
+
+        if virtual_delta:
+            for group_id in BalanceService._common_group_ids(debt.debtor_id, debt.creditor_id):
+                deltas[group_id] += virtual_delta
+
+        for group_id, delta in deltas.items():
+            if not delta:
+                continue
+            # Quem pagou (ou teve a dívida vendida) melhora; quem recebeu piora
+            BalanceService._increment(group_id, debt.debtor_id, adjustment=delta * amount)
+            BalanceService._increment(group_id, debt.creditor_id, adjustment=-delta * amount)
+            BalanceService._refresh_group(group_id)
+
+    @staticmethod
+    def _settled_weight(status):
+        return 1 if status in SETTLED_STATUSES else 0
+
+    @staticmethod
+    def _common_group_ids(user_a, user_b):
+        """Grupos em que os dois usuários são membros"""
+        from app.models.user import GroupMember
+
+        groups_a = db.session.query(GroupMember.group_id).filter(GroupMember.user_id == user_a)
+        rows = db.session.query(GroupMember.group_id).filter(
+            GroupMember.user_id == user_b,
+            GroupMember.group_id.in_(groups_a)
+        ).distinct().all()
+        return [group_id for (group_id,) in rows]
+
+    @staticmethod
+    def _increment(group_id, user_id, paid_total=0.0, adjustment=0.0):
+        """Soma valores às colunas do membro; não membros não têm linha e são ignorados"""
+        db.session.execute(
+            db.update(GroupBalance)
+            .where(GroupBalance.group_id == group_id, GroupBalance.user_id == user_id)
+            .values(
+                paid_total=GroupBalance.paid_total + paid_total,
+                adjustment=GroupBalance.adjustment + adjustment
+            )
+        )
+
+    @staticmethod
+    def _refresh_group(group_id):
+        """Recalcula a coluna balance do grupo: pago - partes nas despesas + correções"""
+        refreshed = db.session.execute(
+            db.update(GroupBalance)
+            .where(GroupBalance.group_id == group_id)
+            .values(
+                balance=GroupBalance.paid_total - GroupBalance.share_total + GroupBalance.adjustment,
+                version=GroupBalance.version + 1,
+                updated_at=datetime.utcnow()
+            )
+        ).rowcount
+
+        if not refreshed:
+            return  # Ledger do grupo ainda não materializado
+
+        RequestMemo.invalidate('group_balances', 'user_group_balances')
+        CacheService.touch(group_ids=[group_id])
+
+    @staticmethod
+    def _rebuild_and_commit(group_id):
+        """Materializa o ledger de um grupo; se outra requisição fez o mesmo, relê o resultado"""
+        try:
+            BalanceService.rebuild_group(group_id)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        return BalanceService._ledger_rows([group_id])
+
+    @staticmethod
+    def _ledger_rows(group_ids):
+        """Linhas (group_id, user_id, saldo) do ledger, na ordem de entrada dos membros no grupo"""
+        from app.models.user import GroupMember
+
+        return db.session.query(GroupBalance.group_id, GroupBalance.user_id, GroupBalance.balance)\
+            .join(GroupMember, db.and_(
+                GroupMember.group_id == GroupBalance.group_id,
+                GroupMember.user_id == GroupBalance.user_id
+            ))\
+            .filter(GroupBalance.group_id.in_(group_ids))\
+            .order_by(GroupMember.joined_at, GroupMember.id).all()
+
+    @staticmethod
+    def _compute_components(group_id):
+        """
+        Calcula do zero as parcelas do saldo de cada membro: (membros, quanto cada um pagou,
+        sua parte nas despesas, correções). Pagamentos e correções vêm de uma única consulta
+        agregada; as partes, da divisão gravada de cada despesa (SplitService.stored_parts).
+        """
+        from app.models.expense import Expense
+        from app.models.debt import Debt
+        from app.models.user import GroupMember
+        from app.services.split_service import SplitService
+
+        zero = db.literal(0.0, db.Float)
+        member_ids = db.select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+        group_debts = db.select(Debt).where(
+            Debt.group_id == group_id,
+            Debt.status.in_(SETTLED_STATUSES)
+        ).subquery()
+        virtual_payments = db.select(Debt).where(
+            Debt.source == 'virtual_payment',
+            Debt.status == 'paid',
+            Debt.debtor_id.in_(member_ids),
+            Debt.creditor_id.in_(member_ids)
+        ).subquery()
+
+        # Cada linha é um lançamento (usuário, valor pago, correção); quem pagou a dívida
+        # (ou a teve vendida) melhora e quem recebeu piora
+        entries = db.union_all(
+            db.select(GroupMember.user_id.label('user_id'), zero.label('paid'), zero.label('adjustment'))
+                .where(GroupMember.group_id == group_id),
+            db.select(Expense.payer_id, Expense.amount, zero).where(Expense.group_id == group_id),
+            db.select(group_debts.c.debtor_id, zero, group_debts.c.amount),
+            db.select(group_debts.c.creditor_id, zero, -group_debts.c.amount),
+            db.select(virtual_payments.c.debtor_id, zero, virtual_payments.c.amount),
+            db.select(virtual_payments.c.creditor_id, zero, -virtual_payments.c.amount)
+        ).subquery()
+
+        rows = db.session.execute(
+            db.select(
+                entries.c.user_id,
+                db.func.sum(entries.c.paid),
+                db.func.sum(entries.c.adjustment)
+            )
+            .where(entries.c.user_id.in_(member_ids))
+            .group_by(entries.c.user_id)
+        ).all()
+
+        members = [user_id for user_id, _, _ in rows]
+        paid_by_user = defaultdict(float, {user_id: paid or 0.0 for user_id, paid, _ in rows})
+        adjustments = defaultdict(float, {user_id: adjustment or 0.0 for user_id, _, adjustment in rows})
+
+        share_by_user = defaultdict(float)
+        for parts in SplitService.stored_parts(Expense.group_id == group_id).values():
+            for user_id, amount in parts:
+                share_by_user[user_id] += amount
+
+        return members, paid_by_user, share_by_user, adjustments
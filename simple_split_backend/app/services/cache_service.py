@@ -0,0 +1,574 @@
+from app import db
+from app.models.change_counter import ChangeCounter
+from app.services.request_memo import RequestMemo
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class CacheBackend:
+    """Interface dos backends de cache (valores já serializados como texto)"""
+
+    def get(self, key):
+        """Retorna o valor guardado ou None"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class NullCacheBackend(CacheBackend):
+    """Backend que não guarda nada (cache desligado)"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Cache em memória do processo, limitado a max_entries com despejo LRU"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()  # chave -> (valor, expira_em)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'evictions': self.evictions
+        }
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Cache compartilhado entre os workers do gunicorn em um arquivo SQLite local.
+    Também guarda um log de invalidações (delete/clear), lido pelo TieredCacheBackend
+    de cada worker para descartar as suas cópias locais.
+    """
+
+    # Quantas invalidações manter no log
+    INVALIDATION_LOG_SIZE = 1000
+    # A cada quantas gravações remover entradas expiradas e excedentes
+    PRUNE_EVERY = 200
+
+    def __init__(self, path, max_entries=20000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_invalidations ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT)'  # key NULL = limpar tudo
+            )
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key):
+        """(valor, segundos restantes ou None) da chave, ou None se ausente/expirada"""
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is None:
+            return value, None
+        remaining = expires_at - time.time()
+        return (value, remaining) if remaining > 0 else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, expires_at)
+            )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            connection.execute('INSERT INTO cache_invalidations (key) VALUES (?)', (key,))
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM cache_entries')
+            connection.execute('INSERT INTO cache_invalidations (key) VALUES (NULL)')
+
+    def invalidations_since(self, seq):
+        """
+        Invalidações posteriores a seq: (último seq, chaves, limpar_tudo).
+        Se o log já foi truncado além de seq, pede para limpar tudo.
+        """
+        connection = self._connection()
+        rows = connection.execute(
+            'SELECT seq, key FROM cache_invalidations WHERE seq > ? ORDER BY seq', (seq,)
+        ).fetchall()
+        if not rows:
+            return seq, [], False
+        oldest = connection.execute('SELECT MIN(seq) FROM cache_invalidations').fetchone()[0]
+        clear_all = oldest > seq + 1 or any(key is None for _, key in rows)
+        return rows[-1][0], [key for _, key in rows if key is not None], clear_all
+
+    def last_invalidation(self):
+        row = self._connection().execute('SELECT MAX(seq) FROM cache_invalidations').fetchone()
+        return row[0] or 0
+
+    def prune(self):
+        """Remove entradas expiradas, as mais antigas acima de max_entries e o log antigo"""
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?',
+                               (time.time(),))
+            connection.execute(
+                'DELETE FROM cache_entries WHERE rowid IN ('
+                'SELECT rowid FROM cache_entries ORDER BY rowid DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            connection.execute(
+                'DELETE FROM cache_invalidations WHERE seq <= '
+                '(SELECT MAX(seq) FROM cache_invalidations) - ?',
+                (self.INVALIDATION_LOG_SIZE,)
+            )
+
+    def stats(self):
+        count = self._connection().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        return {'shared_entries': count, 'shared_max_entries': self.max_entries, 'shared_path': self.path}
+
+    def _connection(self):
+        # Uma conexão por thread e por processo (conexões não sobrevivem ao fork do gunicorn)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.isolation_level = ''
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+class TieredCacheBackend(CacheBackend):
+    """
+    LRU em memória na frente de um cache compartilhado entre processos.
+    Leituras vão primeiro à memória; falhas buscam no compartilhado e copiam para a memória.
+    As invalidações (delete/clear) publicadas por outros workers são aplicadas no máximo uma
+    vez a cada SYNC_INTERVAL_SECONDS: as escritas normais não dependem delas, já que mudam a
+    versão nas chaves.
+    """
+
+    # Intervalo mínimo entre leituras do log de invalidações compartilhado (por processo)
+    SYNC_INTERVAL_SECONDS = 1.0
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+        self.local_hits = 0
+        self.shared_hits = 0
+        self._last_seq = shared.last_invalidation()
+        self._next_sync = time.monotonic() + self.SYNC_INTERVAL_SECONDS
+        self._sync_lock = threading.Lock()
+
+    def get(self, key):
+        self._sync()
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        entry = self.shared.get_entry(key)
+        if entry is None:
+            return None
+        value, remaining = entry
+        self.local.set(key, value, remaining)
+        self.shared_hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        self.shared.set(key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        return {
+            **self.local.stats(),
+            **self.shared.stats(),
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits
+        }
+
+    def _sync(self):
+        """Descarta da memória as chaves invalidadas por qualquer worker desde a última leitura do log"""
+        if time.monotonic() < self._next_sync:
+            return
+        with self._sync_lock:
+            self._next_sync = time.monotonic() + self.SYNC_INTERVAL_SECONDS
+            seq, keys, clear_all = self.shared.invalidations_since(self._last_seq)
+            if seq == self._last_seq:
+                return
+            self._last_seq = seq
+        if clear_all:
+            self.local.clear()
+        for key in keys:
+            self.local.delete(key)
+
+
+class CacheService:
+    """
+    Cache de dados derivados (saldos, resumos do dashboard) entre requisições.
+    As chaves incluem contadores de versão por usuário e por grupo (tabela change_counters),
+    incrementados na mesma transação de qualquer escrita que afete o escopo: uma escrita
+    torna as entradas antigas inalcançáveis, e o LRU as descarta com o tempo.
+    """
+
+    # Backends disponíveis por nome (CACHE_BACKEND); novos backends podem ser registrados
+    BACKENDS = {
+        'memory': lambda app: MemoryCacheBackend(app.config.get('CACHE_MAX_ENTRIES', 2048)),
+        'shared': lambda app: CacheService._shared_backend(app),
+        'tiered': lambda app: TieredCacheBackend(
+            MemoryCacheBackend(app.config.get('CACHE_MAX_ENTRIES', 2048)),
+            CacheService._shared_backend(app)
+        ),
+        'none': lambda app: NullCacheBackend()
+    }
+
+    _backend = NullCacheBackend()
+    _hits = defaultdict(int)
+    _misses = defaultdict(int)
+    _stats_lock = threading.Lock()
+    _listening = False
+
+    @staticmethod
+    def init_app(app):
+        """Configura o backend e passa a registrar as escritas nos contadores de versão"""
+        backend_name = app.config.get('CACHE_BACKEND', 'memory')
+        factory = CacheService.BACKENDS.get(backend_name)
+        if factory is None:
+            raise ValueError(f"Backend de cache desconhecido: {backend_name}")
+        CacheService.set_backend(factory(app))
+
+        if not CacheService._listening:
+            event.listen(Session, 'before_flush', CacheService._track_flush)
+            CacheService._listening = True
+
+    @staticmethod
+    def _shared_backend(app):
+        path = app.config.get('CACHE_SHARED_PATH') or os.path.join(app.instance_path, 'cache.db')
+        return SQLiteCacheBackend(path, app.config.get('CACHE_SHARED_MAX_ENTRIES', 20000))
+
+    @staticmethod
+    def register_backend(name, factory):
+        """Registra um backend: factory(app) -> CacheBackend"""
+        CacheService.BACKENDS[name] = factory
+
+    @staticmethod
+    def set_backend(backend):
+        CacheService._backend = backend
+        CacheService.reset_stats()
+
+    @staticmethod
+    def get_or_set(namespace, key, factory, ttl=None):
+        """Valor em cache de (namespace, key) ou calculado com factory() (deve ser serializável em JSON)"""
+        full_key = f'{namespace}:{key}'
+        cached = CacheService._backend.get(full_key)
+
+        if cached is not None:
+            with CacheService._stats_lock:
+                CacheService._hits[namespace] += 1
+            return json.loads(cached)
+
+        with CacheService._stats_lock:
+            CacheService._misses[namespace] += 1
+
+        value = factory()
+        CacheService._backend.set(full_key, json.dumps(value), ttl)
+        return value
+
+    @staticmethod
+    def for_user(namespace, user_id, factory, ttl=None):
+        """Cache de dados derivados de um usuário, invalidado por escritas no usuário ou nos seus grupos"""
+        key = f'{user_id}:{CacheService.user_scope_version(user_id)}'
+        return CacheService.get_or_set(namespace, key, factory, ttl)
+
+    @staticmethod
+    def for_group(namespace, group_id, factory, ttl=None):
+        """Cache de dados derivados de um grupo, invalidado por escritas no grupo"""
+        key = f'{group_id}:{CacheService.group_version(group_id)}'
+        return CacheService.get_or_set(namespace, key, factory, ttl)
+
+    @staticmethod
+    def user_scope_version(user_id):
+        """
+        Versão combinada do usuário e de todos os seus grupos, em uma consulta indexada.
+        Muda sempre que alguma escrita afeta o usuário ou qualquer grupo dele.
+        """
+        from app.models.user import GroupMember
+
+        def load():
+            user_groups = db.select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+            rows = db.session.query(ChangeCounter.scope, ChangeCounter.object_id, ChangeCounter.version)\
+                .filter(db.or_(
+                    db.and_(ChangeCounter.scope == 'user', ChangeCounter.object_id == user_id),
+                    db.and_(ChangeCounter.scope == 'group', ChangeCounter.object_id.in_(user_groups))
+                )).all()
+            digest = hashlib.sha1(repr(sorted(tuple(row) for row in rows)).encode()).hexdigest()
+            return digest[:16]
+
+        return RequestMemo.get('scope_versions', ('user', user_id), load)
+
+    @staticmethod
+    def group_scope_version(group_id):
+        """
+        Versão combinada do grupo e de todos os seus membros, em uma consulta indexada.
+        Muda com escritas no grupo e com mudanças nos membros (nome, score, carteira, pagamentos).
+        """
+        from app.models.user import GroupMember
+
+        def load():
+            members = db.select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+            rows = db.session.query(ChangeCounter.scope, ChangeCounter.object_id, ChangeCounter.version)\
+                .filter(db.or_(
+                    db.and_(ChangeCounter.scope == 'group', ChangeCounter.object_id == group_id),
+                    db.and_(ChangeCounter.scope == 'user', ChangeCounter.object_id.in_(members))
+                )).all()
+            digest = hashlib.sha1(repr(sorted(tuple(row) for row in rows)).encode()).hexdigest()
+            return digest[:16]
+
+        return RequestMemo.get('scope_versions', ('group_scope', group_id), load)
+
+    @staticmethod
+    def group_version(group_id):
+        """Versão atual de um grupo (0 se nunca alterado)"""
+        return RequestMemo.get('scope_versions', ('group', group_id), lambda: db.session.query(ChangeCounter.version)
+                               .filter_by(scope='group', object_id=group_id).scalar() or 0)
+
+    @staticmethod
+    def touch(user_ids=(), group_ids=(), session=None):
+        """Incrementa os contadores de versão (na transação corrente, sem commit)"""
+        keys = sorted(
+            [('user', user_id) for user_id in set(user_ids) if user_id] +
+            [('group', group_id) for group_id in set(group_ids) if group_id]
+        )
+        if not keys:
+            return
+
+        session = session or db.session
+        now = datetime.utcnow()
+        rows = [
+            {'id': str(uuid.uuid4()), 'scope': scope, 'object_id': object_id, 'version': 1, 'updated_at': now}
+            for scope, object_id in keys
+        ]
+        dialect = session.get_bind().dialect.name
+
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(ChangeCounter.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['scope', 'object_id'],
+                set_={'version': ChangeCounter.__table__.c.version + 1, 'updated_at': now}
+            )
+            session.execute(stmt, rows)
+        else:
+            for row in rows:
+                updated = session.execute(
+                    db.update(ChangeCounter.__table__)
+                    .where(ChangeCounter.scope == row['scope'], ChangeCounter.object_id == row['object_id'])
+                    .values(version=ChangeCounter.__table__.c.version + 1, updated_at=now)
+                ).rowcount
+                if not updated:
+                    session.execute(db.insert(ChangeCounter.__table__), [row])
+
+        RequestMemo.invalidate('scope_versions')
+
+    @staticmethod
+    def touch_debts(debts):
+        """Versiona devedores, credores e grupos de dívidas alteradas por UPDATE em massa"""
+        if not debts:
+            return
+        user_ids = set()
+        group_ids = set()
+        for debt in debts:
+            user_ids.update((debt.debtor_id, debt.creditor_id))
+            group_ids.add(debt.group_id)
+        CacheService.touch(user_ids, group_ids)
+
+    @staticmethod
+    def stats():
+        """Acertos e falhas por namespace, mais as estatísticas do backend"""
+        with CacheService._stats_lock:
+            hits = dict(CacheService._hits)
+            misses = dict(CacheService._misses)
+        return {
+            'backend': type(CacheService._backend).__name__,
+            'hits': sum(hits.values()),
+            'misses': sum(misses.values()),
+            'by_namespace': {
+                namespace: {'hits': hits.get(namespace, 0), 'misses': misses.get(namespace, 0)}
+                for namespace in sorted(set(hits) | set(misses))
+            },
+            **CacheService._backend.stats()
+        }
+
+    @staticmethod
+    def reset_stats():
+        with CacheService._stats_lock:
+            CacheService._hits.clear()
+            CacheService._misses.clear()
+
+    @staticmethod
+    def _track_flush(session, flush_context, instances):
+        """Antes de cada flush, incrementa as versões dos usuários e grupos afetados pelas alterações"""
+        from app.models.debt import Debt
+        from app.models.expense import Expense
+        from app.models.expense_share import ExpenseShare
+        from app.models.group import Group
+        from app.models.log import Log
+        from app.models.receivable import Receivable
+        from app.models.user import User, GroupMember
+        from app.models.wallet import Wallet
+
+        user_ids = set()
+        group_ids = set()
+        expense_ids = set()
+        changed_user_ids = set()
+        known_expense_groups = {}
+
+        changed = list(session.new) + list(session.deleted) + [
+            obj for obj in session.dirty if session.is_modified(obj, include_collections=False)
+        ]
+
+        for obj in changed:
+            if isinstance(obj, Debt):
+                user_ids.update((obj.debtor_id, obj.creditor_id))
+                group_ids.add(obj.group_id)
+                expense_ids.add(obj.expense_id)
+            elif isinstance(obj, Expense):
+                user_ids.add(obj.payer_id)
+                group_ids.add(obj.group_id)
+                if obj.id:
+                    known_expense_groups[obj.id] = obj.group_id
+            elif isinstance(obj, GroupMember):
+                user_ids.add(obj.user_id)
+                group_ids.add(obj.group_id)
+            elif isinstance(obj, Group):
+                group_ids.add(obj.id)
+            elif isinstance(obj, Wallet):
+                user_ids.add(obj.user_id)
+            elif isinstance(obj, Receivable):
+                # consolidated_group_id guarda o devedor nos títulos consolidados
+                user_ids.update((obj.owner_id, obj.buyer_id, obj.consolidated_group_id))
+            elif isinstance(obj, User):
+                user_ids.add(obj.id)
+                if obj not in session.new:
+                    # Nome e score aparecem também nas respostas dos outros membros dos grupos
+                    changed_user_ids.add(obj.id)
+            elif isinstance(obj, Log):
+                user_ids.add(obj.user_id)
+                group_ids.add(obj.group_id)
+            elif isinstance(obj, ExpenseShare):
+                # Vetor de cotas: credor e todos os devedores do bitmap
+                from app.services.share_vector_service import ShareVectorService
+                user_ids.add(obj.creditor_id)
+                user_ids.update(ShareVectorService.debtor_ids(obj))
+                group_ids.add(obj.group_id)
+
+        # Dívidas afetam também o grupo da despesa de origem
+        expense_ids.discard(None)
+        for expense_id in list(expense_ids):
+            if expense_id in known_expense_groups:
+                group_ids.add(known_expense_groups[expense_id])
+                expense_ids.discard(expense_id)
+        if expense_ids:
+            group_ids.update(group_id for (group_id,) in session.execute(
+                db.select(Expense.group_id).where(Expense.id.in_(expense_ids))
+            ).all())
+
+        if changed_user_ids:
+            group_ids.update(group_id for (group_id,) in session.execute(
+                db.select(GroupMember.group_id).where(GroupMember.user_id.in_(changed_user_ids))
+            ).all())
+
+        CacheService.touch(user_ids, group_ids, session=session)
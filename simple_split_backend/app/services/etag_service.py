@@ -0,0 +1,64 @@
+from flask import current_app, make_response, request
+from functools import wraps
+import hashlib
+
+# Incrementar quando o formato das respostas mudar, para invalidar ETags já emitidos
+ETAG_FORMAT_VERSION = 1
+
+
+class EtagService:
+    """
+    GET condicional para endpoints de leitura: o ETag vem dos contadores de versão
+    (change_counters) do escopo da resposta, então If-None-Match é respondido com 304
+    antes de qualquer consulta pesada.
+    """
+
+    @staticmethod
+    def make_etag(namespace, object_id, version):
+        raw = f'{ETAG_FORMAT_VERSION}:{namespace}:{object_id}:{version}'
+        return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+    @staticmethod
+    def user_scoped(namespace):
+        """
+        etag_for de respostas que dependem só do usuário autenticado e dos seus grupos
+        (versão combinada do usuário e de todos os grupos dele).
+        """
+        from flask_jwt_extended import get_jwt_identity
+        from app.services.cache_service import CacheService
+
+        def etag_for(*args, **kwargs):
+            user_id = get_jwt_identity()
+            return EtagService.make_etag(namespace, user_id, CacheService.user_scope_version(user_id))
+        return etag_for
+
+    @staticmethod
+    def conditional(etag_for):
+        """
+        Decorator de view: etag_for(**kwargs) devolve o ETag da resposta (ou None para não usar).
+        Deve ficar abaixo de @jwt_required, pois costuma depender do usuário autenticado.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                etag = etag_for(*args, **kwargs)
+                if etag is None:
+                    return view(*args, **kwargs)
+
+                if request.if_none_match.contains_weak(etag):
+                    return EtagService._tag(current_app.response_class(status=304), etag)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    EtagService._tag(response, etag)
+                return response
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _tag(response, etag):
+        # ETag fraco: a resposta é equivalente, não necessariamente idêntica byte a byte
+        response.set_etag(etag, weak=True)
+        # O cliente pode guardar, mas deve revalidar a cada uso
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
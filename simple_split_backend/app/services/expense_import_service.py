@@ -0,0 +1,213 @@
+from app import db
+from app.models.expense import Expense
+from app.models.group import Group
+from app.models.user import User, GroupMember
+from app.services.balance_service import BalanceService
+from app.services.cache_service import CacheService
+from app.services.expense_rollup_service import ExpenseRollupService
+from app.services.split_service import SplitService, SplitError
+from collections import defaultdict
+from datetime import datetime
+import csv
+import io
+import math
+import uuid
+
+# Máximo de despesas por importação
+MAX_IMPORT_ROWS = 1000
+
+
+class ExpenseImportError(ValueError):
+    """Importação rejeitada; errors traz os problemas por linha"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class ExpenseImportService:
+    """
+    Importação em lote de despesas (JSON ou CSV): valida todas as linhas, calcula as divisões
+    de todas em uma passada (SplitService), grava despesas e dívidas com INSERTs em massa e atualiza ledger, contadores e versões uma vez,
+    tudo em uma única transação.
+    """
+
+    @staticmethod
+    def parse_csv(text):
+        """
+        Linhas de um CSV com cabeçalho: description, amount e opcionalmente date (AAAA-MM-DD),
+        payer_id ou payer_email, member_ids (ids separados por '|') e split_type com shares
+        ('id:valor' separados por '|'). Aceita ',' ou ';' como separador.
+        """
+        text = text.lstrip('﻿')
+        header = text.split('\n', 1)[0]
+        delimiter = ';' if header.count(';') > header.count(',') else ','
+
+        rows = []
+        for row in csv.DictReader(io.StringIO(text), delimiter=delimiter):
+            row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+            if row.get('member_ids'):
+                row['member_ids'] = [member_id.strip() for member_id in row['member_ids'].split('|') if member_id.strip()]
+            else:
+                row.pop('member_ids', None)
+            if row.get('shares'):
+                row['shares'] = dict(
+                    item.split(':', 1) if ':' in item else (item, '')
+                    for item in (item.strip() for item in row['shares'].split('|')) if item
+                )
+            else:
+                row.pop('shares', None)
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def import_expenses(group_id, user_id, rows):
+        """
+        Cria as despesas e suas divisões (sem commit). Pagador padrão: o usuário autenticado.
+        Retorna (ids das despesas, valor total, ids dos participantes). Levanta ExpenseImportError.
+        """
+        if not isinstance(rows, list) or not rows:
+            raise ExpenseImportError(['Nenhuma despesa informada'])
+        if len(rows) > MAX_IMPORT_ROWS:
+            raise ExpenseImportError([f'Máximo de {MAX_IMPORT_ROWS} despesas por importação'])
+
+        member_ids = [
+            member_id for (member_id,) in db.session.query(GroupMember.user_id)
+            .filter(GroupMember.group_id == group_id).order_by(GroupMember.joined_at, GroupMember.id).all()
+        ]
+        members = set(member_ids)
+        emails = {
+            email.lower(): member_id for member_id, email in
+            db.session.query(User.id, User.email).filter(User.id.in_(member_ids)).all()
+        }
+
+        expenses = ExpenseImportService._validate(rows, user_id, member_ids, members, emails)
+
+        now = datetime.utcnow()
+        expense_rows = []
+        paid_by_user = defaultdict(float)
+
+        for expense in expenses:
+            expense['id'] = str(uuid.uuid4())
+            expense['group_id'] = group_id
+            expense['created_at'] = now
+            expense_rows.append({
+                'id': expense['id'],
+                'group_id': group_id,
+                'payer_id': expense['payer_id'],
+                'description': expense['description'],
+                'amount': expense['amount'],
+                'date': expense['date'],
+                'created_at': now
+            })
+            paid_by_user[expense['payer_id']] += expense['amount']
+
+        # Divisões de todas as linhas em uma passada (já validadas em _validate)
+        debt_rows, share_rows, participants, parts = SplitService.split_rows(expenses, group_id)
+
+        db.session.execute(db.insert(Expense), expense_rows)
+        SplitService.insert(debt_rows, share_rows)
+
+        total = sum(expense['amount'] for expense in expenses)
+        BalanceService.record_expenses(group_id, paid_by_user, [part for expense_parts in parts.values() for part in expense_parts])
+        Group.adjust_counters(group_id, expenses=len(expense_rows), amount=total)
+        ExpenseRollupService.record(expenses, parts)
+        # INSERTs em massa não passam pelo flush: versionar explicitamente os afetados
+        CacheService.touch(participants, [group_id])
+
+        return [row['id'] for row in expense_rows], total, sorted(participants)
+
+    @staticmethod
+    def _validate(rows, user_id, member_ids, members, emails):
+        """Normaliza as linhas; acumula os erros de todas antes de rejeitar a importação"""
+        errors = []
+        expenses = []
+        today = datetime.utcnow().date()
+
+        for number, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                errors.append(f'Linha {number}: formato inválido')
+                continue
+
+            description = str(row.get('description') or '').strip()
+            if not description:
+                errors.append(f'Linha {number}: description é obrigatório')
+            elif len(description) > 200:
+                errors.append(f'Linha {number}: description com mais de 200 caracteres')
+
+            amount = ExpenseImportService._parse_amount(row.get('amount'))
+            if amount is None or amount <= 0:
+                errors.append(f'Linha {number}: amount deve ser um número positivo')
+            elif round(amount, 2) != amount:
+                errors.append(f'Linha {number}: amount deve ter no máximo 2 casas decimais')
+
+            date = today
+            if row.get('date'):
+                try:
+                    date = datetime.strptime(str(row['date']), '%Y-%m-%d').date()
+                except ValueError:
+                    errors.append(f'Linha {number}: date deve estar no formato AAAA-MM-DD')
+
+            payer_id = row.get('payer_id') or user_id
+            if row.get('payer_email') and not row.get('payer_id'):
+                payer_id = emails.get(str(row['payer_email']).lower())
+            if payer_id not in members:
+                errors.append(f'Linha {number}: pagador não é membro do grupo')
+
+            split_ids = row.get('member_ids') or member_ids
+            if not isinstance(split_ids, list) or any(member_id not in members for member_id in split_ids):
+                errors.append(f'Linha {number}: member_ids deve conter apenas membros do grupo')
+
+            # Divisões por peso, valor exato ou percentual: partes conferidas já em centavos
+            split_type = str(row.get('split_type') or 'equal').strip().lower()
+            shares = row.get('shares')
+            if split_type != 'equal':
+                if isinstance(shares, dict):
+                    shares = {
+                        str(member_id).strip(): ExpenseImportService._parse_amount(value)
+                        for member_id, value in shares.items()
+                    }
+                if isinstance(shares, dict) and any(member_id not in members for member_id in shares):
+                    errors.append(f'Linha {number}: shares deve conter apenas membros do grupo')
+                elif amount is not None and amount > 0:
+                    try:
+                        SplitService.participant_cents(amount, split_type, shares)
+                    except SplitError as e:
+                        errors.append(f'Linha {number}: {e}')
+
+            expenses.append({
+                'description': description,
+                'amount': amount,
+                'date': date,
+                'payer_id': payer_id,
+                'member_ids': split_ids,
+                'split_type': split_type,
+                'shares': shares
+            })
+
+        if errors:
+            raise ExpenseImportError(errors)
+        return expenses
+
+    @staticmethod
+    def _parse_amount(value):
+        """
+        Aceita números e textos com separador de milhar ('1.234,56' ou '1,234.56'): a vírgula
+        só é decimal quando nenhum ponto vem depois dela. Valores não finitos (nan, inf) viram None.
+        """
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            amount = float(value)
+        else:
+            text = str(value or '').strip()
+            if ',' in text:
+                if '.' in text[text.rindex(','):]:
+                    text = text.replace(',', '')
+                else:
+                    text = text.replace('.', '').replace(',', '.')
+            try:
+                amount = float(text)
+            except ValueError:
+                return None
+        return amount if math.isfinite(amount) else None
@@ -0,0 +1,172 @@
+from app import db
+from app.models.expense import Expense
+from app.models.expense_rollup import ExpenseRollup
+from app.services.settlement_service import SettlementService
+from app.services.split_service import SplitService
+from collections import defaultdict
+from datetime import datetime
+import uuid
+
+# Escala das partes em float (ex.: cotas iguais de 100 / 3) antes de distribuir os centavos
+PART_SCALE = 10 ** 6
+
+
+class ExpenseRollupService:
+    """
+    Totais mensais por (usuário, grupo, mês) na tabela expense_rollups. As escritas de despesas
+    somam ou subtraem seus valores com um UPSERT atômico na mesma transação, e os resumos são
+    uma soma agregada de poucas linhas, independente do tamanho do histórico. Os totais são
+    centavos inteiros: somar e subtrair despesas não acumula erro e bate com uma reconstrução.
+    """
+
+
+    @staticmethod
+    def month_start(value):
+        """Primeiro dia do mês de uma data (ou datetime)"""
+        if isinstance(value, datetime):
+            value = value.date()
+        return value.replace(day=1)
+
+    @staticmethod
+    def record(expenses, parts, sign=1):
+        """
+        Registra (sign=1) ou remove (sign=-1) despesas nos totais (sem commit). Cada despesa é um dict
+        com id, group_id, payer_id, amount e date; parts ({expense_id: [(user_id, valor)]}) traz a parte
+        de cada participante, como devolvida por SplitService.split_rows.
+        """
+        deltas = defaultdict(lambda: [0, 0, 0])
+        for expense in expenses:
+            month = ExpenseRollupService.month_start(expense.get('date') or expense.get('created_at') or datetime.utcnow())
+            paid = deltas[(expense['payer_id'], expense['group_id'], month)]
+            paid[0] += sign * SettlementService.to_cents(expense['amount'])
+            paid[1] += sign
+
+            for user_id, cents in ExpenseRollupService.part_cents(expense, parts.get(expense['id'], [])):
+                deltas[(user_id, expense['group_id'], month)][2] += sign * cents
+
+        ExpenseRollupService._apply(deltas)
+
+    @staticmethod
+    def part_cents(expense, parts):
+        """
+        Partes de uma despesa em centavos inteiros que somam exatamente o valor dela. Os devedores
+        entram pela parte gravada e o pagador pelo restante; os centavos que sobram são distribuídos
+        por SplitService.allocate (maiores frações, empates pela ordem de user_id após o pagador),
+        então o registro incremental e a reconstrução chegam aos mesmos centavos.
+        """
+        payer_id = expense['payer_id']
+        weights = defaultdict(int)
+        for user_id, amount in parts:
+            if user_id != payer_id:
+                weights[user_id] += int(round(amount * PART_SCALE))
+
+        debtor_ids = sorted(weights)
+        payer_weight = int(round(expense['amount'] * PART_SCALE)) - sum(weights.values())
+        total_cents = SettlementService.to_cents(expense['amount'])
+        if not debtor_ids or payer_weight < 0 or total_cents <= 0:
+            return [(payer_id, total_cents)] + [(user_id, 0) for user_id in debtor_ids]
+
+        cents = SplitService.allocate(total_cents, [payer_weight] + [weights[user_id] for user_id in debtor_ids])
+        return list(zip([payer_id] + debtor_ids, cents))
+
+    @staticmethod
+    def remove_expense(expense):
+        """Desfaz uma despesa nos totais antes de removê-la (sem commit)"""
+        ExpenseRollupService.record(
+            [ExpenseRollupService._expense_dict(expense)],
+            SplitService.stored_parts(Expense.id == expense.id),
+            sign=-1
+        )
+
+    @staticmethod
+    def rebuild(group_ids=None):
+        """
+        Recalcula os totais a partir das despesas, dívidas da divisão e vetores de cotas (sem commit).
+        Sem group_ids, reconstrói todos os grupos. Retorna quantas despesas foram lidas.
+        """
+        criteria = []
+        delete = db.delete(ExpenseRollup)
+        if group_ids is not None:
+            group_ids = list(group_ids)
+            criteria.append(Expense.group_id.in_(group_ids))
+            delete = delete.where(ExpenseRollup.group_id.in_(group_ids))
+        db.session.execute(delete, execution_options={'synchronize_session': False})
+
+        expenses = [
+            ExpenseRollupService._expense_dict(expense) for expense in
+            db.session.query(
+                Expense.id, Expense.group_id, Expense.payer_id, Expense.amount, Expense.date, Expense.created_at
+            ).filter(*criteria).all()
+        ]
+        ExpenseRollupService.record(expenses, SplitService.stored_parts(*criteria))
+        return len(expenses)
+
+    @staticmethod
+    def totals(*criteria):
+        """(valor pago, número de despesas pagas, parte nas despesas) somados nas linhas filtradas"""
+        paid_cents, paid_count, spent_cents = db.session.query(
+            db.func.coalesce(db.func.sum(ExpenseRollup.paid_cents), 0),
+            db.func.coalesce(db.func.sum(ExpenseRollup.paid_count), 0),
+            db.func.coalesce(db.func.sum(ExpenseRollup.spent_cents), 0)
+        ).filter(*criteria).one()
+        return paid_cents / 100, paid_count, spent_cents / 100
+
+    @staticmethod
+    def _expense_dict(expense):
+        return {
+            'id': expense.id,
+            'group_id': expense.group_id,
+            'payer_id': expense.payer_id,
+            'amount': expense.amount,
+            'date': expense.date,
+            'created_at': expense.created_at
+        }
+
+    @staticmethod
+    def _apply(deltas):
+        """Soma os deltas ({(user_id, group_id, mês): [pago, despesas, parte]}, em centavos) com um UPSERT atômico"""
+        if not deltas:
+            return
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                'id': str(uuid.uuid4()), 'user_id': user_id, 'group_id': group_id, 'month': month,
+                'paid_cents': paid_cents, 'paid_count': paid_count, 'spent_cents': spent_cents, 'updated_at': now
+            }
+            for (user_id, group_id, month), (paid_cents, paid_count, spent_cents) in sorted(deltas.items())
+        ]
+        table = ExpenseRollup.__table__
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_id', 'group_id', 'month'],
+                set_={
+                    'paid_cents': table.c.paid_cents + stmt.excluded.paid_cents,
+                    'paid_count': table.c.paid_count + stmt.excluded.paid_count,
+                    'spent_cents': table.c.spent_cents + stmt.excluded.spent_cents,
+                    'updated_at': now
+                }
+            )
+            db.session.execute(stmt, rows)
+        else:
+            for row in rows:
+                updated = db.session.execute(
+                    db.update(table)
+                    .where(table.c.user_id == row['user_id'], table.c.group_id == row['group_id'],
+                           table.c.month == row['month'])
+                    .values(
+                        paid_cents=table.c.paid_cents + row['paid_cents'],
+                        paid_count=table.c.paid_count + row['paid_count'],
+                        spent_cents=table.c.spent_cents + row['spent_cents'],
+                        updated_at=now
+                    )
+                ).rowcount
+                if not updated:
+                    db.session.execute(db.insert(table), [row])
@@ -3,15 +3,18 @@ from app.models.user import User
 from app.models.group import Group
 from app.models.wallet import Wallet
 from app.models.expense import Expense
+from app.services.logging_service import LoggingService
 from datetime import datetime
 import uuid
 
+logger = LoggingService.get_logger(__name__)
+
 def initialize_data():
     """Inicializa o banco com dados básicos (Pablo, Cecília e Mariana)"""
     
     # Verificar se já existem usuários
     if User.query.first():
-        print("Dados já existem no banco!")
+        logger.info("Dados já existem no banco!")
         return
     
     # Criar usuários
@@ -92,6 +95,6 @@ def initialize_data():
         # Dividir a despesa automaticamente
         expense.split_expense()
     
-    print("Dados iniciais criados com sucesso!")
-    print("Usuários: Pablo, Cecília, Mariana")
-    print("Grupo: Viagem RJ-2025 com despesa de exemplo")
\ No newline at end of file
+    logger.info("Dados iniciais criados com sucesso!")
+    logger.info("Usuários: Pablo, Cecília, Mariana")
+    logger.info("Grupo: Viagem RJ-2025 com despesa de exemplo")
\ No newline at end of file
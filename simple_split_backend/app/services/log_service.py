@@ -1,8 +1,119 @@
 from app import db
 from app.models.log import Log
 from app.models.debt import Debt
+from app.models.expense_share import ExpenseShare
 from app.models.user import User, GroupMember
+from app.services.cache_service import CacheService
+from app.services.share_vector_service import ShareVectorService
+from app.services.settlement_service import SettlementService, SETTLEABLE_SOURCES, DebtSnapshot, solve_group_snapshot
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import time
+import uuid
+
+
+class OptimizationBatch:
+    """
+    Decisões de uma otimização (cancelamentos, novas dívidas e logs), coletadas
+    durante o cálculo e aplicadas de uma vez em uma única transação.
+    """
+    
+    def __init__(self):
+        self.cancelled = {}
+        self.adjusted = {}
+        self.adjusted_debts = {}
+        self.new_debts = {}  # id(objeto) -> dívida ainda não gravada, na ordem de criação
+        self.logs = []
+        self.timings = defaultdict(float)
+    
+    def __len__(self):
+        return len(self.cancelled) + len(self.adjusted)
+    
+    def cancel(self, debt):
+        """Marca uma dívida para cancelamento (dívidas ainda não gravadas são apenas descartadas)"""
+        if self.new_debts.pop(id(debt), None) is not None:
+            return
+        self.adjusted.pop(debt.id, None)
+        self.cancelled[debt.id] = debt
+    
+    def adjust(self, debt, amount):
+        """Reduz o valor de uma dívida (dívidas ainda não gravadas são alteradas direto)"""
+        if id(debt) in self.new_debts:
+            debt.amount = amount
+            return
+        self.adjusted[debt.id] = amount
+        self.adjusted_debts[debt.id] = debt
+    
+    def add_debt(self, debt):
+        self.new_debts[id(debt)] = debt
+    
+    def add_log(self, log):
+        self.logs.append(log)
+    
+    @contextmanager
+    def timed(self, phase):
+        """Acumula o tempo (ms) gasto em uma fase: load, graph, solve ou apply"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += (time.perf_counter() - started) * 1000
+    
+    def to_dict(self):
+        """Resumo das decisões do lote (usado na simulação)"""
+        return {
+            'cancelled': [
+                {
+                    'debt_id': debt.id,
+                    'debtor_id': debt.debtor_id,
+                    'creditor_id': debt.creditor_id,
+                    'amount': debt.amount
+                }
+                for debt in self.cancelled.values()
+            ],
+            'adjusted': [
+                {'debt_id': debt_id, 'new_amount': amount}
+                for debt_id, amount in self.adjusted.items()
+            ],
+            'created': [
+                {
+                    'debtor_id': debt.debtor_id,
+                    'creditor_id': debt.creditor_id,
+                    'amount': debt.amount,
+                    'source': debt.source
+                }
+                for debt in self.new_debts.values()
+            ]
+        }
+    
+    def pending(self, debts):
+        """Visão das dívidas pendentes após as decisões já tomadas neste lote"""
+        return [debt for debt in debts if debt.id not in self.cancelled] + list(self.new_debts.values())
+    
+    def apply(self):
+        """Grava o lote: um UPDATE em massa, inserções e um único commit"""
+        if not self.cancelled and not self.adjusted and not self.new_debts and not self.logs:
+            return 0
+        
+        with self.timed('apply'):
+            debt_ids, share_keys = ShareVectorService.split_keys(self.cancelled)
+            adjusted_ids, adjusted_keys = ShareVectorService.split_keys(self.adjusted)
+            Debt.bulk_cancel(debt_ids)
+            Debt.bulk_update_amounts({debt_id: self.adjusted[debt_id] for debt_id in adjusted_ids})
+            # Cotas em vetor (grupos grandes) saem do vetor ou viram dívidas com o valor reduzido
+            if share_keys or adjusted_keys:
+                ShareVectorService.apply_optimization(share_keys, {key: self.adjusted[key] for key in adjusted_keys})
+            # As atualizações em massa não passam pelo flush: versionar os escopos afetados aqui
+            CacheService.touch_debts(list(self.cancelled.values()) + list(self.adjusted_debts.values()))
+            db.session.add_all(self.new_debts.values())
+            db.session.add_all(self.logs)
+            db.session.commit()
+        
+        return len(self)
+
 
 class LogService:
     @staticmethod
@@ -12,7 +123,7 @@ class LogService:
             type='payment',
             description=f"{debt.debtor.name} pagou R${debt.amount:.2f} para {debt.creditor.name}",
             user_id=debt.debtor_id,
-            group_id=debt.expense.group_id if debt.expense else None,
+            group_id=debt.group_id,
             amount=debt.amount
         )
         db.session.add(log)
@@ -24,22 +135,38 @@ class LogService:
             type='cancellation',
             description=f"Dívida de R${debt.amount:.2f} entre {debt.debtor.name} e {debt.creditor.name} foi cancelada",
             user_id=debt.debtor_id,
-            group_id=debt.expense.group_id if debt.expense else None,
+            group_id=debt.group_id,
             amount=debt.amount
         )
         db.session.add(log)
     
     @staticmethod
-    def create_optimization_log(debts_optimized, group_id=None):
+    def create_optimization_log(debts_optimized, group_id=None, transfers=None, amount=None):
         """Cria log de otimização de dívidas"""
-        total_amount = sum([debt.amount for debt in debts_optimized])
-        log = Log(
+        log = LogService.build_optimization_log(debts_optimized, group_id, transfers, amount)
+        db.session.add(log)
+        return log
+    
+    @staticmethod
+    def build_optimization_log(debts_optimized, group_id=None, transfers=None, amount=None):
+        """Monta (sem adicionar à sessão) o log de otimização de dívidas"""
+        total_amount = sum([debt.amount for debt in debts_optimized]) if amount is None else amount
+        description = f"Otimização automática cancelou R${total_amount:.2f} em dívidas cruzadas"
+        
+        if transfers is not None:
+            # Plano de quitação: economia = valor cancelado - valor reemitido
+            total_amount -= sum(transfer['amount'] for transfer in transfers)
+            description = (
+                f"Otimização automática simplificou R${total_amount:.2f} em dívidas "
+                f"({len(debts_optimized)} dívidas substituídas por {len(transfers)} pagamentos)"
+            )
+        
+        return Log(
             type='optimization',
-            description=f"Otimização automática cancelou R${total_amount:.2f} em dívidas cruzadas",
+            description=description,
             group_id=group_id,
             amount=total_amount
         )
-        db.session.add(log)
     
     @staticmethod
     def optimize_debts():
@@ -47,98 +174,342 @@ class LogService:
         Otimiza dívidas encontrando ciclos e cancelando dívidas cruzadas
         Exemplo: A deve B, B deve C, C deve A -> todos quitados se valores iguais
         """
-        # Buscar todas as dívidas pendentes (excluindo vendidas)
-        pending_debts = Debt.get_pending_debts().all()
+        batch = OptimizationBatch()
+        
+        with batch.timed('load'):
+            # Buscar todas as dívidas pendentes (excluindo vendidas) já com o grupo da despesa
+            pending_rows = Debt.get_pending_debts().filter(Debt.group_id.isnot(None)).add_columns(Debt.group_id).all()
+            # Cotas pendentes em vetores entram como dívidas (com a chave da cota como id)
+            pending_rows += ShareVectorService.pending_debts()
+            pending_debts = [debt for debt, _ in pending_rows]
         
         # Agrupar por grupo para otimização local
         debts_by_group = defaultdict(list)
-        for debt in pending_debts:
-            if debt.expense and debt.expense.group:
-                debts_by_group[debt.expense.group_id].append(debt)
-        
-        optimized_count = 0
+        for debt, group_id in pending_rows:
+            debts_by_group[group_id].append(debt)
         
         # Otimizar dentro de cada grupo
         for group_id, group_debts in debts_by_group.items():
-            optimized_count += LogService._optimize_group_debts(group_debts, group_id)
+            LogService._optimize_group_debts(group_debts, group_id, batch)
         
-        # Otimizar entre grupos (dívidas cruzadas entre usuários)
-        optimized_count += LogService._optimize_cross_group_debts(pending_debts)
+        # Otimizar entre grupos (dívidas cruzadas entre usuários) sobre o estado após o plano dos grupos
+        LogService._optimize_cross_group_debts(batch.pending(pending_debts), batch)
         
-        if optimized_count > 0:
-            db.session.commit()
+        return batch.apply()
+    
+    @staticmethod
+    def optimize_debts_parallel(workers=None):
+        """
+        Otimização completa em lote (ex.: rotina noturna). Os grupos são independentes:
+        cada um é resolvido em um processo do pool a partir de um snapshot compacto
+        das dívidas (sem objetos do ORM). Os resultados, e a compensação entre grupos,
+        são gravados em uma única fase de escrita.
+        """
+        batch = OptimizationBatch()
+        
+        with batch.timed('load'):
+            rows = db.session.query(
+                Debt.id, Debt.debtor_id, Debt.creditor_id, Debt.amount,
+                Debt.source, Debt.created_at, Debt.expense_id, Debt.group_id
+            ).filter(Debt.status == 'pending', Debt.group_id.isnot(None)).all()
+        
+        with batch.timed('graph'):
+            snapshots_by_group = defaultdict(list)
+            all_snapshots = []
+            for row in rows:
+                snapshot = DebtSnapshot(*row)
+                snapshots_by_group[row.group_id].append(snapshot)
+                all_snapshots.append(snapshot)
+            
+            for snapshot, group_id in ShareVectorService.pending_debts():
+                snapshots_by_group[group_id].append(snapshot)
+                all_snapshots.append(snapshot)
+        
+        with batch.timed('solve'):
+            group_snapshots = list(snapshots_by_group.items())
+            workers = workers or os.cpu_count() or 1
+            
+            if workers > 1 and len(group_snapshots) > 1:
+                chunksize = max(1, len(group_snapshots) // (workers * 4))
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(solve_group_snapshot, group_snapshots, chunksize=chunksize))
+            else:
+                results = [solve_group_snapshot(group_snapshot) for group_snapshot in group_snapshots]
+        
+        for result in results:
+            if result is not None:
+                LogService._add_group_decision(batch, *result)
+        
+        # Compensação entre grupos sobre o estado após os planos dos grupos
+        LogService._optimize_cross_group_debts(batch.pending(all_snapshots), batch)
         
-        return optimized_count
+        optimized_count = batch.apply()
+        
+        return {
+            'groups': len(group_snapshots),
+            'debts': len(all_snapshots),
+            'workers': workers,
+            'optimized_count': optimized_count,
+            'timings_ms': {phase: round(ms, 3) for phase, ms in batch.timings.items()}
+        }
     
     @staticmethod
-    def _optimize_group_debts(debts, group_id):
-        """Otimiza dívidas dentro de um grupo específico"""
-        # Criar matriz de dívidas entre usuários
-        debt_matrix = defaultdict(lambda: defaultdict(float))
+    def optimize_group(group_id, user_ids=None):
+        """
+        Otimização incremental: reorganiza apenas as dívidas de um grupo e
+        compensa entre grupos somente os pares de usuários afetados.
+        user_ids são os participantes da mudança (ex.: pagador e devedores da nova despesa);
+        se omitido, considera todos os membros do grupo.
+        """
+        batch, _ = LogService._plan_group_optimization(group_id, user_ids)
+        return batch.apply()
+    
+    @staticmethod
+    def simulate_group(group_id, user_ids=None):
+        """
+        Simulação (dry-run) da otimização de um grupo: calcula o que seria cancelado
+        ou reorganizado sem gravar nada e retorna o plano, a contagem de
+        transferências antes/depois e o tempo de cada fase.
+        """
+        batch, considered_debts = LogService._plan_group_optimization(group_id, user_ids)
         
-        for debt in debts:
-            debt_matrix[debt.debtor_id][debt.creditor_id] += debt.amount
+        pairs_before = SettlementService.pair_totals(considered_debts)
+        pairs_after = SettlementService.pair_totals(batch.pending(considered_debts))
+        debts_by_id = {debt.id: debt for debt in considered_debts}
+        for debt_id, amount in batch.adjusted.items():
+            debt = debts_by_id[debt_id]
+            pairs_after[(debt.debtor_id, debt.creditor_id)] -= (
+                SettlementService.to_cents(debt.amount) - SettlementService.to_cents(amount)
+            )
         
-        optimized = []
+        plan = [
+            {'debtor_id': debtor_id, 'creditor_id': creditor_id, 'amount': cents / 100}
+            for (debtor_id, creditor_id), cents in sorted(pairs_after.items())
+            if cents > 0
+        ]
         
-        # Encontrar e cancelar dívidas bidirecionais
-        users = list(debt_matrix.keys())
-        for i, user1 in enumerate(users):
-            for user2 in users[i+1:]:
-                debt1to2 = debt_matrix[user1][user2]
-                debt2to1 = debt_matrix[user2][user1]
-                
-                if debt1to2 > 0 and debt2to1 > 0:
-                    # Cancelar o menor valor
-                    min_debt = min(debt1to2, debt2to1)
-                    
-                    # Encontrar e cancelar as dívidas reais
-                    debts_to_cancel = []
-                    remaining = min_debt
-                    
-                    for debt in debts:
-                        if remaining <= 0:
-                            break
-                        if ((debt.debtor_id == user1 and debt.creditor_id == user2) or 
-                            (debt.debtor_id == user2 and debt.creditor_id == user1)):
-                            if debt.amount <= remaining:
-                                debts_to_cancel.append(debt)
-                                remaining -= debt.amount
-                    
-                    for debt in debts_to_cancel:
-                        debt.cancel()
-                        optimized.append(debt)
+        return {
+            'group_id': group_id,
+            'dry_run': True,
+            'plan': plan,
+            'changes': batch.to_dict(),
+            'transfers_before': sum(1 for cents in pairs_before.values() if cents > 0),
+            'transfers_after': len(plan),
+            'debts_before': len(considered_debts),
+            'optimized_count': len(batch),
+            'timings_ms': {
+                phase: round(batch.timings.get(phase, 0.0), 3)
+                for phase in ('load', 'graph', 'solve', 'apply')
+            }
+        }
+    
+    @staticmethod
+    def removal_targets(expense):
+        """
+        Saldo pendente em centavos de cada membro do grupo sem a despesa (positivo = recebe):
+        o saldo das dívidas reorganizáveis menos o efeito da despesa, em que o pagador deixa de
+        receber e cada devedor deixa de dever a sua parte. Como no ledger, os pagamentos das
+        dívidas da própria despesa também saem. Lido antes de remover a despesa.
+        """
+        from app.models.expense import Expense
+        from app.services.balance_service import SETTLED_STATUSES
+        from app.services.split_service import SplitService
+
+        targets = SettlementService.net_balances(LogService._settleable_group_debts(expense.group_id))
+        parts = SplitService.stored_parts(Expense.id == expense.id).get(expense.id, [])
+        for user_id, amount in parts[1:]:
+            cents = SettlementService.to_cents(amount)
+            targets[user_id] += cents
+            targets[expense.payer_id] -= cents
+        for debt in expense.debts:
+            if debt.status in SETTLED_STATUSES:
+                cents = SettlementService.to_cents(debt.amount)
+                targets[debt.debtor_id] -= cents
+                targets[debt.creditor_id] += cents
+        return targets
+
+    @staticmethod
+    def resettle_group(group_id, targets):
+        """
+        Refaz as dívidas pendentes do grupo para os saldos alvo ({user_id: centavos}), ex.: após
+        remover uma despesa cujas dívidas já tinham virado acertos. Se as dívidas pendentes já
+        fecham com os alvos, nada muda; senão são substituídas por um plano de fluxo mínimo.
+        Retorna quantas dívidas foram substituídas.
+        """
+        batch = OptimizationBatch()
+
+        with batch.timed('load'):
+            settleable = LogService._settleable_group_debts(group_id)
+
+        balances = SettlementService.net_balances(settleable)
+        user_ids = set(balances) | set(targets)
+        if all(balances.get(user_id, 0) == targets.get(user_id, 0) for user_id in user_ids):
+            return 0
+
+        with batch.timed('solve'):
+            plan = SettlementService.settle(targets)
+
+        LogService._add_group_decision(batch, group_id, settleable, plan)
+        return batch.apply()
+
+    @staticmethod
+    def _settleable_group_debts(group_id):
+        """Dívidas pendentes reorganizáveis do grupo, incluindo as cotas ainda em vetores"""
+        group_debts = Debt.get_pending_debts().filter(
+            Debt.group_id == group_id,
+            Debt.source.in_(SETTLEABLE_SOURCES)
+        ).all()
+        group_debts += [debt for debt, _ in ShareVectorService.pending_debts(ExpenseShare.group_id == group_id)]
+        return group_debts
+
+    @staticmethod
+    def _plan_group_optimization(group_id, user_ids=None):
+        """Calcula (sem gravar) as decisões da otimização de um grupo"""
+        batch = OptimizationBatch()
         
-        if optimized:
-            LogService.create_optimization_log(optimized, group_id)
+        with batch.timed('load'):
+            if user_ids is None:
+                user_ids = [member.user_id for member in GroupMember.query.filter_by(group_id=group_id).all()]
+            
+            # Dívidas pendentes apenas deste grupo
+            group_debts = Debt.get_pending_debts().filter(Debt.group_id == group_id).all()
+            group_debts += [debt for debt, _ in ShareVectorService.pending_debts(ExpenseShare.group_id == group_id)]
+        
+        affected_users = set(user_ids)
+        LogService._optimize_group_debts(group_debts, group_id, batch, affected_users)
+        considered_debts = list(group_debts)
+        
+        # Compensação entre grupos restrita aos pares entre usuários afetados
+        if len(affected_users) > 1:
+            with batch.timed('load'):
+                pair_debts = Debt.get_pending_debts().filter(
+                    Debt.debtor_id.in_(affected_users),
+                    Debt.creditor_id.in_(affected_users)
+                ).all()
+                # Cotas em vetor entre os afetados: as do grupo já carregadas e as dos demais grupos
+                pair_debts += [
+                    debt for debt in group_debts
+                    if ShareVectorService.is_share_key(debt.id)
+                    and debt.debtor_id in affected_users and debt.creditor_id in affected_users
+                ]
+                pair_debts += [
+                    debt for debt, _ in ShareVectorService.pending_debts(
+                        ExpenseShare.creditor_id.in_(affected_users), ExpenseShare.group_id != group_id
+                    )
+                    if debt.debtor_id in affected_users
+                ]
+            LogService._optimize_cross_group_debts(batch.pending(pair_debts), batch)
+            
+            group_debt_ids = {debt.id for debt in group_debts}
+            considered_debts.extend(debt for debt in pair_debts if debt.id not in group_debt_ids)
+        
+        return batch, considered_debts
+    
+    @staticmethod
+    def _optimize_group_debts(debts, group_id, batch, affected_users=None):
+        """
+        Otimiza dívidas dentro de um grupo substituindo-as por um plano de quitação mínimo.
+        As decisões vão para o batch; se affected_users for informado, recebe os
+        usuários cujas dívidas mudaram.
+        """
+        settleable = [debt for debt in debts if debt.source in SETTLEABLE_SOURCES]
+        if not settleable:
+            return 0
+        
+        with batch.timed('graph'):
+            balances = SettlementService.net_balances(settleable)
+            pair_totals = SettlementService.pair_totals(settleable)
+        
+        with batch.timed('solve'):
+            decision = SettlementService.reorganize(settleable, balances, pair_totals)
+        
+        if decision is None:
+            return 0
+        
+        optimized, new_transfers = decision
+        LogService._add_group_decision(batch, group_id, optimized, new_transfers)
+        
+        if affected_users is not None:
+            for debt in optimized:
+                affected_users.update((debt.debtor_id, debt.creditor_id))
         
         return len(optimized)
     
     @staticmethod
-    def _optimize_cross_group_debts(all_debts):
-        """Otimiza dívidas entre grupos diferentes"""
-        # Agrupar dívidas por par de usuários
-        user_debts = defaultdict(float)
-        debt_objects = defaultdict(list)
+    def _add_group_decision(batch, group_id, optimized, new_transfers):
+        """Registra no batch os cancelamentos e as novas dívidas do plano de um grupo"""
+        for debt in optimized:
+            batch.cancel(debt)
         
-        for debt in all_debts:
-            key = tuple(sorted([debt.debtor_id, debt.creditor_id]))
-            if debt.debtor_id < debt.creditor_id:
-                user_debts[key] += debt.amount
-            else:
-                user_debts[key] -= debt.amount
-            debt_objects[key].append(debt)
+        # Os acertos pertencem ao grupo, não a uma despesa: remover uma despesa não os apaga
+        for transfer in new_transfers:
+            batch.add_debt(Debt(
+                id=str(uuid.uuid4()),
+                expense_id=None,
+                group_id=group_id,
+                debtor_id=transfer['debtor_id'],
+                creditor_id=transfer['creditor_id'],
+                amount=transfer['amount'],
+                status='pending',
+                source='settlement',
+                created_at=datetime.utcnow()
+            ))
+        
+        batch.add_log(LogService.build_optimization_log(optimized, group_id, new_transfers))
+    
+    @staticmethod
+    def _optimize_cross_group_debts(all_debts, batch):
+        """
+        Otimiza dívidas entre grupos diferentes: compensa os dois sentidos de cada par
+        e cancela ciclos (A -> B -> C -> A) no grafo de dívidas entre usuários.
+        """
+        with batch.timed('graph'):
+            debts_by_pair = defaultdict(list)
+            for debt in all_debts:
+                debts_by_pair[(debt.debtor_id, debt.creditor_id)].append(debt)
+            
+            graph = SettlementService.net_pair_graph(all_debts)
         
         optimized = []
+        reduced_cents = 0
         
-        for (user1, user2), net_debt in user_debts.items():
-            if abs(net_debt) < 0.01:  # Praticamente zero
-                # Cancelar todas as dívidas entre esses usuários
-                for debt in debt_objects[(user1, user2)]:
-                    debt.cancel()
-                    optimized.append(debt)
+        with batch.timed('solve'):
+            SettlementService.cancel_cycles(graph)
+            
+            # Ajustar as dívidas reais de cada par ao valor final do grafo
+            for (debtor_id, creditor_id), debts in debts_by_pair.items():
+                target = graph.get(debtor_id, {}).get(creditor_id, 0)
+                reduced = LogService._reconcile_pair_debts(debts, target, batch)
+                if reduced:
+                    reduced_cents += reduced
+                    optimized.extend(debts)
         
         if optimized:
-            LogService.create_optimization_log(optimized)
+            batch.add_log(LogService.build_optimization_log(optimized, amount=reduced_cents / 100))
+        
+        return len(optimized)
+    
+    @staticmethod
+    def _reconcile_pair_debts(debts, target_cents, batch):
+        """
+        Reduz as dívidas de um par (mesmo devedor e credor) até somarem target_cents:
+        mantém as maiores, cancela as excedentes e reduz no máximo uma.
+        Retorna quantos centavos foram reduzidos.
+        """
+        to_cents = SettlementService.to_cents
+        total = sum(to_cents(debt.amount) for debt in debts)
+        if total <= target_cents:
+            return 0
+        
+        kept = 0
+        for debt in sorted(debts, key=lambda debt: debt.amount, reverse=True):
+            cents = to_cents(debt.amount)
+            if kept >= target_cents:
+                batch.cancel(debt)
+            elif kept + cents <= target_cents:
+                kept += cents
+            else:
+                batch.adjust(debt, (target_cents - kept) / 100)
+                kept = target_cents
         
-        return len(optimized)
\ No newline at end of file
+        return total - target_cents
@@ -0,0 +1,161 @@
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import hmac
+import logging
+import os
+import queue
+import random
+import sys
+
+# Nome do logger raiz da aplicação (os módulos usam app.routes.user, app.models.debt, ...)
+ROOT_LOGGER = 'app'
+
+# Cabeçalho que liga o rastreamento em DEBUG apenas para a requisição atual
+TRACE_HEADER = 'X-Debug-Trace'
+
+# Se a requisição atual pediu rastreamento completo
+_trace_enabled = ContextVar('trace_enabled', default=False)
+
+
+class AppLogger:
+    """
+    Logger dos módulos da aplicação. Decide se a mensagem será registrada antes de
+    criar o registro (mensagens no estilo '%s', formatadas só quando emitidas):
+    nível configurado, amostragem por módulo e rastreamento por requisição.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._logger = logging.getLogger(name)
+        self._generation = -1
+        self._sample_rate = 1.0
+
+    def debug(self, msg, *args):
+        self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        self._log(logging.INFO, msg, args)
+
+    def warning(self, msg, *args):
+        self._log(logging.WARNING, msg, args)
+
+    def error(self, msg, *args):
+        self._log(logging.ERROR, msg, args)
+
+    def exception(self, msg, *args):
+        self._log(logging.ERROR, msg, args, exc_info=True)
+
+    def is_enabled_for(self, level):
+        """Se uma mensagem desse nível seria registrada (útil antes de montar detalhes caros)"""
+        if _trace_enabled.get():
+            return True
+        if not self._logger.isEnabledFor(level):
+            return False
+        if level < logging.WARNING:
+            # Amostragem vale só para mensagens de diagnóstico; avisos e erros sempre passam
+            rate = self._rate()
+            return rate >= 1.0 or random.random() < rate
+        return True
+
+    def _log(self, level, msg, args, exc_info=None):
+        if self.is_enabled_for(level):
+            self._logger._log(level, msg, args, exc_info=exc_info, stacklevel=3)
+
+    def _rate(self):
+        if self._generation != LoggingService._generation:
+            self._sample_rate = LoggingService.sample_rate(self.name)
+            self._generation = LoggingService._generation
+        return self._sample_rate
+
+
+class LoggingService:
+    """
+    Logging da aplicação: níveis (LOG_LEVEL), handler não bloqueante (as mensagens vão
+    para uma fila e uma thread escreve na saída), amostragem por módulo (LOG_SAMPLING,
+    ex.: 'app.routes.user=0.1,app.routes.marketplace=0.5') e rastreamento em DEBUG por
+    requisição, ligado pelo cabeçalho X-Debug-Trace com o valor de LOG_TRACE_TOKEN.
+    """
+
+    _queue = None
+    _listener = None
+    _sample_rates = {}
+    _generation = 0
+
+    @staticmethod
+    def get_logger(name):
+        return AppLogger(name)
+
+    @staticmethod
+    def init_app(app):
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(getattr(logging, str(app.config.get('LOG_LEVEL', 'INFO')).upper(), logging.INFO))
+        root.propagate = False
+
+        LoggingService._sample_rates = LoggingService._parse_sampling(app.config.get('LOG_SAMPLING', ''))
+        LoggingService._generation += 1
+
+        if LoggingService._queue is None:
+            LoggingService._queue = queue.SimpleQueue()
+            root.addHandler(QueueHandler(LoggingService._queue))
+            LoggingService._start_listener()
+            atexit.register(LoggingService._stop_listener)
+            if hasattr(os, 'register_at_fork'):
+                # O thread de escrita não sobrevive ao fork (gunicorn --preload)
+                os.register_at_fork(after_in_child=LoggingService._start_listener)
+
+        trace_token = app.config.get('LOG_TRACE_TOKEN')
+
+        @app.before_request
+        def _start_trace():
+            from flask import g, request
+            header = request.headers.get(TRACE_HEADER)
+            if header and (hmac.compare_digest(header, trace_token) if trace_token else app.debug):
+                g._trace_token = _trace_enabled.set(True)
+
+        @app.teardown_request
+        def _end_trace(exception=None):
+            from flask import g
+            token = g.pop('_trace_token', None)
+            if token is not None:
+                _trace_enabled.reset(token)
+
+    @staticmethod
+    def sample_rate(name):
+        """Fração das mensagens DEBUG/INFO registradas para o módulo (prefixo mais longo)"""
+        best, rate = '', 1.0
+        for prefix, prefix_rate in LoggingService._sample_rates.items():
+            if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > len(best):
+                best, rate = prefix, prefix_rate
+        return rate
+
+    @staticmethod
+    def tracing():
+        """Se a requisição atual está com rastreamento ligado"""
+        return _trace_enabled.get()
+
+    @staticmethod
+    def _parse_sampling(spec):
+        rates = {}
+        for item in (spec or '').split(','):
+            if '=' not in item:
+                continue
+            name, rate = item.split('=', 1)
+            try:
+                rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+            except ValueError:
+                continue
+        return rates
+
+    @staticmethod
+    def _start_listener():
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('[%(levelname)s] %(name)s: %(message)s'))
+        LoggingService._listener = QueueListener(LoggingService._queue, handler)
+        LoggingService._listener.start()
+
+    @staticmethod
+    def _stop_listener():
+        if LoggingService._listener is not None:
+            LoggingService._listener.stop()
+            LoggingService._listener = None
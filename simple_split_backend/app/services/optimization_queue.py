@@ -0,0 +1,196 @@
+from app import db
+from app.models.optimization_job import OptimizationJob
+from app.services.log_service import LogService
+from app.services.logging_service import LoggingService
+from flask import current_app
+from datetime import datetime, timedelta
+import os
+import threading
+
+logger = LoggingService.get_logger(__name__)
+
+
+class OptimizationQueue:
+    """
+    Fila local de otimização de dívidas, persistida na tabela optimization_jobs.
+    Disparos para o mesmo grupo enquanto o job ainda está na fila são agrupados
+    em uma única execução; um worker em segundo plano processa os jobs.
+    """
+
+    _worker = None
+    _worker_pid = None
+    _wakeup = threading.Event()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enqueue(group_id, user_ids=None):
+        """Agenda a otimização de um grupo, agrupando com um job já na fila"""
+        job = OptimizationJob.query.filter_by(group_id=group_id, status='queued').first()
+
+        if job:
+            job.merge_user_ids(user_ids)
+            job.trigger_count = (job.trigger_count or 1) + 1
+        else:
+            delay = current_app.config.get('OPTIMIZATION_COALESCE_SECONDS', 2.0)
+            job = OptimizationJob(
+                group_id=group_id,
+                user_ids=','.join(sorted(set(user_ids))) if user_ids else None,
+                run_after=datetime.utcnow() + timedelta(seconds=delay)
+            )
+            db.session.add(job)
+
+        db.session.commit()
+
+        if current_app.config.get('OPTIMIZATION_MODE') == 'sync':
+            OptimizationQueue.run_job(job.id)
+        else:
+            OptimizationQueue._ensure_worker(current_app._get_current_object())
+            OptimizationQueue._wakeup.set()
+
+        return job
+
+    @staticmethod
+    def run_now(group_id, user_ids=None):
+        """Executa imediatamente a otimização do grupo, absorvendo disparos já na fila"""
+        job = OptimizationJob.query.filter_by(group_id=group_id, status='queued').first()
+
+        if job:
+            job.merge_user_ids(user_ids)
+            job.trigger_count = (job.trigger_count or 1) + 1
+        else:
+            job = OptimizationJob(
+                group_id=group_id,
+                user_ids=','.join(sorted(set(user_ids))) if user_ids else None
+            )
+            db.session.add(job)
+
+        db.session.commit()
+        OptimizationQueue.run_job(job.id)
+
+        return OptimizationJob.query.get(job.id)
+
+    @staticmethod
+    def run_job(job_id):
+        """Reserva e executa um job; retorna False se outro worker já o reservou"""
+        # Reserva atômica: apenas um processo consegue mudar queued -> running
+        claimed = OptimizationJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'started_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        if not claimed:
+            return False
+
+        job = OptimizationJob.query.get(job_id)
+        db.session.refresh(job)
+
+        try:
+            job.optimized_count = LogService.optimize_group(job.group_id, job.get_user_ids())
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            job = OptimizationJob.query.get(job_id)
+            job.status = 'failed'
+            job.error = str(e)
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def reclaim_stale(lease_seconds=None):
+        """
+        Devolve à fila os jobs presos em 'running' há mais que o lease (o processo que os
+        reservou caiu no meio da execução). Retorna quantos foram devolvidos.
+        """
+        if lease_seconds is None:
+            lease_seconds = current_app.config.get('OPTIMIZATION_LEASE_SECONDS', 300.0)
+        now = datetime.utcnow()
+
+        reclaimed = OptimizationJob.query.filter(
+            OptimizationJob.status == 'running',
+            OptimizationJob.started_at < now - timedelta(seconds=lease_seconds)
+        ).update(
+            {'status': 'queued', 'started_at': None, 'run_after': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        if reclaimed:
+            logger.warning("%s job(s) de otimização presos em execução voltaram para a fila", reclaimed)
+        return reclaimed
+
+    @staticmethod
+    def run_pending(limit=50):
+        """Executa os jobs cuja janela de agrupamento já terminou, recuperando antes os presos em execução"""
+        OptimizationQueue.reclaim_stale()
+
+        due_jobs = OptimizationJob.query.filter(
+            OptimizationJob.status == 'queued',
+            OptimizationJob.run_after <= datetime.utcnow()
+        ).order_by(OptimizationJob.run_after).limit(limit).all()
+
+        job_ids = [job.id for job in due_jobs]
+        executed = 0
+        for job_id in job_ids:
+            if OptimizationQueue.run_job(job_id):
+                executed += 1
+
+        return executed
+
+    @staticmethod
+    def resume(app):
+        """Na inicialização, inicia o worker se um processo anterior deixou jobs na fila ou em execução"""
+        if app.config.get('OPTIMIZATION_MODE') == 'sync':
+            return False
+
+        with app.app_context():
+            leftover = OptimizationJob.query.filter(
+                OptimizationJob.status.in_(('queued', 'running'))
+            ).first()
+        if leftover:
+            OptimizationQueue._ensure_worker(app)
+        return leftover is not None
+
+    @staticmethod
+    def get_latest_job(group_id):
+        """Último job de otimização de um grupo"""
+        return OptimizationJob.query.filter_by(group_id=group_id)\
+            .order_by(OptimizationJob.created_at.desc()).first()
+
+    @staticmethod
+    def _ensure_worker(app):
+        """Inicia o worker deste processo (uma vez por processo, inclusive após fork do gunicorn)"""
+        with OptimizationQueue._lock:
+            worker = OptimizationQueue._worker
+            if worker and worker.is_alive() and OptimizationQueue._worker_pid == os.getpid():
+                return
+
+            worker = threading.Thread(
+                target=OptimizationQueue._worker_loop,
+                args=(app,),
+                name='optimization-worker',
+                daemon=True
+            )
+            OptimizationQueue._worker = worker
+            OptimizationQueue._worker_pid = os.getpid()
+            worker.start()
+
+    @staticmethod
+    def _worker_loop(app):
+        """Laço do worker: acorda a cada disparo ou intervalo e processa os jobs vencidos"""
+        poll_interval = app.config.get('OPTIMIZATION_POLL_SECONDS', 1.0)
+
+        while True:
+            OptimizationQueue._wakeup.wait(poll_interval)
+            OptimizationQueue._wakeup.clear()
+
+            with app.app_context():
+                try:
+                    OptimizationQueue.run_pending()
+                except Exception as e:
+                    logger.error("Erro no worker de otimização: %s", e)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
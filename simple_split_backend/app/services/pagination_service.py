@@ -0,0 +1,85 @@
+from app import db
+from datetime import datetime
+import base64
+import json
+
+# Tamanho padrão e máximo das páginas
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Cursor de paginação malformado ou de outra ordenação"""
+
+
+class PaginationService:
+    """
+    Paginação por keyset (cursor): cada página continua a partir dos valores de ordenação
+    do último item da anterior, então o custo não cresce com a profundidade do histórico
+    (ao contrário de OFFSET). A ordem padrão é decrescente (mais recentes primeiro).
+    """
+
+    @staticmethod
+    def page_size(value):
+        """Tamanho de página pedido, limitado a [1, MAX_PAGE_SIZE]"""
+        try:
+            size = int(value) if value is not None else DEFAULT_PAGE_SIZE
+        except (TypeError, ValueError):
+            size = DEFAULT_PAGE_SIZE
+        return min(max(size, 1), MAX_PAGE_SIZE)
+
+    @staticmethod
+    def encode_cursor(values):
+        """Cursor opaco com os valores de ordenação de um item"""
+        payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, size):
+        """Valores de ordenação do cursor (datas ISO voltam como datetime)"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        except (ValueError, UnicodeDecodeError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != size:
+            raise InvalidCursor(cursor)
+
+        decoded = []
+        for value in values:
+            if isinstance(value, str):
+                try:
+                    value = datetime.fromisoformat(value)
+                except ValueError:
+                    pass
+            decoded.append(value)
+        return decoded
+
+    @staticmethod
+    def keyset_page(query, columns, limit, cursor=None, key=None, descending=True):
+        """
+        Uma página de query ordenada por columns (a última deve ser única, ex.: id).
+        key(item) devolve os valores de ordenação do item (padrão: atributos com o nome das colunas).
+        Retorna (itens, próximo cursor ou None). Levanta InvalidCursor.
+        """
+        if cursor:
+            values = PaginationService.decode_cursor(cursor, len(columns))
+            query = query.filter(PaginationService._after(columns, values, descending))
+
+        order = [column.desc() if descending else column.asc() for column in columns]
+        rows = query.order_by(*order).limit(limit + 1).all()
+        items = rows[:limit]
+        if len(rows) <= limit:
+            return items, None
+
+        key = key or (lambda item: [getattr(item, column.key) for column in columns])
+        return items, PaginationService.encode_cursor(key(items[-1]))
+
+    @staticmethod
+    def _after(columns, values, descending=True):
+        """Condição 'depois de values' na ordem: (a < x) OR (a = x AND b < y) ... (> se crescente)"""
+        conditions = []
+        for index, (column, value) in enumerate(zip(columns, values)):
+            equal_prefix = [columns[i] == values[i] for i in range(index)]
+            conditions.append(db.and_(*equal_prefix, column < value if descending else column > value))
+        return db.or_(*conditions)
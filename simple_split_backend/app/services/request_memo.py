@@ -0,0 +1,109 @@
+from flask import g, has_app_context
+
+# Chave em flask.g onde ficam os valores memoizados da requisição atual
+MEMO_ATTR = '_request_memo'
+
+
+class RequestMemo:
+    """
+    Memoização por requisição de consultas repetidas (saldos, participação em grupos,
+    usuários). Os valores ficam em flask.g e são descartados no teardown do contexto,
+    então nunca atravessam requisições.
+    """
+
+    @staticmethod
+    def init_app(app):
+        """Registra o descarte da memoização ao fim de cada contexto"""
+        app.teardown_appcontext(RequestMemo._teardown)
+
+    @staticmethod
+    def get(namespace, key, factory):
+        """Retorna o valor memoizado de (namespace, key), calculando com factory() na primeira vez"""
+        if not has_app_context():
+            return factory()
+
+        bucket = RequestMemo._bucket(namespace)
+        if key not in bucket:
+            bucket[key] = factory()
+        return bucket[key]
+
+    @staticmethod
+    def set(namespace, key, value):
+        """Guarda um valor já calculado (ex.: resultados de uma consulta em lote)"""
+        if has_app_context():
+            RequestMemo._bucket(namespace)[key] = value
+        return value
+
+    @staticmethod
+    def invalidate(*namespaces):
+        """Descarta os namespaces informados (ou tudo) após uma escrita na mesma requisição"""
+        if not has_app_context():
+            return
+        store = g.get(MEMO_ATTR)
+        if not store:
+            return
+        if not namespaces:
+            store.clear()
+        for namespace in namespaces:
+            store.pop(namespace, None)
+
+    @staticmethod
+    def user_group_ids(user_id):
+        """Ids dos grupos de que o usuário é membro"""
+        from app import db
+        from app.models.user import GroupMember
+
+        return RequestMemo.get('user_group_ids', user_id, lambda: [
+            group_id for (group_id,) in db.session.query(GroupMember.group_id)
+            .filter(GroupMember.user_id == user_id).all()
+        ])
+
+    @staticmethod
+    def is_member(user_id, group_id):
+        """Se o usuário é membro do grupo"""
+        return group_id in RequestMemo.user_group_ids(user_id)
+
+    @staticmethod
+    def get_user(user_id):
+        """Usuário pelo id (None se não existir)"""
+        from app.models.user import User
+
+        return RequestMemo.get('users', user_id, lambda: User.query.get(user_id))
+
+    @staticmethod
+    def get_users(user_ids, *options):
+        """
+        Carrega vários usuários de uma vez, consultando só os ainda não memoizados.
+        options são opções de carregamento da consulta (ex.: db.selectinload(User.wallet)).
+        """
+        from app.models.user import User
+
+        user_ids = set(user_ids)
+        if not has_app_context():
+            return {user.id: user for user in User.query.options(*options).filter(User.id.in_(user_ids)).all()}
+
+        bucket = RequestMemo._bucket('users')
+        missing = [user_id for user_id in user_ids if user_id not in bucket]
+        if missing:
+            loaded = {user.id: user for user in User.query.options(*options).filter(User.id.in_(missing)).all()}
+            for user_id in missing:
+                bucket[user_id] = loaded.get(user_id)
+        return {user_id: bucket[user_id] for user_id in user_ids}
+
+    @staticmethod
+    def user_name(user_id):
+        """Nome do usuário (None se não existir)"""
+        user = RequestMemo.get_user(user_id)
+        return user.name if user else None
+
+    @staticmethod
+    def _bucket(namespace):
+        store = g.get(MEMO_ATTR)
+        if store is None:
+            store = {}
+            setattr(g, MEMO_ATTR, store)
+        return store.setdefault(namespace, {})
+
+    @staticmethod
+    def _teardown(exception=None):
+        g.pop(MEMO_ATTR, None)
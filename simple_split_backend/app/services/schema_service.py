@@ -0,0 +1,175 @@
+from app import db
+from app.services.logging_service import LoggingService
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+logger = LoggingService.get_logger(__name__)
+
+
+class SchemaService:
+    """
+    Ajustes de esquema em bancos já existentes (o projeto não usa migrações):
+    create_all só cria tabelas novas, então colunas adicionadas aos modelos
+    são criadas aqui com ALTER TABLE ... ADD COLUMN, e colunas que passaram a
+    aceitar NULL perdem o NOT NULL.
+    """
+
+    @staticmethod
+    def upgrade():
+        """
+        Cria tabelas, colunas e índices que faltam e preenche os dados derivados ausentes.
+        Todas as etapas são idempotentes: pode rodar de novo após uma falha ou em outro worker.
+        """
+        db.create_all()
+        # create_all não altera tabelas existentes: criar colunas e índices declarados depois delas
+        SchemaService.add_missing_columns()
+        SchemaService.relax_not_null_columns()
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        return SchemaService.backfill()
+
+    @staticmethod
+    def backfill():
+        """
+        Preenche dados derivados que faltam, detectados nos próprios dados e não pelas colunas
+        recém-criadas: uma inicialização interrompida é completada pela seguinte. Cada etapa
+        confirma a própria transação. Retorna os nomes das etapas executadas.
+        """
+        from app.models.debt import Debt
+        from app.models.expense import Expense
+        from app.models.expense_rollup import ExpenseRollup
+        from app.models.group import Group
+        from app.models.group_balance import GroupBalance
+        from app.models.user import GroupMember
+        from app.services.balance_service import BalanceService
+        from app.services.expense_rollup_service import ExpenseRollupService
+
+        done = []
+
+        # Contadores do grupo criados zerados em grupos que já tinham membros ou despesas
+        has_members = db.select(GroupMember.id).where(GroupMember.group_id == Group.id).exists()
+        has_expenses = db.select(Expense.id).where(Expense.group_id == Group.id).exists()
+        group_ids = [group_id for (group_id,) in db.session.query(Group.id).filter(db.or_(
+            db.and_(Group.members_count == 0, has_members),
+            db.and_(Group.expenses_count == 0, has_expenses)
+        )).all()]
+        if group_ids:
+            Group.repair_counters(group_ids)
+            db.session.commit()
+            done.append('group_counters')
+
+        # Dívidas antigas sem grupo (ou acertos da otimização ainda presos a uma despesa)
+        expense_exists = db.select(Expense.id).where(Expense.id == Debt.expense_id).exists()
+        if db.session.query(Debt.id).filter(db.or_(
+            db.and_(Debt.group_id.is_(None), expense_exists),
+            db.and_(Debt.source == 'settlement', Debt.expense_id.isnot(None))
+        )).first():
+            Debt.repair_groups()
+            db.session.commit()
+            done.append('debt_groups')
+
+        # Ledger anterior às partes por membro (antes era a cota igual do grupo)
+        group_ids = [group_id for (group_id,) in db.session.query(GroupBalance.group_id)
+                     .filter(GroupBalance.share_total.is_(None)).distinct().all()]
+        if group_ids:
+            for group_id in group_ids:
+                BalanceService.rebuild_group(group_id)
+            db.session.commit()
+            done.append('group_balances')
+
+        # Totais mensais ausentes (tabela nova) ou ainda sem centavos (linhas da versão em float)
+        has_rollups = db.select(ExpenseRollup.id).where(ExpenseRollup.group_id == Expense.group_id).exists()
+        group_ids = {group_id for (group_id,) in db.session.query(Expense.group_id).filter(~has_rollups).distinct().all()}
+        group_ids.update(group_id for (group_id,) in db.session.query(ExpenseRollup.group_id).filter(db.or_(
+            ExpenseRollup.paid_cents.is_(None), ExpenseRollup.spent_cents.is_(None)
+        )).distinct().all())
+        if group_ids:
+            ExpenseRollupService.rebuild(group_ids)
+            db.session.commit()
+            done.append('expense_rollups')
+
+        if done:
+            logger.info("Dados derivados preenchidos: %s", ', '.join(done))
+        return done
+
+    @staticmethod
+    def add_missing_columns():
+        """
+        Cria as colunas declaradas nos modelos que ainda não existem no banco.
+        Só colunas que aceitam NULL ou têm server_default podem ser adicionadas a tabelas com dados.
+        Retorna a lista de 'tabela.coluna' criadas.
+        """
+        inspector = inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        added = []
+
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.error("Coluna %s.%s não pode ser adicionada: NOT NULL sem server_default",
+                                 table.name, column.name)
+                    continue
+
+                column_sql = CreateColumn(column).compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column_sql}')
+                added.append(f'{table.name}.{column.name}')
+                logger.info("Coluna %s.%s adicionada", table.name, column.name)
+
+        return added
+
+    @staticmethod
+    def relax_not_null_columns():
+        """
+        Remove o NOT NULL das colunas que os modelos passaram a declarar como nullable.
+        O SQLite não altera colunas: a tabela é recriada com o esquema do modelo e os dados copiados
+        (os índices declarados são recriados depois, junto com os das demais tabelas).
+        Retorna a lista de 'tabela.coluna' alteradas.
+        """
+        inspector = inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        relaxed = []
+
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name']: column for column in inspector.get_columns(table.name)}
+            columns = [
+                column.name for column in table.columns
+                if column.nullable and not column.primary_key
+                and column.name in existing_columns and not existing_columns[column.name]['nullable']
+            ]
+            if not columns:
+                continue
+
+            with db.engine.begin() as connection:
+                if db.engine.dialect.name == 'sqlite':
+                    SchemaService._rebuild_sqlite_table(connection, table, list(existing_columns))
+                else:
+                    for name in columns:
+                        connection.exec_driver_sql(f'ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL')
+            relaxed.extend(f'{table.name}.{name}' for name in columns)
+            logger.info("Colunas %s passaram a aceitar NULL", ', '.join(f'{table.name}.{name}' for name in columns))
+
+        return relaxed
+
+    @staticmethod
+    def _rebuild_sqlite_table(connection, table, existing_columns):
+        """Recria a tabela com o esquema do modelo (cria a nova, copia, remove a antiga e renomeia)"""
+        new_name = f'{table.name}_rebuild'
+        create_sql = str(CreateTable(table).compile(dialect=db.engine.dialect)).strip()
+        create_sql = create_sql.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {new_name} ', 1)
+        column_list = ', '.join(name for name in table.columns.keys() if name in existing_columns)
+
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {new_name}')
+        connection.exec_driver_sql(create_sql)
+        connection.exec_driver_sql(f'INSERT INTO {new_name} ({column_list}) SELECT {column_list} FROM {table.name}')
+        connection.exec_driver_sql(f'DROP TABLE {table.name}')
+        connection.exec_driver_sql(f'ALTER TABLE {new_name} RENAME TO {table.name}')
@@ -0,0 +1,271 @@
+import heapq
+from collections import defaultdict, namedtuple
+
+# Origens de dívida que podem ser reorganizadas pelo motor de quitação.
+# Títulos comprados pertencem ao comprador e não entram na simplificação do grupo.
+SETTLEABLE_SOURCES = ('group_debt', 'settlement')
+
+# Cópia compacta de uma dívida pendente, enviada aos processos da otimização em lote
+DebtSnapshot = namedtuple(
+    'DebtSnapshot',
+    ['id', 'debtor_id', 'creditor_id', 'amount', 'source', 'created_at', 'expense_id', 'group_id'],
+    defaults=(None,)
+)
+
+
+class SettlementService:
+    """Motor de quitação por fluxo mínimo de caixa (greedy com heaps)"""
+
+    @staticmethod
+    def to_cents(amount):
+        """Converte um valor em reais para centavos inteiros"""
+        return int(round(amount * 100))
+
+    @staticmethod
+    def net_balances(debts):
+        """Calcula o saldo líquido em centavos de cada usuário (positivo = recebe)"""
+        balances = defaultdict(int)
+        for debt in debts:
+            cents = SettlementService.to_cents(debt.amount)
+            balances[debt.creditor_id] += cents
+            balances[debt.debtor_id] -= cents
+        return balances
+
+    @staticmethod
+    def pair_totals(debts):
+        """Soma em centavos as dívidas de cada par (devedor, credor)"""
+        totals = defaultdict(int)
+        for debt in debts:
+            totals[(debt.debtor_id, debt.creditor_id)] += SettlementService.to_cents(debt.amount)
+        return totals
+
+    @staticmethod
+    def settle(balances):
+        """
+        Reduz os saldos líquidos ao menor número de transferências.
+        A cada passo o maior devedor paga ao maior credor; quem zera sai do heap.
+        Gera no máximo n-1 transferências em O(n log n).
+        """
+        creditors = []
+        debtors = []
+        for user_id, cents in balances.items():
+            if cents > 0:
+                heapq.heappush(creditors, (-cents, user_id))
+            elif cents < 0:
+                heapq.heappush(debtors, (cents, user_id))
+
+        plan = []
+        while creditors and debtors:
+            credit, creditor_id = heapq.heappop(creditors)
+            debit, debtor_id = heapq.heappop(debtors)
+            cents = min(-credit, -debit)
+
+            plan.append({
+                'debtor_id': debtor_id,
+                'creditor_id': creditor_id,
+                'amount': cents / 100
+            })
+
+            if -credit > cents:
+                heapq.heappush(creditors, (credit + cents, creditor_id))
+            if -debit > cents:
+                heapq.heappush(debtors, (debit + cents, debtor_id))
+
+        return plan
+
+    @staticmethod
+    def build_plan(debts):
+        """Gera o plano de quitação de um conjunto de dívidas pendentes"""
+        return SettlementService.settle(SettlementService.net_balances(debts))
+
+    @staticmethod
+    def reorganize(settleable, balances, pair_totals):
+        """
+        Decide a reorganização das dívidas de um grupo.
+        Retorna None se o plano não reduzir o número de pagamentos; senão
+        (dívidas a cancelar, novas transferências).
+        Pares que já coincidem com o plano são mantidos.
+        """
+        plan = SettlementService.settle(balances)
+        if len(plan) >= len(pair_totals):
+            return None
+
+        kept_pairs = set()
+        new_transfers = []
+        for transfer in plan:
+            pair = (transfer['debtor_id'], transfer['creditor_id'])
+            if pair_totals.get(pair) == SettlementService.to_cents(transfer['amount']):
+                kept_pairs.add(pair)
+            else:
+                new_transfers.append(transfer)
+
+        cancelled = [
+            debt for debt in settleable
+            if (debt.debtor_id, debt.creditor_id) not in kept_pairs
+        ]
+
+        return cancelled, new_transfers
+
+    @staticmethod
+    def net_pair_graph(debts):
+        """
+        Monta o grafo de dívidas entre usuários (devedor -> credor, em centavos),
+        já compensando os dois sentidos de cada par.
+        """
+        totals = SettlementService.pair_totals(debts)
+        graph = defaultdict(dict)
+        for (debtor_id, creditor_id), cents in totals.items():
+            if (creditor_id, debtor_id) in totals and creditor_id < debtor_id:
+                continue  # Par já processado no outro sentido
+            net = cents - totals.get((creditor_id, debtor_id), 0)
+            if net > 0:
+                graph[debtor_id][creditor_id] = net
+            elif net < 0:
+                graph[creditor_id][debtor_id] = -net
+        return graph
+
+    @staticmethod
+    def strongly_connected_components(graph):
+        """Componentes fortemente conexas (Tarjan iterativo, O(V + E))"""
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        counter = 0
+
+        for root in list(graph):
+            if root in index:
+                continue
+
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(graph.get(root, {})))]
+
+            while work:
+                node, neighbors = work[-1]
+                advanced = False
+
+                for neighbor in neighbors:
+                    if neighbor not in index:
+                        index[neighbor] = low[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack.add(neighbor)
+                        work.append((neighbor, iter(graph.get(neighbor, {}))))
+                        advanced = True
+                        break
+                    elif neighbor in on_stack:
+                        low[node] = min(low[node], index[neighbor])
+
+                if advanced:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+        return components
+
+    @staticmethod
+    def cancel_cycles(graph):
+        """
+        Cancela ciclos de dívida (A -> B -> C -> A) subtraindo o menor valor do ciclo
+        de todas as arestas. Só percorre componentes fortemente conexas, e cada ciclo
+        encontrado zera ao menos uma aresta, então o custo fica próximo de linear no
+        número de arestas. Altera o grafo e retorna o total cancelado em centavos.
+        """
+        cancelled = 0
+
+        for component in SettlementService.strongly_connected_components(graph):
+            if len(component) < 2:
+                continue
+
+            nodes = set(component)
+            finished = set()
+
+            for start in component:
+                if start in finished:
+                    continue
+
+                path = [start]
+                position = {start: 0}
+                neighbors = {start: iter(list(graph.get(start, {})))}
+
+                while path:
+                    node = path[-1]
+                    advanced = False
+
+                    for neighbor in neighbors[node]:
+                        if neighbor not in nodes or neighbor in finished:
+                            continue
+                        if graph[node].get(neighbor, 0) <= 0:
+                            continue
+
+                        if neighbor in position:
+                            # Ciclo encontrado: path[position[neighbor]:] -> neighbor
+                            cycle = path[position[neighbor]:]
+                            edges = list(zip(cycle, cycle[1:] + [neighbor]))
+                            amount = min(graph[a][b] for a, b in edges)
+
+                            first_zeroed = None
+                            for a, b in edges:
+                                graph[a][b] -= amount
+                                if graph[a][b] == 0:
+                                    del graph[a][b]
+                                    if first_zeroed is None:
+                                        first_zeroed = a
+                            cancelled += amount * len(edges)
+
+                            # Voltar o caminho até a origem da primeira aresta zerada
+                            while path[-1] != first_zeroed:
+                                del position[path.pop()]
+                        else:
+                            position[neighbor] = len(path)
+                            path.append(neighbor)
+                            neighbors[neighbor] = iter(list(graph.get(neighbor, {})))
+
+                        advanced = True
+                        break
+
+                    if not advanced:
+                        finished.add(node)
+                        del position[path.pop()]
+
+        return cancelled
+
+
+def solve_group_snapshot(group_snapshot):
+    """
+    Resolve um grupo a partir de um snapshot (group_id, [DebtSnapshot]).
+    Função de módulo para poder ser enviada a um ProcessPoolExecutor; não acessa o banco.
+    Retorna (group_id, dívidas a cancelar, novas transferências) ou None.
+    """
+    group_id, debts = group_snapshot
+    settleable = [debt for debt in debts if debt.source in SETTLEABLE_SOURCES]
+    if not settleable:
+        return None
+
+    decision = SettlementService.reorganize(
+        settleable,
+        SettlementService.net_balances(settleable),
+        SettlementService.pair_totals(settleable)
+    )
+    if decision is None:
+        return None
+
+    cancelled, new_transfers = decision
+    return group_id, cancelled, new_transfers
@@ -0,0 +1,484 @@
+from app import db
+from app.models.debt import Debt
+from app.models.expense_share import ExpenseShare
+from app.models.user import GroupMember
+from app.services.logging_service import LoggingService
+from app.services.request_memo import RequestMemo
+from app.services.settlement_service import DebtSnapshot
+from flask import current_app, has_app_context
+from collections import defaultdict
+import struct
+import uuid
+
+logger = LoggingService.get_logger(__name__)
+
+# Padrão de SHARE_VECTOR_MIN_MEMBERS (devedores a partir dos quais a divisão vira vetor)
+DEFAULT_MIN_MEMBERS = 200
+
+# Tentativas do UPDATE condicional ao fechar posições disputadas por outro processo
+CLOSE_RETRIES = 3
+
+# Chave de uma cota em vetor ('<id do vetor>:<posição>'), usada no lugar do id de dívida
+SHARE_KEY_SEPARATOR = ':'
+
+
+class ShareVectorService:
+    """
+    Vetores de cotas (expense_shares) para grupos grandes: a divisão de uma despesa vira uma
+    linha com o bitmap dos devedores em vez de uma dívida por membro. Saldos pendentes, listagens
+    e a otimização leem os vetores diretamente; a dívida de um par só é gravada (materializada)
+    quando precisa existir como registro, ao ser paga ou vendida.
+    """
+
+    @staticmethod
+    def enabled_for(debtor_count):
+        """Se uma divisão com debtor_count devedores deve ser gravada como vetor"""
+        threshold = DEFAULT_MIN_MEMBERS
+        if has_app_context():
+            threshold = current_app.config.get('SHARE_VECTOR_MIN_MEMBERS', DEFAULT_MIN_MEMBERS)
+        return threshold > 0 and debtor_count >= threshold
+
+    @staticmethod
+    def member_positions(group_id):
+        """{user_id: posição} dos membros; membros antigos ainda sem posição recebem uma agora (sem commit)"""
+        rows = db.session.query(GroupMember.id, GroupMember.user_id, GroupMember.position)\
+            .filter(GroupMember.group_id == group_id)\
+            .order_by(GroupMember.joined_at, GroupMember.id).all()
+
+        positions = {user_id: position for _, user_id, position in rows if position is not None}
+        missing = [(member_id, user_id) for member_id, user_id, position in rows if position is None]
+        if missing:
+            next_position = max(positions.values(), default=-1) + 1
+            updates = []
+            for offset, (member_id, user_id) in enumerate(missing):
+                positions[user_id] = next_position + offset
+                updates.append({'id': member_id, 'position': next_position + offset})
+            db.session.execute(db.update(GroupMember), updates)
+        return positions
+
+    @staticmethod
+    def build_row(expense_id, group_id, creditor_id, debtor_ids, unit_amount, created_at, positions, weights=None):
+        """
+        Linha do vetor de cotas de uma despesa (dict para INSERT) ou None se algum devedor
+        não tiver posição no grupo (a divisão segue então como dívidas).
+        weights: peso inteiro de cada devedor (padrão 1); a parte de cada um é unit_amount * peso
+        arredondado a centavos (SplitService grava partes em centavos com unit_amount 0.01).
+        """
+        weight_by_position = {}
+        for index, debtor_id in enumerate(debtor_ids):
+            position = positions.get(debtor_id)
+            if position is None:
+                return None
+            weight_by_position[position] = weights[index] if weights else 1
+
+        ordered = sorted(weight_by_position)
+        ordered_weights = [weight_by_position[position] for position in ordered]
+        packed_weights = None
+        if any(weight != 1 for weight in ordered_weights):
+            packed_weights = struct.pack(f'<{len(ordered_weights)}I', *ordered_weights)
+
+        return {
+            'id': str(uuid.uuid4()),
+            'expense_id': expense_id,
+            'group_id': group_id,
+            'creditor_id': creditor_id,
+            'unit_amount': unit_amount,
+            'participants': ShareVectorService.encode_bitmap(ordered),
+            'weights': packed_weights,
+            'closed': b'',
+            'open_count': len(ordered),
+            'created_at': created_at
+        }
+
+    @staticmethod
+    def encode_bitmap(positions):
+        """Bitmap compacto (bytes little-endian) com os bits das posições ligados"""
+        bitmap = 0
+        for position in positions:
+            bitmap |= 1 << position
+        return ShareVectorService._to_bytes(bitmap)
+
+    @staticmethod
+    def decode_bitmap(data):
+        return int.from_bytes(data or b'', 'little')
+
+    @staticmethod
+    def bit_positions(bitmap):
+        """Posições dos bits ligados, em ordem crescente"""
+        return [position for position, bit in enumerate(bin(bitmap)[:1:-1]) if bit == '1']
+
+    @staticmethod
+    def pending_amounts(share):
+        """[(posição, valor)] das cotas ainda pendentes no vetor"""
+        return ShareVectorService._amounts(share, ShareVectorService.decode_bitmap(share.closed))
+
+    @staticmethod
+    def split_amounts(share):
+        """[(user_id, valor)] da divisão original do vetor (cotas pendentes ou não)"""
+        users = ShareVectorService._position_users(share.group_id)
+        return [
+            (users[position], amount) for position, amount in ShareVectorService._amounts(share, 0)
+            if position in users
+        ]
+
+    @staticmethod
+    def _amounts(share, closed):
+        """[(posição, valor)] das cotas do vetor fora do bitmap closed"""
+        participants = ShareVectorService.bit_positions(ShareVectorService.decode_bitmap(share.participants))
+        weights = None
+        if share.weights:
+            weights = struct.unpack(f'<{len(participants)}I', share.weights)
+
+        amounts = []
+        for index, position in enumerate(participants):
+            if closed >> position & 1:
+                continue
+            if weights:
+                # Com pesos a parte é um valor em centavos (SplitService): desfazer o erro do float
+                amounts.append((position, round(share.unit_amount * weights[index], 2)))
+            else:
+                amounts.append((position, share.unit_amount))
+        return amounts
+
+    @staticmethod
+    def open_shares(*criteria):
+        """Vetores com cotas pendentes (linhas leves, sem objetos do ORM)"""
+        return db.session.query(
+            ExpenseShare.id, ExpenseShare.expense_id, ExpenseShare.group_id, ExpenseShare.creditor_id,
+            ExpenseShare.unit_amount, ExpenseShare.participants, ExpenseShare.weights,
+            ExpenseShare.closed, ExpenseShare.created_at
+        ).filter(ExpenseShare.open_count > 0, *criteria).all()
+
+    @staticmethod
+    def pending_debts(*criteria):
+        """
+        Cotas pendentes dos vetores filtrados por criteria como [(DebtSnapshot, group_id)],
+        com a chave da cota no lugar do id da dívida.
+        """
+        users_by_group = {}
+        pending = []
+        for share in ShareVectorService.open_shares(*criteria):
+            if share.group_id not in users_by_group:
+                users_by_group[share.group_id] = ShareVectorService._position_users(share.group_id)
+            users = users_by_group[share.group_id]
+
+            for position, amount in ShareVectorService.pending_amounts(share):
+                pending.append((DebtSnapshot(
+                    ShareVectorService.share_key(share.id, position), users[position], share.creditor_id,
+                    amount, 'group_debt', share.created_at, share.expense_id, share.group_id
+                ), share.group_id))
+        return pending
+
+    @staticmethod
+    def snapshot_dict(debt, expense_description=None):
+        """Cota pendente de pending_debts no formato de Debt.to_dict (id = chave da cota)"""
+        return {
+            'id': debt.id,
+            'expense_id': debt.expense_id,
+            'group_id': debt.group_id,
+            'debtor_id': debt.debtor_id,
+            'debtor_name': RequestMemo.user_name(debt.debtor_id),
+            'creditor_id': debt.creditor_id,
+            'creditor_name': RequestMemo.user_name(debt.creditor_id),
+            'amount': debt.amount,
+            'status': 'pending',
+            'source': debt.source,
+            'due_date': None,
+            'paid_at': None,
+            'sold_at': None,
+            'created_at': debt.created_at.isoformat() if debt.created_at else None,
+            'expense_description': expense_description
+        }
+
+    @staticmethod
+    def debtor_ids(share):
+        """Devedores de um vetor (pendentes ou não)"""
+        users = ShareVectorService._position_users(share.group_id)
+        participants = ShareVectorService.decode_bitmap(share.participants)
+        return [users[position] for position in ShareVectorService.bit_positions(participants)]
+
+    @staticmethod
+    def share_key(share_id, position):
+        return f'{share_id}{SHARE_KEY_SEPARATOR}{position}'
+
+    @staticmethod
+    def is_share_key(debt_id):
+        return SHARE_KEY_SEPARATOR in debt_id
+
+    @staticmethod
+    def split_keys(debt_ids):
+        """Separa ids de dívidas gravadas e chaves de cotas em vetor"""
+        debt_ids = list(debt_ids)
+        return (
+            [debt_id for debt_id in debt_ids if not ShareVectorService.is_share_key(debt_id)],
+            [debt_id for debt_id in debt_ids if ShareVectorService.is_share_key(debt_id)]
+        )
+
+    @staticmethod
+    def user_pending_debts(debtor_id=None, creditor_id=None):
+        """
+        Cotas pendentes em vetor em que o usuário é devedor e/ou credor, como PendingShare
+        (somente leitura: as listagens não tiram cotas do vetor).
+        """
+        return [
+            PendingShare(debt) for debt in ShareVectorService._user_snapshots(debtor_id, creditor_id)
+        ]
+
+    @staticmethod
+    def find_debt(debt_id):
+        """Dívida gravada ou, para uma chave de cota, a cota pendente como PendingShare (None se não houver)"""
+        if not ShareVectorService.is_share_key(debt_id):
+            return Debt.query.get(debt_id)
+
+        try:
+            share_id, position = ShareVectorService._parse_share_key(debt_id)
+        except ValueError:
+            return None
+        shares = ShareVectorService.open_shares(ExpenseShare.id == share_id)
+        if not shares:
+            return None
+        share = shares[0]
+        amount = ShareVectorService._position_amount(share, position)
+        user_id = ShareVectorService._position_users(share.group_id).get(position)
+        if amount is None or user_id is None:
+            return None
+        return PendingShare(DebtSnapshot(
+            debt_id, user_id, share.creditor_id, amount, 'group_debt',
+            share.created_at, share.expense_id, share.group_id
+        ))
+
+    @staticmethod
+    def materialize_debt(debt):
+        """
+        Grava como dívida a cota de um PendingShare (só a posição dele, sem commit) para que
+        possa ser paga ou vendida; dívidas já gravadas voltam como estão. None se outro
+        processo tirou a cota do vetor no meio tempo.
+        """
+        if not isinstance(debt, PendingShare):
+            return debt
+        share_id, position = ShareVectorService._parse_share_key(debt.id)
+        debts = ShareVectorService.materialize({share_id: {position}})
+        if not debts:
+            return None
+        db.session.flush()
+        return debts[0]
+
+    @staticmethod
+    def materialize_between(creditor_id, debtor_id):
+        """Grava como dívidas as cotas pendentes em vetor do devedor com o credor (sem commit)"""
+        positions_by_share = defaultdict(set)
+        for debt in ShareVectorService._user_snapshots(debtor_id, creditor_id):
+            share_id, position = ShareVectorService._parse_share_key(debt.id)
+            positions_by_share[share_id].add(position)
+        return ShareVectorService.materialize(positions_by_share) if positions_by_share else []
+
+    @staticmethod
+    def _user_snapshots(debtor_id=None, creditor_id=None):
+        """DebtSnapshots das cotas pendentes em vetor filtradas por devedor e/ou credor"""
+        if debtor_id is None:
+            return [debt for debt, _ in ShareVectorService.pending_debts(ExpenseShare.creditor_id == creditor_id)]
+
+        # Como devedor só interessa a própria posição em cada grupo, sem decodificar o vetor inteiro
+        own_positions = dict(
+            db.session.query(GroupMember.group_id, GroupMember.position)
+            .filter(GroupMember.user_id == debtor_id, GroupMember.position.isnot(None)).all()
+        )
+        if not own_positions:
+            return []
+        criteria = [ExpenseShare.group_id.in_(list(own_positions))]
+        if creditor_id is not None:
+            criteria.append(ExpenseShare.creditor_id == creditor_id)
+
+        snapshots = []
+        for share in ShareVectorService.open_shares(*criteria):
+            position = own_positions[share.group_id]
+            amount = ShareVectorService._position_amount(share, position)
+            if amount is not None:
+                snapshots.append(DebtSnapshot(
+                    ShareVectorService.share_key(share.id, position), debtor_id, share.creditor_id,
+                    amount, 'group_debt', share.created_at, share.expense_id, share.group_id
+                ))
+        return snapshots
+
+    @staticmethod
+    def _position_amount(share, position):
+        """Valor da cota pendente da posição no vetor (None se não participa ou já saiu)"""
+        participants = ShareVectorService.decode_bitmap(share.participants)
+        if position < 0 or not participants >> position & 1:
+            return None
+        if ShareVectorService.decode_bitmap(share.closed) >> position & 1:
+            return None
+        if not share.weights:
+            return share.unit_amount
+
+        index = bin(participants & ((1 << position) - 1)).count('1')
+        count = bin(participants).count('1')
+        weight = struct.unpack(f'<{count}I', share.weights)[index]
+        return round(share.unit_amount * weight, 2)
+
+    @staticmethod
+    def materialize(positions_by_share, amounts=None):
+        """
+        Tira dos vetores as posições informadas ({id do vetor: posições ou None para todas as
+        pendentes}) e grava uma dívida pendente para cada cota fechada (sem commit).
+        amounts ({chave da cota: valor}) substitui o valor de cotas específicas.
+        """
+        debts = []
+        users_by_group = {}
+        for share, closed in ShareVectorService.close(positions_by_share):
+            if share.group_id not in users_by_group:
+                users_by_group[share.group_id] = ShareVectorService._position_users(share.group_id)
+            users = users_by_group[share.group_id]
+
+            for position, amount in closed:
+                key = ShareVectorService.share_key(share.id, position)
+                debts.append(Debt(
+                    id=str(uuid.uuid4()),
+                    expense_id=share.expense_id,
+                    group_id=share.group_id,
+                    debtor_id=users[position],
+                    creditor_id=share.creditor_id,
+                    amount=amounts.get(key, amount) if amounts else amount,
+                    split_amount=amount,
+                    status='pending',
+                    source='group_debt',
+                    created_at=share.created_at
+                ))
+
+        db.session.add_all(debts)
+        return debts
+
+    @staticmethod
+    def close(positions_by_share):
+        """
+        Fecha posições dos vetores ({id do vetor: posições ou None para todas}) com um UPDATE
+        condicional ao bitmap lido: se outro processo fechou posições no meio tempo, relê e
+        tenta de novo, então cada cota sai do vetor uma única vez (sem commit).
+        Retorna [(vetor, [(posição, valor)])] com as cotas efetivamente fechadas.
+        """
+        closed_shares = []
+        pending = dict(positions_by_share)
+
+        for _ in range(CLOSE_RETRIES):
+            if not pending:
+                break
+            conflicts = {}
+            for share in ShareVectorService.open_shares(ExpenseShare.id.in_(list(pending))):
+                wanted = pending[share.id]
+                closing = [
+                    (position, amount) for position, amount in ShareVectorService.pending_amounts(share)
+                    if wanted is None or position in wanted
+                ]
+                if not closing:
+                    continue
+
+                bitmap = ShareVectorService.decode_bitmap(share.closed)
+                for position, _ in closing:
+                    bitmap |= 1 << position
+
+                updated = db.session.execute(
+                    db.update(ExpenseShare)
+                    .where(ExpenseShare.id == share.id, ExpenseShare.closed == share.closed)
+                    .values(
+                        closed=ShareVectorService._to_bytes(bitmap),
+                        open_count=ExpenseShare.open_count - len(closing)
+                    ),
+                    execution_options={'synchronize_session': False}
+                ).rowcount
+                if updated:
+                    closed_shares.append((share, closing))
+                else:
+                    conflicts[share.id] = wanted
+            pending = conflicts
+
+        if pending:
+            logger.warning("Vetores de cotas alterados concorrentemente; posições não fechadas: %s", list(pending))
+        return closed_shares
+
+    @staticmethod
+    def apply_optimization(cancelled_keys, adjusted):
+        """
+        Aplica às cotas em vetor as decisões da otimização (sem commit): as canceladas só saem
+        do vetor e as reduzidas viram dívidas com o novo valor ({chave da cota: valor}).
+        """
+        cancelled = defaultdict(set)
+        for key in cancelled_keys:
+            share_id, position = ShareVectorService._parse_share_key(key)
+            cancelled[share_id].add(position)
+
+        reduced = defaultdict(set)
+        for key in adjusted:
+            share_id, position = ShareVectorService._parse_share_key(key)
+            reduced[share_id].add(position)
+
+        closed = sum(len(positions) for _, positions in ShareVectorService.close(cancelled)) if cancelled else 0
+        created = ShareVectorService.materialize(reduced, amounts=adjusted) if reduced else []
+
+        expected = len(cancelled_keys) + len(adjusted)
+        if closed + len(created) < expected:
+            logger.warning("Otimização aplicada a %s de %s cotas em vetor (as demais já tinham sido materializadas)",
+                           closed + len(created), expected)
+        return closed + len(created)
+
+    @staticmethod
+    def _parse_share_key(key):
+        share_id, position = key.rsplit(SHARE_KEY_SEPARATOR, 1)
+        return share_id, int(position)
+
+    @staticmethod
+    def _position_users(group_id):
+        """{posição: user_id} dos membros do grupo"""
+        return {
+            position: user_id for user_id, position in
+            db.session.query(GroupMember.user_id, GroupMember.position)
+            .filter(GroupMember.group_id == group_id, GroupMember.position.isnot(None)).all()
+        }
+
+    @staticmethod
+    def _to_bytes(bitmap):
+        return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+
+class PendingShare:
+    """
+    Cota pendente em vetor vista como dívida nas listagens: expõe os campos e relações de Debt
+    lidos pelas rotas, com a chave da cota como id. Não é gravada; para pagar ou vender use
+    ShareVectorService.materialize_debt.
+    """
+
+    status = 'pending'
+    due_date = None
+    paid_at = None
+    sold_at = None
+
+    def __init__(self, snapshot):
+        self.id = snapshot.id
+        self.expense_id = snapshot.expense_id
+        self.group_id = snapshot.group_id
+        self.debtor_id = snapshot.debtor_id
+        self.creditor_id = snapshot.creditor_id
+        self.amount = snapshot.amount
+        self.split_amount = snapshot.amount
+        self.source = snapshot.source
+        self.created_at = snapshot.created_at
+
+    @property
+    def debtor(self):
+        return RequestMemo.get_user(self.debtor_id)
+
+    @property
+    def creditor(self):
+        return RequestMemo.get_user(self.creditor_id)
+
+    @property
+    def expense(self):
+        from app.models.expense import Expense
+
+        return RequestMemo.get('expenses', self.expense_id, lambda: db.session.get(Expense, self.expense_id))
+
+    @property
+    def description(self):
+        return self.expense.description if self.expense else None
+
+    def to_dict(self):
+        return ShareVectorService.snapshot_dict(self, self.description)
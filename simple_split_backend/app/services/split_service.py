@@ -0,0 +1,196 @@
+from app import db
+from app.models.debt import Debt
+from app.models.expense import Expense
+from app.models.expense_share import ExpenseShare
+from app.services.settlement_service import SettlementService
+from app.services.share_vector_service import ShareVectorService
+from collections import defaultdict
+from datetime import datetime
+import uuid
+
+# Tipos de divisão: igual (padrão), por pesos, por valores exatos ou por percentuais
+SPLIT_TYPES = ('equal', 'weighted', 'exact', 'percentage')
+
+# Pesos e percentuais viram inteiros com esta escala (até 3 casas decimais nos pesos, 2 nos percentuais)
+WEIGHT_SCALE = 1000
+PERCENT_SCALE = 100
+
+
+class SplitError(ValueError):
+    """Divisão inválida (tipo desconhecido, partes que não fecham o valor da despesa...)"""
+
+
+class SplitService:
+    """
+    Divisão de despesas em centavos inteiros. Partes por peso e por percentual são
+    arredondadas para baixo e os centavos que sobram vão para as maiores frações (método
+    do maior resto), então as partes sempre somam exatamente o valor da despesa.
+    split_rows calcula as divisões de várias despesas em uma passada e devolve as linhas
+    de dívidas e vetores de cotas prontas para INSERT em massa.
+    """
+
+    @staticmethod
+    def allocate(total_cents, weights):
+        """Distribui total_cents proporcionalmente aos pesos inteiros (empates: ordem dos pesos)"""
+        weight_sum = sum(weights)
+        if weight_sum <= 0:
+            raise SplitError('A soma das partes deve ser positiva')
+
+        parts = []
+        remainders = []
+        for index, weight in enumerate(weights):
+            part, remainder = divmod(total_cents * weight, weight_sum)
+            parts.append(part)
+            remainders.append((-remainder, index))
+
+        for _, index in sorted(remainders)[:total_cents - sum(parts)]:
+            parts[index] += 1
+        return parts
+
+    @staticmethod
+    def participant_cents(amount, split_type, shares):
+        """
+        Parte de cada participante em centavos ([(user_id, centavos)], na ordem de shares).
+        shares ({user_id: valor}) traz pesos, valores em reais ou percentuais conforme split_type.
+        Levanta SplitError.
+        """
+        if split_type not in SPLIT_TYPES or split_type == 'equal':
+            raise SplitError(f"split_type deve ser um de: {', '.join(SPLIT_TYPES)}")
+        if not isinstance(shares, dict) or not shares:
+            raise SplitError('shares é obrigatório para divisões que não são iguais')
+
+        user_ids = list(shares)
+        values = []
+        for user_id in user_ids:
+            value = shares[user_id]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise SplitError('Os valores de shares devem ser números não negativos')
+            values.append(value)
+
+        total_cents = SettlementService.to_cents(amount)
+
+        if split_type == 'exact':
+            cents = [SettlementService.to_cents(value) for value in values]
+            if sum(cents) != total_cents:
+                raise SplitError(f'Os valores de shares somam {sum(cents) / 100:.2f}, mas a despesa é de {total_cents / 100:.2f}')
+        elif split_type == 'percentage':
+            points = [int(round(value * PERCENT_SCALE)) for value in values]
+            if sum(points) != 100 * PERCENT_SCALE:
+                raise SplitError('Os percentuais de shares devem somar 100')
+            cents = SplitService.allocate(total_cents, points)
+        else:
+            cents = SplitService.allocate(total_cents, [int(round(value * WEIGHT_SCALE)) for value in values])
+
+        return list(zip(user_ids, cents))
+
+    @staticmethod
+    def split_rows(expenses, group_id, positions=None):
+        """
+        Divisões de várias despesas do grupo em uma passada. Cada despesa é um dict com id,
+        payer_id, amount, created_at e member_ids (divisão igual) ou split_type e shares.
+        Retorna (linhas de dívidas, linhas de vetores de cotas, ids dos participantes, partes),
+        onde partes é {expense_id: [(user_id, valor)]} com a parte do pagador primeiro.
+        Levanta SplitError.
+        """
+        debt_rows = []
+        share_rows = []
+        participants = set()
+        parts = {}
+
+        for expense in expenses:
+            payer_id = expense['payer_id']
+            created_at = expense.get('created_at') or datetime.utcnow()
+            participants.add(payer_id)
+            parts[expense['id']] = [(payer_id, expense['amount'])]
+
+            split_type = expense.get('split_type') or 'equal'
+            if split_type == 'equal':
+                # Cota em float: valor / (devedores + 1), o pagador conta como uma cota
+                debtors = [member_id for member_id in expense['member_ids'] if member_id != payer_id]
+                if not debtors:
+                    continue
+                unit_amount = expense['amount'] / (len(debtors) + 1)
+                amounts = [unit_amount] * len(debtors)
+                weights = None
+                payer_amount = unit_amount
+            else:
+                # A parte do próprio pagador não vira dívida; partes zeradas também não
+                debtor_cents = [
+                    (user_id, cents) for user_id, cents in
+                    SplitService.participant_cents(expense['amount'], split_type, expense.get('shares'))
+                    if user_id != payer_id and cents > 0
+                ]
+                if not debtor_cents:
+                    continue
+                debtors = [user_id for user_id, _ in debtor_cents]
+                weights = [cents for _, cents in debtor_cents]
+                amounts = [cents / 100 for cents in weights]
+                unit_amount = 0.01
+                payer_amount = (SettlementService.to_cents(expense['amount']) - sum(weights)) / 100
+            participants.update(debtors)
+            parts[expense['id']] = [(payer_id, payer_amount)] + list(zip(debtors, amounts))
+
+            # Grupos grandes: uma linha com o vetor de cotas no lugar de uma dívida por membro
+            if ShareVectorService.enabled_for(len(debtors)):
+                if positions is None:
+                    positions = ShareVectorService.member_positions(group_id)
+                share_row = ShareVectorService.build_row(
+                    expense['id'], group_id, payer_id, debtors, unit_amount, created_at, positions, weights
+                )
+                if share_row:
+                    share_rows.append(share_row)
+                    continue
+
+            for debtor_id, amount in zip(debtors, amounts):
+                debt_rows.append({
+                    'id': str(uuid.uuid4()),
+                    'expense_id': expense['id'],
+                    'group_id': group_id,
+                    'debtor_id': debtor_id,
+                    'creditor_id': payer_id,
+                    'amount': amount,
+                    'split_amount': amount,
+                    'status': 'pending',
+                    'source': 'group_debt',
+                    'created_at': created_at
+                })
+
+        return debt_rows, share_rows, participants, parts
+
+    @staticmethod
+    def stored_parts(*criteria):
+        """
+        Partes das despesas filtradas reconstruídas do banco ({expense_id: [(user_id, valor)]}):
+        devedores pelo valor original das dívidas da divisão ou pelo vetor de cotas, e o pagador com o restante.
+        """
+        expenses = {
+            expense_id: (payer_id, amount) for expense_id, payer_id, amount in
+            db.session.query(Expense.id, Expense.payer_id, Expense.amount).filter(*criteria).all()
+        }
+        debtors = defaultdict(list)
+
+        # Despesas em vetor: as dívidas com source group_debt são cotas já materializadas
+        shares = ExpenseShare.query.join(Expense, ExpenseShare.expense_id == Expense.id).filter(*criteria).all()
+        for share in shares:
+            debtors[share.expense_id] = ShareVectorService.split_amounts(share)
+
+        debts = db.session.query(Debt.expense_id, Debt.debtor_id, db.func.coalesce(Debt.split_amount, Debt.amount))\
+            .join(Expense, Debt.expense_id == Expense.id)\
+            .outerjoin(ExpenseShare, ExpenseShare.expense_id == Expense.id)\
+            .filter(Debt.source == 'group_debt', ExpenseShare.id.is_(None), *criteria).all()
+        for expense_id, debtor_id, amount in debts:
+            debtors[expense_id].append((debtor_id, amount))
+
+        parts = {}
+        for expense_id, (payer_id, amount) in expenses.items():
+            debtor_parts = debtors.get(expense_id, [])
+            parts[expense_id] = [(payer_id, amount - sum(part for _, part in debtor_parts))] + debtor_parts
+        return parts
+
+    @staticmethod
+    def insert(debt_rows, share_rows):
+        """Grava as linhas de split_rows com INSERTs em massa (sem commit)"""
+        if debt_rows:
+            db.session.execute(db.insert(Debt), debt_rows)
+        if share_rows:
+            db.session.execute(db.insert(ExpenseShare), share_rows)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Benchmark do otimizador de dívidas (LogService) com grafos de dívidas sintéticos.
+
+Gera grupos de 10 a 10.000 membros com grafos esparsos, densos e cíclicos e mede,
+para optimize_debts, _optimize_group_debts e _optimize_cross_group_debts:
+tempo, número de queries e transferências que restam. Compara com um baseline salvo.
+
+Uso:
+    python benchmarks/optimizer_benchmark.py                    # perfil rápido, compara com o baseline
+    python benchmarks/optimizer_benchmark.py --profile full     # inclui grupos de 10.000 membros
+    python benchmarks/optimizer_benchmark.py --save-baseline    # grava os resultados como novo baseline
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCHMARK_DIR))
+
+# Banco temporário e otimização síncrona: o benchmark nunca toca o banco real
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file.name}'
+os.environ['OPTIMIZATION_MODE'] = 'sync'
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models.user import User, GroupMember
+from app.models.group import Group
+from app.models.expense import Expense
+from app.models.debt import Debt
+from app.services.log_service import LogService, OptimizationBatch
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'optimizer_baseline.json')
+
+PROFILES = {
+    'quick': [10, 100, 1000],
+    'full': [10, 100, 1000, 10000]
+}
+
+SHAPES = ('sparse', 'dense', 'cyclic')
+
+# Limite de dívidas por cenário denso (um grafo completo de 10.000 membros teria 10^8 arestas)
+MAX_DENSE_DEBTS = 50000
+
+
+def generate_edges(shape, members, rng):
+    """Gera as arestas (devedor, credor, valor) de um grafo sintético"""
+    edges = []
+
+    if shape == 'sparse':
+        # Cada membro deve para ~2 outros membros
+        for debtor in range(members):
+            for _ in range(2):
+                creditor = rng.randrange(members)
+                if creditor != debtor:
+                    edges.append((debtor, creditor, rng.randint(100, 10000) / 100))
+
+    elif shape == 'dense':
+        pairs = members * (members - 1)
+        if pairs <= MAX_DENSE_DEBTS:
+            candidates = ((d, c) for d in range(members) for c in range(members) if d != c)
+        else:
+            candidates = set()
+            while len(candidates) < MAX_DENSE_DEBTS:
+                debtor, creditor = rng.randrange(members), rng.randrange(members)
+                if debtor != creditor:
+                    candidates.add((debtor, creditor))
+        for debtor, creditor in candidates:
+            edges.append((debtor, creditor, rng.randint(100, 10000) / 100))
+
+    elif shape == 'cyclic':
+        # Anel A -> B -> ... -> A com cordas, cheio de ciclos de tamanhos variados
+        for debtor in range(members):
+            edges.append((debtor, (debtor + 1) % members, rng.randint(100, 10000) / 100))
+        for _ in range(max(1, members // 5)):
+            debtor = rng.randrange(members)
+            creditor = (debtor + rng.randint(2, max(2, members - 1))) % members
+            if creditor != debtor:
+                edges.append((debtor, creditor, rng.randint(100, 10000) / 100))
+
+    return edges
+
+
+def build_scenario(shape, members, seed):
+    """Recria o banco com um grupo sintético e suas dívidas pendentes"""
+    rng = random.Random(f'{seed}-{shape}-{members}')
+    # Ids também derivados da semente (o desempate do solver depende deles), com um gerador
+    # separado para não alterar a sequência das dívidas
+    id_rng = random.Random(f'{seed}-{shape}-{members}-ids')
+
+    def new_id():
+        return str(uuid.UUID(int=id_rng.getrandbits(128)))
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+    user_ids = [new_id() for _ in range(members)]
+    db.session.execute(db.insert(User), [
+        {'id': user_id, 'name': f'Usuário {i}', 'email': f'bench{i}@example.com', 'password_hash': 'x'}
+        for i, user_id in enumerate(user_ids)
+    ])
+
+    group_id = new_id()
+    db.session.execute(db.insert(Group), [{'id': group_id, 'name': f'Bench {shape} {members}', 'created_by': user_ids[0]}])
+    db.session.execute(db.insert(GroupMember), [
+        {'id': new_id(), 'user_id': user_id, 'group_id': group_id} for user_id in user_ids
+    ])
+
+    edges = generate_edges(shape, members, rng)
+
+    # Uma despesa a cada 50 dívidas, como origem das dívidas do grupo
+    expense_ids = []
+    expenses = []
+    for start in range(0, len(edges), 50):
+        expense_id = new_id()
+        expense_ids.append(expense_id)
+        expenses.append({
+            'id': expense_id,
+            'group_id': group_id,
+            'payer_id': user_ids[edges[start][1]],
+            'description': 'Despesa sintética',
+            'amount': sum(amount for _, _, amount in edges[start:start + 50])
+        })
+    db.session.execute(db.insert(Expense), expenses)
+
+    created_at = datetime.utcnow() - timedelta(days=1)
+    db.session.execute(db.insert(Debt), [
+        {
+            'id': new_id(),
+            'expense_id': expense_ids[i // 50],
+            'group_id': group_id,
+            'debtor_id': user_ids[debtor],
+            'creditor_id': user_ids[creditor],
+            'amount': amount,
+            'status': 'pending',
+            'source': 'group_debt',
+            'created_at': created_at + timedelta(seconds=i)
+        }
+        for i, (debtor, creditor, amount) in enumerate(edges)
+    ])
+    db.session.commit()
+
+    return group_id, len(edges)
+
+
+def run_optimize_debts(group_id):
+    return LogService.optimize_debts()
+
+
+def run_group_debts(group_id):
+    debts = Debt.get_pending_debts().filter(Debt.group_id == group_id).all()
+    batch = OptimizationBatch()
+    LogService._optimize_group_debts(debts, group_id, batch)
+    return batch.apply()
+
+
+def run_cross_group_debts(group_id):
+    debts = Debt.get_pending_debts().all()
+    batch = OptimizationBatch()
+    LogService._optimize_cross_group_debts(debts, batch)
+    return batch.apply()
+
+
+TARGETS = {
+    'optimize_debts': run_optimize_debts,
+    '_optimize_group_debts': run_group_debts,
+    '_optimize_cross_group_debts': run_cross_group_debts
+}
+
+
+def remaining_transfers():
+    """Pares (devedor, credor) distintos que ainda têm dívida pendente"""
+    return db.session.query(Debt.debtor_id, Debt.creditor_id)\
+        .filter(Debt.status == 'pending').distinct().count()
+
+
+def run_benchmark(sizes, seed):
+    results = {}
+    query_counter = {'count': 0}
+
+    def count_query(*args):
+        query_counter['count'] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    try:
+        for target_name, target in TARGETS.items():
+            for shape in SHAPES:
+                for members in sizes:
+                    group_id, debts = build_scenario(shape, members, seed)
+                    transfers_before = remaining_transfers()
+                    db.session.remove()
+
+                    query_counter['count'] = 0
+                    started = time.perf_counter()
+                    optimized = target(group_id)
+                    runtime_ms = (time.perf_counter() - started) * 1000
+                    queries = query_counter['count']
+
+                    key = f'{target_name}/{shape}/{members}'
+                    results[key] = {
+                        'debts': debts,
+                        'runtime_ms': round(runtime_ms, 2),
+                        'queries': queries,
+                        'optimized': optimized,
+                        'transfers_before': transfers_before,
+                        'transfers_remaining': remaining_transfers()
+                    }
+                    print(
+                        f'{key:<50} {debts:>7} dívidas  {runtime_ms:>10.1f} ms  '
+                        f'{queries:>4} queries  {transfers_before:>6} -> {results[key]["transfers_remaining"]:<6} transferências'
+                    )
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_query)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compara com o baseline; retorna a lista de regressões encontradas"""
+    regressions = []
+
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+
+        if current['runtime_ms'] > previous['runtime_ms'] * (1 + tolerance) and current['runtime_ms'] - previous['runtime_ms'] > 5:
+            regressions.append(f"{key}: tempo {previous['runtime_ms']:.1f} -> {current['runtime_ms']:.1f} ms")
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{key}: queries {previous['queries']} -> {current['queries']}")
+        if current['transfers_remaining'] > previous['transfers_remaining']:
+            regressions.append(
+                f"{key}: transferências restantes {previous['transfers_remaining']} -> {current['transfers_remaining']}"
+            )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do otimizador de dívidas')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Grava os resultados como novo baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Aumento de tempo tolerado (0.25 = 25%%)')
+    parser.add_argument('--output', help='Arquivo JSON para gravar os resultados desta execução')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        results = run_benchmark(PROFILES[args.profile], args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'\nBaseline gravado em {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('\nNenhum baseline encontrado; rode com --save-baseline para criar um.')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('\nRegressões em relação ao baseline:')
+        for regression in regressions:
+            print(f'  - {regression}')
+        return 1
+
+    print('\nSem regressões em relação ao baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    finally:
+        os.unlink(_db_file.name)
@@ -6,6 +6,11 @@ from app.models.debt import Debt
 from app.models.log import Log
 from app.models.receivable import Receivable
 from app.models.wallet import Wallet
+from app.models.optimization_job import OptimizationJob
+from app.models.group_balance import GroupBalance
+from app.models.change_counter import ChangeCounter
+from app.models.expense_share import ExpenseShare
+from app.models.expense_rollup import ExpenseRollup
 from app.services.init_data import initialize_data
 
 app = create_app()
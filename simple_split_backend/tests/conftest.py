@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# Permitir 'import app' rodando o pytest a partir de simple_split_backend ou da raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """Aplicação com banco SQLite temporário, otimização síncrona e cache só em memória"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    os.environ['OPTIMIZATION_MODE'] = 'sync'
+    os.environ['CACHE_BACKEND'] = 'memory'
+    os.environ['LOG_LEVEL'] = 'WARNING'
+
+    from app import create_app
+    return create_app()
+
+
+@pytest.fixture
+def db(app):
+    """Sessão dentro de um contexto da aplicação; as tabelas são recriadas ao fim de cada teste"""
+    from app import db as database
+
+    with app.app_context():
+        yield database
+        database.session.remove()
+        database.drop_all()
+        database.create_all()
@@ -0,0 +1,73 @@
+import pytest
+
+from app.services.expense_import_service import ExpenseImportService, ExpenseImportError
+
+MEMBERS = ['u1', 'u2']
+
+
+def _validate(*rows):
+    return ExpenseImportService._validate(list(rows), 'u1', MEMBERS, set(MEMBERS), {})
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('1.234,56', 1234.56),
+    ('1,234.56', 1234.56),
+    ('1.234.567,89', 1234567.89),
+    ('1,234,567.89', 1234567.89),
+    ('12,5', 12.5),
+    (' 42.10 ', 42.1),
+    (10, 10.0),
+    (7.25, 7.25),
+])
+def test_parse_amount_accepts_thousands_separators(value, expected):
+    assert ExpenseImportService._parse_amount(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    'nan', 'NaN', 'inf', '-inf', 'Infinity', float('nan'), float('inf'),
+    '', None, 'abc', '1,2,3', True,
+])
+def test_parse_amount_rejects_non_numbers(value):
+    assert ExpenseImportService._parse_amount(value) is None
+
+
+def test_validate_normalizes_amounts():
+    expenses = _validate(
+        {'description': 'Mercado', 'amount': '1.234,50'},
+        {'description': 'Jantar', 'amount': 80}
+    )
+
+    assert [expense['amount'] for expense in expenses] == [1234.5, 80.0]
+    assert expenses[0]['payer_id'] == 'u1'
+    assert expenses[0]['member_ids'] == MEMBERS
+
+
+@pytest.mark.parametrize('amount', ['10.005', '0,001', 1.999])
+def test_validate_rejects_more_than_two_decimals(amount):
+    with pytest.raises(ExpenseImportError) as error:
+        _validate({'description': 'x', 'amount': amount})
+
+    assert error.value.errors == ['Linha 1: amount deve ter no máximo 2 casas decimais']
+
+
+@pytest.mark.parametrize('amount', ['nan', 'inf', '0', '-5', 'dez'])
+def test_validate_rejects_non_positive_or_non_finite(amount):
+    with pytest.raises(ExpenseImportError) as error:
+        _validate({'description': 'x', 'amount': amount})
+
+    assert error.value.errors == ['Linha 1: amount deve ser um número positivo']
+
+
+def test_validate_reports_every_bad_row():
+    with pytest.raises(ExpenseImportError) as error:
+        _validate(
+            {'description': 'ok', 'amount': '10'},
+            {'description': '', 'amount': 'inf'},
+            {'description': 'y', 'amount': '3.333'}
+        )
+
+    assert error.value.errors == [
+        'Linha 2: description é obrigatório',
+        'Linha 2: amount deve ser um número positivo',
+        'Linha 3: amount deve ter no máximo 2 casas decimais'
+    ]
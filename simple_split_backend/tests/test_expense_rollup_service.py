@@ -0,0 +1,117 @@
+from datetime import date
+
+import pytest
+
+from app.models.expense import Expense
+from app.models.expense_rollup import ExpenseRollup
+from app.models.expense_share import ExpenseShare
+from app.models.group import Group
+from app.models.user import User
+from app.services.expense_rollup_service import ExpenseRollupService
+
+
+def _group(db, size):
+    users = [User(name=f'U{i}', email=f'u{i}@example.com', password_hash='x') for i in range(size)]
+    db.session.add_all(users)
+    db.session.commit()
+    group = Group(name='Viagem', created_by=users[0].id)
+    db.session.add(group)
+    db.session.commit()
+    for user in users:
+        group.add_member(user.id)
+    return group, [user.id for user in users]
+
+
+def _expense(db, group, payer_id, amount, day=date(2026, 1, 15), **split):
+    expense = Expense(group_id=group.id, payer_id=payer_id, description='Despesa', amount=amount, date=day)
+    db.session.add(expense)
+    db.session.flush()
+    expense.split_expense(**split)
+    return expense
+
+
+def _rollups():
+    """{(usuário, grupo, mês): (pago, despesas pagas, parte)} sem as linhas zeradas"""
+    return {
+        (row.user_id, row.group_id, row.month): (row.paid_cents, row.paid_count, row.spent_cents)
+        for row in ExpenseRollup.query.all()
+        if row.paid_cents or row.paid_count or row.spent_cents
+    }
+
+
+def _rebuilt(db):
+    ExpenseRollupService.rebuild()
+    db.session.commit()
+    return _rollups()
+
+
+def _mixed_expenses(db, group, user_ids):
+    a, b, c, d = user_ids[:4]
+    return [
+        _expense(db, group, a, 100.0),
+        _expense(db, group, b, 10.01, member_ids=[a, b, c]),
+        _expense(db, group, c, 99.99, split_type='weighted', shares={a: 1, b: 2, d: 3}),
+        _expense(db, group, d, 50.0, split_type='exact', shares={a: 12.34, c: 37.66}),
+        _expense(db, group, a, 33.33, day=date(2026, 2, 3), split_type='percentage', shares={b: 33.33, c: 33.33, d: 33.34}),
+    ]
+
+
+def test_part_cents_sum_to_the_expense():
+    third = 100.0 / 3
+    expense = {'payer_id': 'p', 'amount': 100.0}
+
+    parts = ExpenseRollupService.part_cents(expense, [('p', third), ('b', third), ('a', third)])
+
+    assert parts == [('p', 3334), ('a', 3333), ('b', 3333)]
+
+
+def test_record_matches_rebuild(db):
+    group, user_ids = _group(db, 4)
+    expenses = _mixed_expenses(db, group, user_ids)
+    recorded = _rollups()
+
+    assert recorded == _rebuilt(db)
+    assert sum(spent for _, _, spent in recorded.values()) == sum(round(e.amount * 100) for e in expenses)
+    assert sum(count for _, count, _ in recorded.values()) == len(expenses)
+
+
+def test_remove_expense_matches_rebuild(db):
+    group, user_ids = _group(db, 4)
+    expenses = _mixed_expenses(db, group, user_ids)
+
+    for expense in (expenses[0], expenses[2]):
+        ExpenseRollupService.remove_expense(expense)
+        db.session.delete(expense)
+        db.session.commit()
+    recorded = _rollups()
+
+    assert recorded == _rebuilt(db)
+    assert sum(spent for _, _, spent in recorded.values()) == sum(
+        round(e.amount * 100) for e in (expenses[1], expenses[3], expenses[4])
+    )
+
+
+def test_share_vectors_match_rebuild(db, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SHARE_VECTOR_MIN_MEMBERS', 2)
+    group, user_ids = _group(db, 5)
+    expenses = _mixed_expenses(db, group, user_ids)
+    assert ExpenseShare.query.count() > 0
+
+    assert _rollups() == _rebuilt(db)
+
+    ExpenseRollupService.remove_expense(expenses[0])
+    db.session.delete(expenses[0])
+    db.session.commit()
+
+    assert _rollups() == _rebuilt(db)
+
+
+@pytest.mark.parametrize('size', [3, 7])
+def test_totals_match_the_expenses(db, size):
+    group, user_ids = _group(db, size)
+    _expense(db, group, user_ids[0], 100.0)
+    _expense(db, group, user_ids[1], 0.05)
+
+    paid, paid_count, spent = ExpenseRollupService.totals(ExpenseRollup.group_id == group.id)
+
+    assert (paid, paid_count, spent) == (100.05, 2, 100.05)
@@ -0,0 +1,153 @@
+import random
+from collections import defaultdict
+
+from app.services.settlement_service import SettlementService, DebtSnapshot
+
+
+def _debt(debtor_id, creditor_id, amount):
+    return DebtSnapshot(f'{debtor_id}-{creditor_id}', debtor_id, creditor_id, amount, 'group_debt', None, None)
+
+
+def _apply(balances, plan):
+    """Saldos que sobram depois de executar as transferências do plano"""
+    remaining = dict(balances)
+    for transfer in plan:
+        cents = SettlementService.to_cents(transfer['amount'])
+        remaining[transfer['debtor_id']] += cents
+        remaining[transfer['creditor_id']] -= cents
+    return remaining
+
+
+def test_settle_clears_every_balance():
+    balances = {'a': -5000, 'b': -2500, 'c': 4000, 'd': 3500}
+
+    plan = SettlementService.settle(balances)
+
+    assert all(cents == 0 for cents in _apply(balances, plan).values())
+    assert all(transfer['amount'] > 0 for transfer in plan)
+
+
+def test_settle_uses_at_most_n_minus_one_transfers():
+    rng = random.Random(7)
+    for _ in range(50):
+        users = [f'u{i}' for i in range(rng.randint(2, 30))]
+        balances = {user_id: rng.randint(-10000, 10000) for user_id in users[:-1]}
+        balances[users[-1]] = -sum(balances.values())
+
+        plan = SettlementService.settle(balances)
+
+        nonzero = len([cents for cents in balances.values() if cents])
+        assert len(plan) <= max(nonzero - 1, 0)
+        assert all(cents == 0 for cents in _apply(balances, plan).values())
+
+
+def test_settle_ignores_zero_balances():
+    assert SettlementService.settle({}) == []
+    assert SettlementService.settle({'a': 0, 'b': 0}) == []
+    assert SettlementService.settle({'a': -100, 'b': 100, 'c': 0}) == [
+        {'debtor_id': 'a', 'creditor_id': 'b', 'amount': 1.0}
+    ]
+
+
+def test_build_plan_collapses_a_chain_into_one_transfer():
+    debts = [_debt('a', 'b', 10.0), _debt('b', 'c', 10.0)]
+
+    assert SettlementService.build_plan(debts) == [{'debtor_id': 'a', 'creditor_id': 'c', 'amount': 10.0}]
+
+
+def test_net_balances_work_in_cents():
+    debts = [_debt('a', 'b', 0.1), _debt('a', 'b', 0.2), _debt('b', 'a', 0.3)]
+
+    balances = SettlementService.net_balances(debts)
+
+    assert balances['a'] == 0
+    assert balances['b'] == 0
+
+
+def test_reorganize_keeps_pairs_that_match_the_plan():
+    debts = [_debt('a', 'b', 10.0), _debt('b', 'c', 10.0), _debt('d', 'c', 5.0)]
+
+    cancelled, new_transfers = SettlementService.reorganize(
+        debts, SettlementService.net_balances(debts), SettlementService.pair_totals(debts)
+    )
+
+    assert {debt.id for debt in cancelled} == {'a-b', 'b-c'}
+    assert new_transfers == [{'debtor_id': 'a', 'creditor_id': 'c', 'amount': 10.0}]
+
+
+def test_reorganize_returns_none_when_nothing_improves():
+    debts = [_debt('a', 'b', 10.0), _debt('c', 'd', 5.0)]
+
+    assert SettlementService.reorganize(
+        debts, SettlementService.net_balances(debts), SettlementService.pair_totals(debts)
+    ) is None
+
+
+def _graph(edges):
+    graph = defaultdict(dict)
+    for debtor_id, creditor_id, cents in edges:
+        graph[debtor_id][creditor_id] = cents
+    return graph
+
+
+def _graph_balances(graph):
+    balances = defaultdict(int)
+    for debtor_id, creditors in graph.items():
+        for creditor_id, cents in creditors.items():
+            balances[debtor_id] -= cents
+            balances[creditor_id] += cents
+    return {user_id: cents for user_id, cents in balances.items() if cents}
+
+
+def _edges(graph):
+    return {(debtor_id, creditor_id): cents for debtor_id, creditors in graph.items()
+            for creditor_id, cents in creditors.items()}
+
+
+def test_cancel_cycles_removes_an_equal_triangle():
+    graph = _graph([('a', 'b', 1000), ('b', 'c', 1000), ('c', 'a', 1000)])
+
+    assert SettlementService.cancel_cycles(graph) == 3000
+    assert _edges(graph) == {}
+
+
+def test_cancel_cycles_subtracts_the_smallest_edge():
+    graph = _graph([('a', 'b', 1000), ('b', 'c', 500), ('c', 'a', 700)])
+
+    assert SettlementService.cancel_cycles(graph) == 1500
+    assert _edges(graph) == {('a', 'b'): 500, ('c', 'a'): 200}
+
+
+def test_cancel_cycles_leaves_acyclic_graphs_alone():
+    edges = [('a', 'b', 1000), ('b', 'c', 500), ('a', 'c', 300)]
+    graph = _graph(edges)
+
+    assert SettlementService.cancel_cycles(graph) == 0
+    assert _edges(graph) == {(debtor_id, creditor_id): cents for debtor_id, creditor_id, cents in edges}
+
+
+def test_cancel_cycles_keeps_balances_and_leaves_no_cycle():
+    rng = random.Random(11)
+    for _ in range(100):
+        users = [f'u{i}' for i in range(rng.randint(2, 12))]
+        edges = {}
+        for _ in range(rng.randint(1, 40)):
+            debtor_id, creditor_id = rng.sample(users, 2)
+            edges[(debtor_id, creditor_id)] = rng.randint(1, 5000)
+        graph = _graph((debtor_id, creditor_id, cents) for (debtor_id, creditor_id), cents in edges.items())
+        before = _graph_balances(graph)
+
+        cancelled = SettlementService.cancel_cycles(graph)
+
+        assert _graph_balances(graph) == before
+        assert sum(edges.values()) - sum(_edges(graph).values()) == cancelled
+        components = SettlementService.strongly_connected_components(
+            {debtor_id: creditors for debtor_id, creditors in graph.items() if creditors}
+        )
+        assert all(len(component) == 1 for component in components)
+
+
+def test_net_pair_graph_offsets_both_directions():
+    debts = [_debt('a', 'b', 10.0), _debt('b', 'a', 4.0), _debt('c', 'a', 1.0)]
+
+    assert _edges(SettlementService.net_pair_graph(debts)) == {('a', 'b'): 600, ('c', 'a'): 100}
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from app.services.split_service import SplitService, SplitError
+
+
+def test_allocate_breaks_ties_by_weight_order():
+    assert SplitService.allocate(100, [1, 1, 1]) == [34, 33, 33]
+    assert SplitService.allocate(200, [1, 1, 1]) == [67, 67, 66]
+
+
+def test_allocate_gives_leftover_cents_to_the_largest_remainders():
+    assert SplitService.allocate(100, [1, 2]) == [33, 67]
+    assert SplitService.allocate(1000, [1, 1, 1, 4]) == [143, 143, 143, 571]
+
+
+def test_allocate_zero_weight_gets_nothing():
+    assert SplitService.allocate(1000, [0, 3, 1]) == [0, 750, 250]
+    assert SplitService.allocate(0, [1, 2]) == [0, 0]
+
+
+def test_allocate_rejects_non_positive_weight_sum():
+    with pytest.raises(SplitError):
+        SplitService.allocate(100, [])
+    with pytest.raises(SplitError):
+        SplitService.allocate(100, [0, 0])
+
+
+def test_allocate_is_exact_and_within_one_cent_of_the_share():
+    rng = random.Random(3)
+    for _ in range(500):
+        total = rng.randint(0, 10 ** 7)
+        weights = [rng.randint(0, 1000) for _ in range(rng.randint(1, 40))]
+        if not sum(weights):
+            weights[0] = 1
+
+        parts = SplitService.allocate(total, weights)
+
+        assert sum(parts) == total
+        for part, weight in zip(parts, weights):
+            exact = total * weight / sum(weights)
+            assert exact - 1 < part < exact + 1
+
+
+def test_participant_cents_weighted_and_percentage():
+    assert SplitService.participant_cents(100, 'weighted', {'a': 1, 'b': 2}) == [('a', 3333), ('b', 6667)]
+    assert SplitService.participant_cents(10, 'percentage', {'a': 33.33, 'b': 66.67}) == [('a', 333), ('b', 667)]
+
+
+def test_participant_cents_exact_must_match_the_amount():
+    assert SplitService.participant_cents(10, 'exact', {'a': 2.5, 'b': 7.5}) == [('a', 250), ('b', 750)]
+    with pytest.raises(SplitError):
+        SplitService.participant_cents(10, 'exact', {'a': 2.5, 'b': 7.49})
+
+
+def test_participant_cents_rejects_invalid_shares():
+    with pytest.raises(SplitError):
+        SplitService.participant_cents(10, 'percentage', {'a': 50, 'b': 40})
+    with pytest.raises(SplitError):
+        SplitService.participant_cents(10, 'weighted', {'a': -1, 'b': 2})
+    with pytest.raises(SplitError):
+        SplitService.participant_cents(10, 'weighted', {})
+    with pytest.raises(SplitError):
+        SplitService.participant_cents(10, 'shares', {'a': 1})